@@ -19,6 +19,47 @@ class BaseConfig:
     DATABASE_USER = os.getenv('DATABASE_USER', 'admin')
     DATABASE_PASS = os.getenv('DATABASE_PASS', 'admin')
     DATABASE_NAME = os.getenv('DATABASE_NAME', 'devops-at-scale')
+    # HTTP session shared by all couchdb requests of a web service worker
+    DATABASE_TIMEOUT = int(os.getenv('DATABASE_TIMEOUT', '30'))
+    DATABASE_RETRY_DELAYS = [0, 1, 3]
+    # Configuration document is cached in memory, invalidated from the couchdb _changes feed
+    CONFIG_CACHE_TTL = int(os.getenv('CONFIG_CACHE_TTL', '300'))
+    CONFIG_CACHE_WATCH = os.getenv('CONFIG_CACHE_WATCH', 'true').lower() == 'true'
+
+    # Background jobs (asynchronous workspace creation/merge)
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+    JOB_RETENTION = int(os.getenv('JOB_RETENTION', '3600'))
+
+    # Concurrent ONTAP snapshot deletions per volume during a purge, 1 deletes snapshots one at a time
+    PURGE_WORKERS = int(os.getenv('PURGE_WORKERS', '8'))
+
+    # Concurrent PVC creations of a batched PVC clone request
+    CLONE_WORKERS = int(os.getenv('CLONE_WORKERS', '8'))
+    # Hosts an asynchronous PVC clone may notify through its callback_url, comma separated.
+    # Defaults to the Jenkins service
+    CALLBACK_HOSTS = [host.strip() for host in
+                      os.getenv('CALLBACK_HOSTS', os.getenv('JENKINS_SERVICE_NAME') or '').split(',') if host.strip()]
+
+    # HTTP session shared by all NSLM requests of a web service worker: connections kept open per NSLM server,
+    # retries of failed connections and of GET requests answered with one of ONTAP_RETRY_STATUS_CODES
+    ONTAP_POOL_SIZE = int(os.getenv('ONTAP_POOL_SIZE', '10'))
+    ONTAP_MAX_RETRIES = int(os.getenv('ONTAP_MAX_RETRIES', '3'))
+    ONTAP_BACKOFF_FACTOR = float(os.getenv('ONTAP_BACKOFF_FACTOR', '0.5'))
+    ONTAP_RETRY_STATUS_CODES = [int(code) for code in os.getenv('ONTAP_RETRY_STATUS_CODES', '502,503,504').split(',')
+                                if code.strip()]
+    # NSLM requests in flight (defaults to ONTAP_POOL_SIZE) and token bucket rate limit, per NSLM server and user
+    ONTAP_MAX_CONCURRENT_REQUESTS = int(os.getenv('ONTAP_MAX_CONCURRENT_REQUESTS', str(ONTAP_POOL_SIZE)))
+    ONTAP_REQUEST_RATE = float(os.getenv('ONTAP_REQUEST_RATE', '20'))
+    ONTAP_REQUEST_BURST = int(os.getenv('ONTAP_REQUEST_BURST', '40'))
+
+    # Concurrent build clone PVC deletions when deleting a pipeline
+    TEARDOWN_WORKERS = int(os.getenv('TEARDOWN_WORKERS', '8'))
+
+    # Purges run in the background at these intervals (seconds, @hourly, @daily or @weekly) per purge type,
+    # e.g. 'ci=@hourly,scm=43200,workspace=@daily', no purge is scheduled if empty.
+    # A replica holding the purge lock longer than PURGE_LOCK_TTL seconds is considered gone
+    PURGE_SCHEDULE = os.getenv('PURGE_SCHEDULE', '')
+    PURGE_LOCK_TTL = int(os.getenv('PURGE_LOCK_TTL', '7200'))
 
     # The following values are set during Helm deployment
 
@@ -48,6 +89,14 @@ class BaseConfig:
     KUBE_NAMESPACE = os.getenv('KUBE_NAMESPACE')
     STORAGE_CLASS = os.getenv('STORAGE_CLASS')
     SERVICE_TYPE = os.getenv('SERVICE_TYPE')
+    # Serve PVC/PV/Service/Pod/Node reads from an in-process list-watch cache.
+    # Seconds the cache may lag behind the API server, unset or 0 disables the cache
+    KUBE_CACHE_STALENESS = int(os.getenv('KUBE_CACHE_STALENESS', '0'))
+    # Node exposing NodePort services: first, round-robin or label (first node matching KUBE_NODE_SELECTOR).
+    # Only Ready worker nodes are used, their addresses are cached for KUBE_NODE_CACHE_TTL seconds
+    KUBE_NODE_STRATEGY = os.getenv('KUBE_NODE_STRATEGY', 'first')
+    KUBE_NODE_SELECTOR = os.getenv('KUBE_NODE_SELECTOR')
+    KUBE_NODE_CACHE_TTL = int(os.getenv('KUBE_NODE_CACHE_TTL', '60'))
 
 
 class TestingConfig(BaseConfig):
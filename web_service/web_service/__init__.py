@@ -20,6 +20,35 @@ def create_app():
     app.register_blueprint(backend_blueprint)
     app.register_blueprint(frontend_blueprint)
 
+    # One couchdb connection pool per worker, shared by all request threads
+    import web_service.database.database as Database
+    app.extensions['couchdb'] = Database.ConnectionPool(timeout=app.config.get('DATABASE_TIMEOUT'),
+                                                        retry_delays=app.config.get('DATABASE_RETRY_DELAYS'))
+    app.extensions['config_cache'] = Database.DocumentCache('configuration',
+                                                            ttl=app.config.get('CONFIG_CACHE_TTL', 300))
+
+    # NSLM sessions use the pool size, retry policy and request limits of the config
+    from web_service.ontap.ontap_apis.ontap_apis import APIServer
+    APIServer.configure(pool_size=app.config.get('ONTAP_POOL_SIZE'), retries=app.config.get('ONTAP_MAX_RETRIES'),
+                        backoff_factor=app.config.get('ONTAP_BACKOFF_FACTOR'),
+                        retry_status_codes=app.config.get('ONTAP_RETRY_STATUS_CODES'),
+                        max_concurrent_requests=app.config.get('ONTAP_MAX_CONCURRENT_REQUESTS'),
+                        request_rate=app.config.get('ONTAP_REQUEST_RATE'),
+                        request_burst=app.config.get('ONTAP_REQUEST_BURST'))
+
+    # Long running operations (e.g. workspace provisioning) run as background jobs
+    from web_service.helpers.jobs import JobManager
+    app.extensions['jobs'] = JobManager(workers=app.config.get('JOB_WORKERS', 4),
+                                        retention=app.config.get('JOB_RETENTION', 3600))
+
+    # Scheduled purges, a lock document in DB ensures a single replica runs each purge
+    from web_service.helpers.scheduler import PurgeScheduler, parse_schedule
+    purge_intervals = parse_schedule(app.config.get('PURGE_SCHEDULE'))
+    if purge_intervals:
+        app.extensions['purge_scheduler'] = PurgeScheduler(app, purge_intervals,
+                                                           lock_ttl=app.config.get('PURGE_LOCK_TTL', 7200))
+        app.extensions['purge_scheduler'].start()
+
     # Setup swagger documentation for our app
     app.config['SWAGGER'] = {
         'title': 'DevOps@Scale API',
@@ -2,9 +2,15 @@
 import json
 import os
 import sys
+import threading
+import time
 import unittest
 from unittest.mock import patch, Mock
 from web_service import create_app
+from web_service.helpers import jobs
+from web_service.helpers.errors import GenericException
+import web_service.backend.views as views
+from web_service.ontap.ontap_apis.ontap_apis import APIServer
 
 # Set project root directory so coverage.py can generate coverage
 BASE_DIR = os.path.join(os.path.dirname(__file__), '../..')
@@ -61,16 +67,15 @@ class ViewsTestCase(unittest.TestCase):
                                    mock_get_db_config, mock_setup, mock_kube):
         ''' Test create volumeclaim endpoint '''
         pvc_clone_name = 'test_pvc_clone_name'
-        mock_kube.return_value.create_pvc_clone_resource.return_value = [
-            {
-                "code": 201,
-                "error_message": "",
-                "message": "Snapshot %s completed successfully" % pvc_clone_name,
-                "resource": "Snapshot",
-                "resource_name": pvc_clone_name,
-                "status": "COMPLETED"
-            }
-        ]
+        mock_kube.return_value.create_pvc_clone_resource.return_value = {
+            "code": 201,
+            "error_message": "",
+            "message": "Snapshot %s completed successfully" % pvc_clone_name,
+            "resource": "Snapshot",
+            "resource_name": pvc_clone_name,
+            "status": "COMPLETED",
+            "bound": True
+        }
         response = self.client.post("/backend/volumeclaim/clone",
                                     data=dict(pvc_clone_name=pvc_clone_name,
                                               pvc_source_name='test_pvc_source_name',
@@ -79,8 +84,112 @@ class ViewsTestCase(unittest.TestCase):
                                               volume_name='isthisneeded?',
                                               build_status='passed'))
         self.assertEqual(response.status_code, 200)
-        data = json.loads(response.data)[0]    # response is single JSON object enclosed in a list
+        data = json.loads(response.data)
         self.assertEqual(data['resource_name'], pvc_clone_name)
+        mock_snapshot_store.assert_called_once()
+
+    @patch('web_service.backend.views.requests.post')
+    @patch('web_service.kub.KubernetesAPI.KubernetesAPI.get_instance')
+    @patch('web_service.helpers.helpers._setup_couchdb')
+    @patch('web_service.helpers.helpers.get_db_config')
+    @patch('web_service.helpers.helpers.connect_db')
+    def test_build_snapshot_create_async(self, mock_connect_db, mock_get_db_config, mock_setup, mock_kube,
+                                         mock_post):
+        ''' Test asynchronous volumeclaim clone records a pending clone, then its final state '''
+        kube = mock_kube.return_value
+        kube.get_kube_resource_name.return_value = 'ci_1-pvc'
+        kube.create_pvc_clone_resource.return_value = {'code': 201, 'error_message': '', 'name': 'ci_1-pvc',
+                                                       'resource_name': 'ci_1-pvc', 'bound': True}
+        database = mock_connect_db.return_value
+        database.save.return_value = 'snapshot-id', '1-a'
+        database.get.return_value = {'_id': 'snapshot-id', '_rev': '1-a', 'type': 'snapshot', 'name': 'ci_1',
+                                     'state': 'pending'}
+        self.app.config['CALLBACK_HOSTS'] = ['jenkins']
+        form = {'pvc_clone_name': 'ci_1', 'pvc_source_name': 'build-pvc', 'jenkins_build': 7, 'volume_name': 'vol',
+                'build_status': 'passed', 'async': 'true', 'callback_url': 'http://attacker.example/callback'}
+        response = self.client.post("/backend/volumeclaim/clone", data=form)
+        self.assertEqual(response.status_code, 400)
+        database.save.assert_not_called()
+        form['callback_url'] = 'http://jenkins/callback'
+        response = self.client.post("/backend/volumeclaim/clone", data=form)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(database.save.call_args_list[0][0][0]['state'], 'pending')
+        job = self.app.extensions['jobs'].get(json.loads(response.data)['job_id'])
+        self.assertTrue(job.wait(5))
+        self.assertEqual(job.result['state'], 'bound')
+        self.assertEqual(database.save.call_args_list[-1][0][0]['state'], 'bound')
+        mock_post.assert_called_once_with('http://jenkins/callback', json=job.result, timeout=10)
+
+    @patch('web_service.kub.KubernetesAPI.KubernetesAPI.get_instance')
+    @patch('web_service.database.database.get_document_by_name')
+    def test_wait_for_build_clone(self, mock_get_document, mock_kube):
+        ''' Test workspaces are not created from failed or unbound build clones '''
+        database = Mock()
+        mock_get_document.return_value = {'name': 'ci_1', 'pvc': 'ci_1-pvc', 'state': 'failed'}
+        with self.assertRaises(GenericException) as context:
+            views._wait_for_build_clone(database, 'ci_1')
+        self.assertEqual(context.exception.status_code, 409)
+        mock_get_document.return_value = {'name': 'ci_1', 'pvc': 'ci_1-pvc', 'state': 'pending'}
+        mock_kube.return_value.wait_for.return_value = False, None
+        with self.assertRaises(GenericException) as context:
+            views._wait_for_build_clone(database, 'ci_1', timeout=1)
+        self.assertEqual(context.exception.to_dict()['status_code'], 503)
+        mock_kube.return_value.wait_for.return_value = True, None
+        views._wait_for_build_clone(database, 'ci_1', timeout=1)
+        self.assertEqual(database.save.call_args[0][0]['state'], 'bound')
+
+    @patch('web_service.kub.KubernetesAPI.KubernetesAPI.get_instance')
+    @patch('web_service.helpers.helpers._setup_couchdb')
+    @patch('web_service.helpers.helpers.get_db_config')
+    @patch('web_service.helpers.helpers.connect_db')
+    def test_build_snapshots_create(self, mock_connect_db, mock_get_db_config, mock_setup, mock_kube):
+        ''' Test batched volumeclaim clone endpoint '''
+        kube = mock_kube.return_value
+        kube.get_kube_resource_name.side_effect = lambda name, resource: '%s-%s' % (name, resource)
+        kube.create_pvc_clone_resources.return_value = [
+            {'code': 201, 'error_message': '', 'resource_name': 'scm_1-pvc', 'name': 'scm_1-pvc'},
+            {'code': 400, 'error_message': 'source not found', 'resource_name': 'ci_1-pvc', 'name': 'ci_1-pvc'}]
+
+        def bound(statuses):
+            for status in statuses:
+                status['bound'] = True
+        kube.wait_for_pvc_clones.side_effect = bound
+        recorded = list()
+
+        def update(documents):
+            # couchdb sets the id of stored documents, store the first one only
+            recorded.append([dict(doc) for doc in documents])
+            documents[0]['_id'] = 'id-%s' % len(recorded)
+            return [(index == 0, 'id-%s' % len(recorded), '1-a') for index in range(len(documents))]
+        mock_connect_db.return_value.update.side_effect = update
+        clones = [dict(pvc_clone_name=name, pvc_source_name=source, jenkins_build=7, volume_name='vol',
+                       build_status='passed') for name, source in (('scm_1', 'scm-pvc'), ('ci_1', 'build-pvc'))]
+        response = self.client.post("/backend/volumeclaim/clones", json={'clones': clones})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([status['code'] for status in json.loads(response.data)], [201, 400])
+        kube.create_pvc_clone_resources.assert_called_once_with(
+            [('scm_1-pvc', 'scm-pvc'), ('ci_1-pvc', 'build-pvc')], workers=self.app.config['CLONE_WORKERS'])
+        # only the created clone is recorded as pending before the wait, then as bound
+        self.assertEqual([(doc['name'], doc['pvc'], doc['type'], doc['state']) for doc in recorded[0]],
+                         [('scm_1', 'scm_1-pvc', 'snapshot', 'pending')])
+        self.assertEqual([doc['state'] for doc in recorded[1]], ['bound'])
+
+        # a clone whose document is not stored is deleted and reported as failed
+        kube.create_pvc_clone_resources.return_value = [
+            {'code': 201, 'error_message': '', 'resource_name': name, 'name': name}
+            for name in ('scm_1-pvc', 'ci_1-pvc')]
+        recorded.clear()
+        response = self.client.post("/backend/volumeclaim/clones", json={'clones': clones})
+        self.assertEqual([status['code'] for status in json.loads(response.data)], [201, 500])
+        kube.delete_pvc.assert_called_once_with('ci_1-pvc')
+        self.assertEqual([status['resource_name'] for status in kube.wait_for_pvc_clones.call_args[0][0]],
+                         ['scm_1-pvc'])
+
+        clones[1]['build_status'] = 'unknown'
+        response = self.client.post("/backend/volumeclaim/clones", json={'clones': clones})
+        self.assertEqual(response.status_code, 406)
+        response = self.client.post("/backend/volumeclaim/clones", json={})
+        self.assertEqual(response.status_code, 400)
 
     @patch('web_service.helpers.helpers._setup_couchdb')
     @patch('web_service.helpers.helpers.get_db_config')
@@ -118,6 +227,58 @@ class ViewsTestCase(unittest.TestCase):
         print(resp.get_data(as_text=True))
         self.assertEqual(resp.status_code, 200)
 
+    @patch('web_service.helpers.helpers.onetime_setup_required')
+    @patch('web_service.helpers.helpers.get_db_config')
+    def test_ontap_request_metrics(self, mock_get_db_config, mock_setup):
+        '''Test ONTAP request scheduler metrics endpoint does not need the ONTAP configuration'''
+        APIServer('nslm.test:8443', 'admin', 'password')
+        APIServer('nslm.test:8443', 'operator', 'password')
+        response = self.client.get("/backend/ontap/requests")
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(sorted(data['requests']['admin@https://nslm.test:8443/api']['priorities']),
+                         ['interactive', 'purge'])
+        self.assertIn('operator@https://nslm.test:8443/api', data['requests'])
+        mock_get_db_config.assert_not_called()
+
+    @patch('web_service.helpers.helpers.onetime_setup_required')
+    @patch('web_service.helpers.helpers.connect_db')
+    @patch('web_service.database.checkpoint.purge_status')
+    def test_purge_status(self, mock_purge_status, mock_connect_db, mock_setup):
+        '''Test scheduled purge status endpoint'''
+        mock_purge_status.side_effect = lambda database, purge_type, interval: {'purge_type': purge_type,
+                                                                                'last_status': 'COMPLETED'}
+        response = self.client.get("/backend/purge/status")
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(sorted(data['purges']), ['ci', 'scm', 'workspace'])
+        self.assertEqual(data['purges']['ci']['last_status'], 'COMPLETED')
+
+    @patch('web_service.helpers.helpers.onetime_setup_required')
+    @patch('web_service.helpers.helpers.connect_db')
+    @patch('web_service.database.checkpoint.release_lock')
+    @patch('web_service.database.checkpoint.acquire_lock')
+    @patch('web_service.database.snapshot.purge')
+    def test_snapshot_purge(self, mock_snapshot_purge, mock_acquire, mock_release, mock_connect_db, mock_setup):
+        '''Test purge snapshots endpoint takes the purge lock'''
+        mock_snapshot_purge.return_value = 2
+        response = self.client.post("/backend/snapshot/purge", data={'type': 'ci'})
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['purged_snapshots'], {'ci': 2})
+        self.assertEqual(mock_acquire.call_args[0][1], 'ci')
+        mock_snapshot_purge.assert_called_once()
+        self.assertEqual(mock_snapshot_purge.call_args[1]['workers'], self.app.config['PURGE_WORKERS'])
+        mock_release.assert_called_once_with(mock_connect_db.return_value, mock_acquire.return_value, 'COMPLETED',
+                                             result=2)
+        response = self.client.post("/backend/snapshot/purge", data={'type': 'invalid'})
+        self.assertEqual(response.status_code, 400)
+        # a purge of the same type is running on another replica
+        mock_acquire.return_value = None
+        response = self.client.post("/backend/snapshot/purge", data={'type': 'ci'})
+        self.assertEqual(response.status_code, 409)
+        mock_snapshot_purge.assert_called_once()
+
     @patch('web_service.helpers.helpers._setup_couchdb')
     @patch('web_service.helpers.helpers.connect_db')            # for _get_config_from_db
     @patch('web_service.helpers.helpers.get_db_config')         # for _get_config_from_db
@@ -127,7 +288,8 @@ class ViewsTestCase(unittest.TestCase):
     @patch('time.sleep')                                        # to avoid sleeping for a minute
     @patch('web_service.kub.KubernetesAPI.KubernetesAPI.execute_command_in_pod')
     @patch('web_service.database.workspace.Workspace.store')
-    def test_workspace_creation(self, mock_store, mock_kube_exec, mock_sleep,
+    @patch('web_service.database.database.get_document_by_name', return_value=None)   # build clone document
+    def test_workspace_creation(self, mock_get_document, mock_store, mock_kube_exec, mock_sleep,
                                 mock_kube, mock_get_db_user_doc, mock_exceeded, mock_get_db_config,
                                 mock_connect_db, mock_setup_couch_db):
         '''Test workspace creation endpoint'''
@@ -158,6 +320,7 @@ class ViewsTestCase(unittest.TestCase):
             return mock_create_pvc_pod_return_value
 
         mock_kube.return_value.create_pvc_clone_and_pod.side_effect = update_worskspace
+        mock_kube.return_value.wait_for.return_value = (True, None)
 
         new_workspace_data = {
             'workspace-name': 'test',
@@ -171,15 +334,124 @@ class ViewsTestCase(unittest.TestCase):
         response = self.client.post("/backend/workspace/create", data=new_workspace_data)
         self.assertEqual(response.status_code, 200)
 
+    @patch('web_service.helpers.helpers._setup_couchdb')
+    @patch('web_service.helpers.helpers.connect_db')            # for _get_config_from_db
+    @patch('web_service.helpers.helpers.get_db_config')         # for _get_config_from_db
+    @patch('web_service.database.workspace.exceeded_workspace_count_for_user')
+    @patch('web_service.helpers.helpers.get_db_user_document')
+    @patch('web_service.kub.KubernetesAPI.KubernetesAPI.get_instance')
+    @patch('time.sleep')                                        # to avoid sleeping for a minute
+    @patch('web_service.database.workspace.Workspace.store')
+    @patch('web_service.database.database.get_document_by_name')
+    def test_workspace_creation_async(self, mock_get_document, mock_store, mock_sleep, mock_kube,
+                                      mock_get_db_user_doc, mock_exceeded, mock_get_db_config, mock_connect_db,
+                                      mock_setup):
+        '''Test workspace creation as a background job, from a build clone that is not bound yet'''
+        mock_get_document.return_value = {'name': 'testme', 'type': 'snapshot', 'pvc': 'testme-pvc',
+                                          'state': 'pending'}
+        mock_get_db_config.return_value = {'user_workspace_limit': 10,
+                                           'workspace_pod_image': 'test_pod_image',
+                                           'service_type': 'NodePort'}
+        mock_exceeded.return_value = [False, []]
+
+        def update_workspace(workspace, merge):
+            workspace.update({'clone_name': 'test_clone_name', 'pod': 'test_pod_name',
+                              'source_pvc': 'test_source_pvc_name', 'pvc': 'test_pvc_name',
+                              'pv_name': 'test_pv_name', 'service': 'test_service_name',
+                              'pipeline_pvc': 'test_pvc_name'})
+            return [{'code': 201, 'resource': 'PVC', 'status': 'COMPLETED'}]
+
+        mock_kube.return_value.create_pvc_clone_and_pod.side_effect = update_workspace
+        mock_kube.return_value.get_service_url.return_value = 'http://ide:3000'
+        mock_kube.return_value.wait_for.return_value = (True, None)
+        new_workspace_data = {
+            'workspace-name': 'test',
+            'build-name-with-status': 'testme_ok',
+            'username': 'test_user',
+            'pipeline-name': 'test_project',
+            'async': 'true',
+        }
+        response = self.client.post("/backend/workspace/create", data=new_workspace_data)
+        self.assertEqual(response.status_code, 202)
+        job_id = json.loads(response.data)['job_id']
+        # wait for the background job while the mocks are still active
+        self.assertTrue(self.app.extensions['jobs'].get(job_id).wait(timeout=10))
+        response = self.client.get("/backend/jobs/%s" % job_id)
+        data = json.loads(response.data)
+        self.assertEqual(data['status'], 'COMPLETED')
+        self.assertEqual(data['result']['ontap_volume_name'], 'test_clone_name')
+        response = self.client.get("/backend/jobs/%s" % job_id, headers={'Accept': 'text/html'})
+        self.assertIn(b'http://ide:3000', response.data)
+        mock_kube.return_value.wait_for.assert_any_call('pvc', 'testme-pvc', mock_kube.return_value.pvc_bound,
+                                                        timeout=60)
+        self.assertEqual(mock_get_document.return_value['state'], 'bound')
+
+    @patch('web_service.helpers.helpers._setup_couchdb')
+    def test_job_status_unknown(self, mock_setup):
+        '''Test status of an unknown job'''
+        response = self.client.get("/backend/jobs/does-not-exist")
+        self.assertEqual(response.status_code, 404)
+
+    @patch('web_service.helpers.helpers._setup_couchdb')
+    @patch('web_service.helpers.helpers.get_pipeline_dependents', return_value={'build': [], 'workspace': []})
+    @patch('web_service.helpers.helpers.delete_pipeline')
+    def test_pipeline_delete_async(self, mock_delete_pipeline, mock_dependents, mock_setup):
+        '''Test pipeline deletion as a background job reporting progress'''
+        def delete_pipeline(name, workers):
+            jobs.report_progress(3, 4, 'Deleted build clone build-3-pvc')
+            proceed.wait(5)
+
+        proceed = threading.Event()
+        mock_delete_pipeline.side_effect = delete_pipeline
+        response = self.client.post("/backend/pipeline/delete", data={'pipeline-name': 'ci-project', 'async': 'true'})
+        self.assertEqual(response.status_code, 202)
+        job = self.app.extensions['jobs'].get(json.loads(response.data)['job_id'])
+        while job.progress is None:
+            time.sleep(0.01)
+        data = json.loads(self.client.get("/backend/jobs/%s" % job.id).data)
+        self.assertEqual(data['status'], 'RUNNING')
+        self.assertEqual(data['progress'], {'done': 3, 'total': 4, 'message': 'Deleted build clone build-3-pvc'})
+        proceed.set()
+        self.assertTrue(job.wait(5))
+        self.assertEqual(job.status, 'COMPLETED')
+        mock_delete_pipeline.assert_called_once_with('ci-project', workers=self.app.config['TEARDOWN_WORKERS'])
+
+    @patch('web_service.helpers.helpers._setup_couchdb')
+    @patch('web_service.helpers.helpers.connect_db')
+    @patch('web_service.helpers.helpers.delete_pipeline')
+    def test_pipeline_delete_with_workspaces(self, mock_delete_pipeline, mock_connect_db, mock_setup):
+        '''Test a pipeline with workspaces is not deleted, dependents are read with one view request'''
+        database = mock_connect_db.return_value
+        database.view.side_effect = [
+            [Mock(doc={'_id': 'p1', 'name': 'ci-project', 'type': 'project', 'pvc': 'ci-project-pvc'})],
+            [Mock(key=['ci-project-pvc', 'build'], value='build-1-pvc'),
+             Mock(key=['ci-project-pvc', 'workspace'], value='ws-1-pvc')]]
+        response = self.client.post("/backend/pipeline/delete", data={'pipeline-name': 'ci-project'})
+        self.assertEqual(response.status_code, 500)
+        self.assertIn('ws-1-pvc', json.loads(response.data)['error'])
+        database.view.assert_called_with('project/get_pipeline_dependents', reduce=False,
+                                         startkey=['ci-project-pvc'], endkey=['ci-project-pvc', {}])
+        mock_delete_pipeline.assert_not_called()
+        # unknown pipeline
+        database.view.side_effect = [[]]
+        response = self.client.post("/backend/pipeline/delete", data={'pipeline-name': 'unknown'})
+        self.assertEqual(response.status_code, 404)
+        mock_delete_pipeline.assert_not_called()
+
     @patch('web_service.helpers.helpers.onetime_setup_required')
+    @patch('web_service.helpers.helpers.connect_db')
+    @patch('web_service.database.checkpoint.release_lock')
+    @patch('web_service.database.checkpoint.acquire_lock')
     @patch('web_service.database.workspace.purge_old_workspaces')
-    def test_workspace_purge(self, mock_purge_workspace, mock_setup):
+    def test_workspace_purge(self, mock_purge_workspace, mock_acquire, mock_release, mock_connect_db, mock_setup):
         '''Test purge workspaces endpoint'''
         mock_purge_workspace.return_value = 1, ['deleted_ws_1']
         response = self.client.post("/backend/workspace/purge")
         self.assertEqual(response.status_code, 200)
         data = json.loads(response.data)
         self.assertEqual(len(data['purged_workspaces']), 1)
+        mock_release.assert_called_once_with(mock_connect_db.return_value, mock_acquire.return_value, 'COMPLETED',
+                                             result=1)
 
     @patch('web_service.helpers.helpers._setup_couchdb')
     @patch('web_service.helpers.helpers.connect_db')            # for _get_config_from_db
@@ -1,20 +1,27 @@
 ''' Web service API endpoints logic '''
 import logging
-from flask import Blueprint, jsonify, request, render_template
+import requests
+from flask import Blueprint, jsonify, request, render_template, redirect, url_for
 from flask import current_app as app
 from web_service.helpers import helpers
+from web_service.helpers import jobs
 from web_service.helpers.errors import GenericException
 from web_service.kub.KubernetesAPI import KubernetesAPI
 from web_service.jenkins.jenkins_api_secure import JenkinsAPI
+from web_service.ontap.ontap_apis.ontap_apis import RequestScheduler
+from web_service.ontap.ontap_service import OntapService
 from web_service.database.pipeline import Pipeline
 from web_service.database.snapshot import Snapshot
 from web_service.database.workspace import Workspace
 import web_service.database.database as Database
 from web_service.database.user import User
 import web_service.database.workspace as workspace_obj
-import time
+import web_service.database.snapshot as snapshot_obj
+import web_service.database.checkpoint as checkpoint
+import web_service.helpers.scheduler as scheduler_obj
 from couchdb import http
 import traceback
+from urllib.parse import urlparse
 
 # TODO: Make exceptions specific
 #   Should all exceptions be rendered to views.py?
@@ -84,6 +91,46 @@ def version():
     return jsonify(response_object), 200
 
 
+@backend_blueprint.route('/backend/config/cache', methods=['GET'])
+def config_cache_stats():
+    """
+    Display hit/miss counters of the in-process configuration document cache
+    ---
+    tags:
+      - default
+    responses:
+      200:
+        description: return cache statistics for this web service worker
+
+    """
+    response_object = {
+        'status': 'success',
+        'cache': app.extensions['config_cache'].stats()
+    }
+    return jsonify(response_object), 200
+
+
+@backend_blueprint.route('/backend/ontap/requests', methods=['GET'])
+def ontap_request_metrics():
+    """
+    Display queue depth and wait time per priority of the ONTAP API requests sent by this worker,
+    per NSLM user and server
+    ---
+    tags:
+      - default
+    responses:
+      200:
+        description: return request scheduler metrics for this web service worker
+
+    """
+    # schedulers exist once a NSLM server was used, no client is built (ONTAP may not be configured yet)
+    response_object = {
+        'status': 'success',
+        'requests': {server: scheduler.metrics() for server, scheduler in RequestScheduler.servers().items()}
+    }
+    return jsonify(response_object), 200
+
+
 def _get_config_from_db():
     # TODO: Should this method belong to database.py? Iff Exceptions can be redirected to web server
     """
@@ -109,6 +156,31 @@ def _get_config_from_db():
     return connector, config_document
 
 
+def _async_requested():
+    '''True if the client asked for the operation to run as a background job'''
+    return request.values.get('async', 'false').lower() == 'true'
+
+
+def _prefers_html():
+    '''True if the client (e.g. a browser form submission) prefers HTML over JSON'''
+    return request.accept_mimetypes.best_match(['application/json', 'text/html']) == 'text/html'
+
+
+def _submit_job(job_type, func, *args, template=None):
+    '''
+    Run func(*args) as a background job
+    Browsers are redirected to the job page, API clients get the job id with HTTP 202
+    :param template: template rendered with the result of func for browsers once the job completes
+    '''
+    job = app.extensions['jobs'].submit(app._get_current_object(), job_type, func, *args, template=template)
+    status_url = url_for('backend.job_status', job_id=job.id)
+    if _prefers_html():
+        return redirect(status_url, code=303)
+    response = jsonify({'status': 'accepted', 'job_id': job.id, 'status_url': status_url})
+    response.headers['Location'] = status_url
+    return response, 202
+
+
 def _validate_input_form_params(form, required):
     """
     Validate if all required params are input in the web form
@@ -126,12 +198,12 @@ def _populate_workspace_details(workspace, input_form, config, merge):
 
     # Retrieve user document from db
     try:
-        user_doc = helpers.get_db_user_document(request.form['username'])
+        user_doc = helpers.get_db_user_document(input_form['username'])
     except:
         raise GenericException(500, "Error retrieving user information from database", "Database Exception")
 
     workspace['name'] = '-'.join([input_form['workspace-name'],
-                                  request.form['username'],
+                                  input_form['username'],
                                   '-'.join(workspace['pipeline'].split('-')[1:]),  # extract project name from pipeline
                                   helpers.return_random_string(4)])
     # User details
@@ -160,19 +232,23 @@ def _complete_kubernetes_setup_for_workspace(workspace, merge=False):
     # workspace['clone_name'] is populated from KubernetesAPI (retrieved from PV-PVC mapping)
     workspace['clone_mount'] = "/mnt/" + workspace['clone_name']
 
-    # Wait for IDE to be ready before returning
-    # TODO: Change this to wait and proceed only when service is in Ready state (geta an IP assigned)
+    # Wait for IDE to be ready before returning: service has an address and the pod is running
     try:
-        time.sleep(60)
+        kube.wait_for('service', workspace['service'], kube.service_has_address, timeout=60)
         workspace['ide'] = kube.get_service_url(workspace['service'])
     except:
         workspace['ide'] = "NA"
         logging.warning("WARNING: Unable to retrieve workspace URL")
 
     # Wait for pod to be ready before executing any commands
-    # TODO: Add logic to proceed only when pod status is 'Running'
     # Set git user.email and user.name , we don't care if the command fails
-    git_user_cmd = 'git config --global user.name %s' % request.form['username']
+    try:
+        running, _ = kube.wait_for('pod', workspace['pod'], kube.pod_running, timeout=60)
+        if not running:
+            logging.warning("WARNING: Workspace pod %s is not running yet" % workspace['pod'])
+    except:
+        logging.warning("WARNING: Unable to retrieve workspace pod status: %s" % traceback.format_exc())
+    git_user_cmd = 'git config --global user.name %s' % workspace['username']
     git_email_cmd = 'git config --global user.email %s' % workspace['user_email']
     try:
         kube.execute_command_in_pod(workspace['pod'], git_user_cmd)
@@ -182,6 +258,24 @@ def _complete_kubernetes_setup_for_workspace(workspace, merge=False):
                         traceback.format_exc())
 
 
+def _wait_for_build_clone(db, build_name, timeout=60):
+    '''
+    Wait until the build clone a workspace is cloned from is bound
+    :raises GenericException if the build clone failed or is still not bound after timeout seconds
+    '''
+    snapshot_doc = Database.get_document_by_name(db, build_name)
+    if snapshot_doc is None or snapshot_doc.get('state') in (None, snapshot_obj.STATE_BOUND):
+        return
+    if snapshot_doc['state'] == snapshot_obj.STATE_FAILED:
+        raise GenericException(409, "Build clone %s could not be created, please select another build" % build_name)
+    kube = KubernetesAPI.get_instance()
+    bound, _ = kube.wait_for('pvc', snapshot_doc['pvc'], kube.pvc_bound, timeout=timeout)
+    if not bound:
+        raise GenericException(503, "Build clone %s is not ready yet, please re-try later" % build_name)
+    snapshot_doc['state'] = snapshot_obj.STATE_BOUND
+    db.save(snapshot_doc)
+
+
 def _record_new_workspace(db, workspace, merge=False):
     try:
         new_ws_document = Workspace(name=workspace['name'],
@@ -231,7 +325,7 @@ def _setup_workspace(input_form, merge=False):
     if merge:
         # Retrieve project name from source_workspace document
         try:
-            source_ws_document = Database.get_document_by_name(connect, request.form['source-workspace-name'])
+            source_ws_document = Database.get_document_by_name(connect, input_form['source-workspace-name'])
         except:
             error_msg = "Error retrieving source workspace information from database"
             logging.error("%s: %s" % (error_msg, traceback.format_exc()))
@@ -239,14 +333,17 @@ def _setup_workspace(input_form, merge=False):
         # populate the workspace details
         workspace['source_workspace_name'] = input_form['source-workspace-name']
         workspace['pipeline'] = source_ws_document['pipeline']
-        workspace['build_name'] = request.form['build-name']
+        workspace['build_name'] = input_form['build-name']
     else:
-        workspace['pipeline'] = request.form['pipeline-name']
+        workspace['pipeline'] = input_form['pipeline-name']
         # strip build_status and retain only the build_name
-        workspace['build_name'] = request.form['build-name-with-status'].rsplit('_', 1)[0]
+        workspace['build_name'] = input_form['build-name-with-status'].rsplit('_', 1)[0]
 
     _populate_workspace_details(workspace, input_form, config, merge)
 
+    # Build clones registered asynchronously may not be bound yet
+    _wait_for_build_clone(connect, workspace['build_name'])
+
     # Create Kube PVC, Pod, Service, and execute commands in Pod to complete workspace setup
     _complete_kubernetes_setup_for_workspace(workspace, merge)
 
@@ -284,20 +381,37 @@ def workspace_create():
         required: true
         description: pipeline name of the SCM project
         type: string
+      - in: path
+        name: async
+        required: false
+        description: run as a background job and return a job id to poll at /backend/jobs/<job_id>
+        type: boolean
     responses:
       200:
         description: workspace created successfully
+      202:
+        description: workspace creation job accepted
 
     """
     # Validate input form parameters
     _validate_input_form_params(request.form, ['workspace-name', 'build-name-with-status', 'username', 'pipeline-name'])
 
-    workspace = _setup_workspace(request.form)
+    if _async_requested():
+        return _submit_job('workspace-create', _create_workspace, request.form.to_dict(),
+                           template='workspace_details.html')
+
+    return render_template('workspace_details.html', **_create_workspace(request.form)), 200
+
+
+def _create_workspace(input_form):
+    '''Create a workspace and return the details rendered in workspace_details.html'''
+    workspace = _setup_workspace(input_form)
 
     logging.debug("Workspace details:: %s" % str(workspace))
-    return render_template('workspace_details.html', message="Workspace created successfully",
-                           ontap_data_ip=app.config['ONTAP_DATA_IP'],
-                           ontap_volume_name=workspace['clone_name'], workspace_ide=workspace['ide']), 200
+    return {'message': "Workspace created successfully",
+            'ontap_data_ip': app.config['ONTAP_DATA_IP'],
+            'ontap_volume_name': workspace['clone_name'],
+            'workspace_ide': workspace['ide']}
 
 
 @backend_blueprint.route('/backend/workspace/merge', methods=['POST'])
@@ -328,15 +442,31 @@ def workspace_merge():
         required: true
         description: Source workspace
         type: integer
+      - in: path
+        name: async
+        required: false
+        description: run as a background job and return a job id to poll at /backend/jobs/<job_id>
+        type: boolean
     responses:
       200:
         description: merge workspace created successfully
+      202:
+        description: merge workspace creation job accepted
 
     """
     # Validate input web form parameters from the application
     _validate_input_form_params(request.form, ['workspace-name', 'build-name', 'username', 'source-workspace-name'])
 
-    workspace = _setup_workspace(request.form, merge=True)
+    if _async_requested():
+        return _submit_job('workspace-merge', _merge_workspace, request.form.to_dict(),
+                           template='workspace_details.html')
+
+    return render_template('workspace_details.html', **_merge_workspace(request.form)), 200
+
+
+def _merge_workspace(input_form):
+    '''Create a merge workspace and return the details rendered in workspace_details.html'''
+    workspace = _setup_workspace(input_form, merge=True)
 
     # Run the merge commands in the new workspace. source ws will be mounted at /source_workspace/git
     # Destination ws will be mounted at /workspace/git
@@ -362,8 +492,41 @@ def workspace_merge():
         logging.error("Response from workspace POD:: %s" % response)
         raise GenericException(500, "Unable to successfully create a merged workspace! , please contact your administrator")
 
-    return render_template('workspace_details.html', message=message,
-                           ontap_volume_name=workspace['clone_name'], workspace_ide=workspace['ide']), 200
+    return {'message': message,
+            'ontap_volume_name': workspace['clone_name'],
+            'workspace_ide': workspace['ide']}
+
+
+@backend_blueprint.route('/backend/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """
+    Status of a background job (e.g. asynchronous workspace creation)
+    ---
+    tags:
+      - jobs
+    parameters:
+      - in: path
+        name: job_id
+        required: true
+        description: id returned when the job was submitted
+        type: string
+    responses:
+      200:
+        description: job status, with the job result once the job has completed
+      404:
+        description: unknown or expired job id
+
+    """
+    job = app.extensions['jobs'].get(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': "Unknown job %s" % job_id}), 404
+    if _prefers_html():
+        if job.status == jobs.COMPLETED and job.template:
+            return render_template(job.template, **job.result), 200
+        if job.status == jobs.FAILED:
+            return render_template('error.html', error=job.error.get('error', job.error)), job.error['status_code']
+        return render_template('job_status.html', job=job.to_dict()), 200
+    return jsonify(job.to_dict()), 200
 
 
 @backend_blueprint.route('/backend/workspace/delete', methods=['POST'])
@@ -418,7 +581,9 @@ def workspace_purge():
         description: workspaces have been purged successfully
 
     """
-    count, purged_workspaces = workspace_obj.purge_old_workspaces()
+    count, purged_workspaces = _run_manual_purge(
+        'workspace', lambda heartbeat: workspace_obj.purge_old_workspaces(workers=app.config['PURGE_WORKERS'],
+                                                                          heartbeat=heartbeat))
     response = {'code': 200,
                 'resource': 'purge',
                 'customer_instance': app.config['DATABASE_NAME'],
@@ -428,6 +593,120 @@ def workspace_purge():
     return jsonify(response)
 
 
+@backend_blueprint.route('/backend/snapshot/purge', methods=['POST'])
+def snapshot_purge():
+    """
+    Purge SCM and CI snapshots exceeding the purge limits
+    Snapshot documents without an ONTAP snapshot are purged from DB as well
+    ---
+    tags:
+      - snapshot
+    parameters:
+      - in: formData
+        name: type
+        required: false
+        description: snapshot type to purge, scm or ci (default both)
+        type: string
+    responses:
+      200:
+        description: snapshots have been purged successfully
+
+    """
+    snapshot_types = [request.values['type']] if request.values.get('type') else ['scm', 'ci']
+    if not set(snapshot_types) <= {'scm', 'ci'}:
+        raise GenericException(400, "Invalid snapshot type %s, expected scm or ci" % request.values['type'])
+    counts = dict()
+    for snapshot_type in snapshot_types:
+        counts[snapshot_type] = _run_manual_purge(
+            snapshot_type, lambda heartbeat: snapshot_obj.purge(snapshot_type, workers=app.config['PURGE_WORKERS'],
+                                                                heartbeat=heartbeat))
+    response = {'code': 200,
+                'resource': 'purge',
+                'customer_instance': app.config['DATABASE_NAME'],
+                'message': "Purged %s snapshots" % sum(counts.values()),
+                'purged_snapshots': counts,
+                'status': 'COMPLETED'}
+    return jsonify(response)
+
+
+def _run_manual_purge(purge_type, purge):
+    '''
+    Run a manual purge holding the purge lock of its type, like the scheduled purges
+    :raises GenericException 409 while a scheduled or manual purge of the same type is running
+    '''
+    result = scheduler_obj.run_locked(helpers.connect_db(), purge_type, scheduler_obj.new_owner(),
+                                      app.config['PURGE_LOCK_TTL'], purge)
+    if result is None:
+        raise GenericException(409, "A %s purge is already running, please re-try later" % purge_type)
+    return result
+
+
+@backend_blueprint.route('/backend/purge/status', methods=['GET'])
+def purge_status():
+    """
+    Status of the scheduled purges: last run status, duration and result, next run
+    ---
+    tags:
+      - purge
+    responses:
+      200:
+        description: status per purge type
+
+    """
+    scheduler = app.extensions.get('purge_scheduler')
+    intervals = scheduler.intervals if scheduler else dict()
+    database = helpers.connect_db()
+    statuses = {purge_type: checkpoint.purge_status(database, purge_type, intervals.get(purge_type))
+                for purge_type in scheduler_obj.PURGE_TYPES}
+    response = {'code': 200,
+                'resource': 'purge',
+                'customer_instance': app.config['DATABASE_NAME'],
+                'scheduled': bool(intervals),
+                'purges': statuses,
+                'status': 'COMPLETED'}
+    return jsonify(response)
+
+
+@backend_blueprint.route('/backend/snapshot/reconcile', methods=['POST'])
+def snapshot_reconcile():
+    """
+    Reconcile snapshots between ONTAP and DB
+    Reports snapshot documents without ONTAP snapshot (purged from DB unless dry_run)
+    and ONTAP snapshots without snapshot document, per volume
+    ---
+    tags:
+      - snapshot
+    parameters:
+      - in: formData
+        name: volume
+        required: false
+        description: volume to reconcile (default SCM and all project volumes)
+        type: string
+      - in: formData
+        name: dry_run
+        required: false
+        description: only report inconsistencies (default true)
+        type: boolean
+    responses:
+      200:
+        description: reconciliation report per volume
+
+    """
+    dry_run = request.values.get('dry_run', 'true').lower() != 'false'
+    if request.values.get('volume'):
+        reports = [snapshot_obj.reconcile_snapshots(request.values['volume'], dry_run)]
+    else:
+        reports = snapshot_obj.reconcile_all_snapshots(dry_run)
+    response = {'code': 200,
+                'resource': 'reconcile',
+                'customer_instance': app.config['DATABASE_NAME'],
+                'message': "Reconciled %s volumes" % len(reports),
+                'dry_run': dry_run,
+                'volumes': reports,
+                'status': 'COMPLETED'}
+    return jsonify(response)
+
+
 @backend_blueprint.route('/backend/pipeline/create', methods=['POST'])
 def pipeline_create():
     """
@@ -571,9 +850,16 @@ def pipeline_delete():
         required: true
         description: Name of the pipeline to be deleted
         type: string
+      - in: path
+        name: async
+        required: false
+        description: run as a background job and return a job id to poll at /backend/jobs/<job_id>
+        type: boolean
     responses:
       200:
         description:  Pipeline has been deleted successfully
+      202:
+        description: pipeline deletion job accepted, the job reports the build clones deleted so far
 
     """
     #####
@@ -585,23 +871,31 @@ def pipeline_delete():
     _validate_input_form_params(request.form, ['pipeline-name'])
 
     # Don't delete pipeline if there are one or more workspaces associated with it
-    ws_exists, workspaces = helpers.check_if_workspaces_exist_for_pipeline(request.form['pipeline-name'])
-    if ws_exists:
-        raise GenericException(500, "One or more workspaces for this pipeline %s exist."
+    dependents = helpers.get_pipeline_dependents(request.form['pipeline-name'])
+    if dependents['workspace']:
+        raise GenericException(500, "%s workspace(s) for this pipeline %s exist."
                                     "Please re-try after deleting the following workspaces %s."
-                                    % (request.form['pipeline-name'], workspaces))
+                                    % (len(dependents['workspace']), request.form['pipeline-name'],
+                                       dependents['workspace']))
+
+    if _async_requested():
+        return _submit_job('pipeline-delete', _delete_pipeline, request.form['pipeline-name'])
+
+    return jsonify(_delete_pipeline(request.form['pipeline-name'])), 200
 
+
+def _delete_pipeline(pipeline_name):
+    '''Delete a pipeline and its build clones'''
     try:
-        helpers.delete_pipeline(request.form['pipeline-name'])
+        helpers.delete_pipeline(pipeline_name, workers=app.config['TEARDOWN_WORKERS'])
     except Exception as exc:
         logging.error("Unable to delete pipeline: %s" % traceback.format_exc())
-        raise GenericException(500, "Unable to delete pipeline %s :: %s" % (request.form['pipeline-name'], str(exc)))
+        raise GenericException(500, "Unable to delete pipeline %s :: %s" % (pipeline_name, str(exc)))
 
-    response_object = {
+    return {
         'status': 'success',
-        'message': "Successfully deleted workspace: %s" % request.form['pipeline-name']
+        'message': "Successfully deleted workspace: %s" % pipeline_name
     }
-    return jsonify(response_object), 200
 
 
 @backend_blueprint.route('/backend/volumeclaim/clone', endpoint='pvc_clone_create', methods=['POST'])
@@ -629,51 +923,207 @@ def volume_claim_clone():
         required: false
         description: specifies whether this clone is of a successful or failed build
         type: string
+      - in: body
+        name: async
+        required: false
+        description: return once the clone is recorded as pending, with a job id to poll at /backend/jobs/<job_id>
+        type: boolean
+      - in: body
+        name: callback_url
+        required: false
+        description: with async, URL receiving a POST with the clone status once the clone is bound or failed
+        type: string
     responses:
       200:
         description: PVC Clone was created successfully
+      202:
+        description: PVC Clone job accepted
 
     """
     # TODO: document jenkins_build in docstring
     # TODO: do we need volume name?
-    _validate_input_form_params(request.form, ['pvc_clone_name', 'pvc_source_name', 'build_status',
-                                               'jenkins_build', 'volume_name'])
+    build_status = _validate_clone_params(request.form)
     config_document = helpers.get_db_config()
     if not config_document:
         raise GenericException(500,
                                GenericException.DB_CONFIG_DOC_NOT_FOUND,
                                "Database Exception")
-    build_status = request.form['build_status'] or 'N/A'
-    if build_status not in ["passed", "failed", "N/A"]:
-        raise GenericException(406,
-                               "Invalid build_status type parameter: accepted values - 'passed', 'failed', 'N/A'")
 
     # TODO: this name should be created in KubernetesAPI, but currently will impact create_pvc_and_pod()
     kube = KubernetesAPI.get_instance()
 
     pvc_clone_name = kube.get_kube_resource_name(request.form['pvc_clone_name'], 'pvc')
+    db_connect = helpers.connect_db()
+    if not db_connect:
+        raise GenericException(500,
+                               GenericException.DB_CONNECTION_ERROR,
+                               "Database Exception")
+    if _async_requested():
+        callback_url = _validate_callback_url(request.form.get('callback_url'))
+        # record the pending clone first so that workspace creation waits for it
+        snapshot_doc = _new_clone_snapshot(request.form, pvc_clone_name, build_status)
+        snapshot_doc.state = snapshot_obj.STATE_PENDING
+        snapshot_doc.store(db_connect)
+        return _submit_job('volumeclaim-clone', _clone_volume_claim, snapshot_doc.id, pvc_clone_name,
+                           request.form['pvc_source_name'], callback_url)
+
     status = kube.create_pvc_clone_resource(
         clone=pvc_clone_name, source=request.form['pvc_source_name'])
     # record snapshot in db
+    snapshot_doc = _new_clone_snapshot(request.form, pvc_clone_name, build_status)
+    snapshot_doc.state = snapshot_obj.clone_state(status)
+    snapshot_doc.store(db_connect)
+    return jsonify(status)
+
+
+def _validate_callback_url(callback_url):
+    '''
+    Only allow callbacks to the configured CALLBACK_HOSTS, the server must not send requests to any URL a caller chooses
+    :raises GenericException if callback_url points to another host
+    '''
+    if not callback_url:
+        return None
+    url = urlparse(callback_url)
+    if url.scheme not in ('http', 'https') or url.hostname not in app.config['CALLBACK_HOSTS']:
+        raise GenericException(400, "callback_url must be an http(s) URL of one of the hosts %s"
+                               % ', '.join(app.config['CALLBACK_HOSTS']))
+    return callback_url
+
+
+def _clone_volume_claim(snapshot_id, pvc_clone_name, pvc_source_name, callback_url=None):
+    '''
+    Create a PVC clone recorded as pending, then record whether it is bound or failed
+    :param callback_url: URL notified with the clone status once the clone is bound or failed
+    :return: status of PVC creation
+    '''
+    try:
+        status = KubernetesAPI.get_instance().create_pvc_clone_resource(clone=pvc_clone_name, source=pvc_source_name)
+    except Exception as exc:
+        logging.error("Unable to create PVC clone %s: %s" % (pvc_clone_name, traceback.format_exc()))
+        status = OntapService.set_status(400, "PVC", pvc_clone_name, str(exc))
+        status['name'] = pvc_clone_name
+    db_connect = helpers.connect_db()
+    status['state'] = snapshot_obj.clone_state(status)
+    snapshot_doc = Snapshot.load(db_connect, snapshot_id)
+    if snapshot_doc is None:
+        # e.g. the pipeline was deleted while the clone was created
+        logging.warning("WARNING: Snapshot document of PVC clone %s no longer exists" % pvc_clone_name)
+    else:
+        snapshot_doc.state = status['state']
+        snapshot_doc.store(db_connect)
+    if callback_url:
+        try:
+            requests.post(callback_url, json=status, timeout=10)
+        except requests.exceptions.RequestException as exc:
+            logging.warning("WARNING: Unable to notify %s of PVC clone %s: %s" % (callback_url, pvc_clone_name, exc))
+    return status
+
+
+@backend_blueprint.route('/backend/volumeclaim/clones', endpoint='pvc_clones_create', methods=['POST'])
+def volume_claim_clones():
+    """
+    Create several Kube PVC clones in one request
+    PVCs are created concurrently and recorded as pending with a single bulk write,
+    then waited for together and their state recorded with another bulk write
+    ---
+    tags:
+      - volumeclaim
+    parameters:
+      - in: body
+        name: clones
+        required: true
+        description: list of clone requests, each with the parameters of /backend/volumeclaim/clone
+                     (pvc_clone_name, pvc_source_name, build_status, jenkins_build, volume_name)
+        type: array
+    responses:
+      200:
+        description: PVC clone status, in the order of the clone requests
+
+    """
+    body = request.get_json(silent=True) or dict()
+    clones = body.get('clones')
+    if not clones or not isinstance(clones, list) or not all(isinstance(clone, dict) for clone in clones):
+        raise GenericException(400, "The following parameters ['clones'] are required")
+    build_statuses = [_validate_clone_params(clone) for clone in clones]
+    config_document = helpers.get_db_config()
+    if not config_document:
+        raise GenericException(500,
+                               GenericException.DB_CONFIG_DOC_NOT_FOUND,
+                               "Database Exception")
+    kube = KubernetesAPI.get_instance()
+    pvc_clone_names = [kube.get_kube_resource_name(clone['pvc_clone_name'], 'pvc') for clone in clones]
     db_connect = helpers.connect_db()
     if not db_connect:
         raise GenericException(500,
                                GenericException.DB_CONNECTION_ERROR,
                                "Database Exception")
+    statuses = kube.create_pvc_clone_resources(
+        [(pvc_clone_name, clone['pvc_source_name']) for pvc_clone_name, clone in zip(pvc_clone_names, clones)],
+        workers=app.config['CLONE_WORKERS'])
+    # record the created clones as pending before waiting, so that they are listed and purged even if the wait fails
+    snapshot_docs = list()
+    for clone, pvc_clone_name, build_status, status in zip(clones, pvc_clone_names, build_statuses, statuses):
+        if status['code'] >= 400:
+            logging.error("PVC clone %s not created: %s" % (pvc_clone_name, status['error_message']))
+            continue
+        snapshot_doc = _new_clone_snapshot(clone, pvc_clone_name, build_status)
+        snapshot_doc.state = snapshot_obj.STATE_PENDING
+        snapshot_docs.append((snapshot_doc, status))
+    stored = set(Database.store_documents(db_connect, [snapshot_doc for snapshot_doc, _ in snapshot_docs]))
+    for snapshot_doc, status in snapshot_docs:
+        if snapshot_doc.id not in stored:
+            # a clone that is not recorded would never be listed or purged, remove it
+            _delete_unrecorded_clone(kube, status)
+    snapshot_docs = [(snapshot_doc, status) for snapshot_doc, status in snapshot_docs if snapshot_doc.id in stored]
+    kube.wait_for_pvc_clones([status for _, status in snapshot_docs])
+    updates = list()
+    for snapshot_doc, status in snapshot_docs:
+        snapshot_doc.state = snapshot_obj.clone_state(status)
+        if snapshot_doc.state != snapshot_obj.STATE_PENDING:
+            updates.append(snapshot_doc)
+    Database.store_documents(db_connect, updates)
+    return jsonify(statuses)
+
+
+def _delete_unrecorded_clone(kube, status):
+    '''Delete a PVC clone whose snapshot document could not be stored and report it as failed in status'''
+    logging.error("Snapshot document of PVC clone %s not stored, deleting the PVC" % status['resource_name'])
+    status.update(OntapService.set_status(500, "PVC", status['resource_name'],
+                                          "Unable to record the PVC clone in the database"))
+    try:
+        kube.delete_pvc(status['resource_name'])
+    except Exception as exc:
+        logging.error("Unable to delete PVC clone %s: %s" % (status['resource_name'], exc))
+
+
+def _validate_clone_params(params):
+    '''
+    Validate the parameters of a PVC clone request
+    :return: build status of the clone
+    '''
+    _validate_input_form_params(params, ['pvc_clone_name', 'pvc_source_name', 'build_status',
+                                         'jenkins_build', 'volume_name'])
+    build_status = params['build_status'] or 'N/A'
+    if build_status not in ["passed", "failed", "N/A"]:
+        raise GenericException(406,
+                               "Invalid build_status type parameter: accepted values - 'passed', 'failed', 'N/A'")
+    return build_status
+
+
+def _new_clone_snapshot(params, pvc_clone_name, build_status):
+    '''Snapshot document (not stored yet) recording a PVC clone'''
     # TODO: Replace Snapshot doc with Clone document
     # TODO: Do we need volume or pvc_source_name?
-    snapshot_doc = Snapshot(name=request.form['pvc_clone_name'],
-                            pvc_name=pvc_clone_name,
-                            # TODO: Why do we need volume? Also, this is not the clone volume name,
-                            #  but the parent pipeline volume name which we use later for only querying.
-                            #  Reflect key-name appropriately
-                            parent_pipeline_pvc=request.form['pvc_source_name'],
-                            volume=request.form['volume_name'],
-                            pvc=pvc_clone_name,
-                            jenkins_build=request.form['jenkins_build'],
-                            build_status=build_status)
-    snapshot_doc.store(db_connect)
-    return jsonify(status)
+    return Snapshot(name=params['pvc_clone_name'],
+                    pvc_name=pvc_clone_name,
+                    # TODO: Why do we need volume? Also, this is not the clone volume name,
+                    #  but the parent pipeline volume name which we use later for only querying.
+                    #  Reflect key-name appropriately
+                    parent_pipeline_pvc=params['pvc_source_name'],
+                    volume=params['volume_name'],
+                    pvc=pvc_clone_name,
+                    jenkins_build=params['jenkins_build'],
+                    build_status=build_status)
 
 
 @backend_blueprint.route('/backend/<pipeline_name>/buildclones',
@@ -0,0 +1,191 @@
+''' purge checkpoint, run and lock couchdb document mappings '''
+import logging
+import time
+import uuid
+from datetime import datetime
+from couchdb.http import ResourceConflict
+from couchdb.mapping import Document, TextField, DateTimeField, IntegerField, FloatField, BooleanField
+import web_service.database.database as Database
+
+
+class Checkpoint(Document):
+    '''State of one volume as seen by the last purge run that processed it'''
+    name = TextField()
+    type = TextField(default="checkpoint")
+    purge_type = TextField()
+    volume = TextField()
+    # id of the purge run that processed the volume
+    run = TextField()
+    # timestamp of the newest snapshot and number of snapshots left after the purge
+    snapshot_timestamp = FloatField()
+    snapshot_count = IntegerField()
+    # purge limit applied to the volume, a changed limit purges the volume again
+    purge_limit = IntegerField()
+    # workspace activity verdict and earliest time the workspace can become inactive
+    verdict = TextField()
+    next_scan = FloatField()
+    updated = DateTimeField(default=datetime.now)
+
+
+class PurgeRun(Document):
+    '''Latest run of a purge type, a run that did not complete is resumed by the next purge'''
+    name = TextField()
+    type = TextField(default="purge_run")
+    purge_type = TextField()
+    run = TextField()
+    started = DateTimeField(default=datetime.now)
+    finished = DateTimeField()
+    completed = BooleanField(default=False)
+
+
+class PurgeLock(Document):
+    '''Leader lock and last run status of scheduled purges of one type, shared by all replicas'''
+    name = TextField()
+    type = TextField(default="purge_lock")
+    purge_type = TextField()
+    # replica running the purge, the lock is free once expired
+    owner = TextField()
+    expires = FloatField()
+    last_started = FloatField()
+    last_finished = FloatField()
+    last_duration = FloatField()
+    last_status = TextField()
+    last_result = IntegerField()
+    last_error = TextField()
+
+
+def checkpoint_id(purge_type, volume):
+    '''Document id of the checkpoint of a volume for a purge type'''
+    return 'checkpoint_%s_%s' % (purge_type, volume)
+
+
+def start_run(database, purge_type):
+    """
+    Start a purge run, or resume the previous run if it did not complete
+    @return: purge run document, dict volume -> Checkpoint for purge_type
+    """
+    run = PurgeRun.load(database, 'purge_run_%s' % purge_type)
+    if run is None:
+        run = PurgeRun(id='purge_run_%s' % purge_type, name='purge_run_%s' % purge_type, purge_type=purge_type)
+    if run.run is None or run.completed:
+        run.run = uuid.uuid4().hex
+        run.started = datetime.now()
+        run.finished = None
+        run.completed = False
+        run.store(database)
+    else:
+        logging.info("Purge: resuming interrupted %s purge run %s", purge_type, run.run)
+    return run, load_checkpoints(database, purge_type)
+
+
+def finish_run(database, run):
+    '''Mark a purge run as completed'''
+    run.completed = True
+    run.finished = datetime.now()
+    run.store(database)
+
+
+def load_checkpoints(database, purge_type):
+    '''@return: dict volume -> Checkpoint for purge_type'''
+    checkpoints = dict()
+    for document in Database.get_documents_by_type(database, doc_type='checkpoint'):
+        if document.get('purge_type') == purge_type:
+            checkpoint = Checkpoint.wrap(dict(document.items()))
+            checkpoints[checkpoint.volume] = checkpoint
+    return checkpoints
+
+
+def new_checkpoint(purge_type, volume, run):
+    '''Create (without storing) the checkpoint of a volume'''
+    return Checkpoint(id=checkpoint_id(purge_type, volume), name=checkpoint_id(purge_type, volume),
+                      purge_type=purge_type, volume=volume, run=run.run)
+
+
+def delete_checkpoint(database, purge_type, volume):
+    '''Delete the checkpoint of a volume, e.g. when the workspace is deleted outside of a purge'''
+    volume_checkpoint = Checkpoint.load(database, checkpoint_id(purge_type, volume))
+    if volume_checkpoint is not None:
+        database.delete(volume_checkpoint)
+
+
+def save_checkpoints(database, checkpoints):
+    '''Store several checkpoints with a single _bulk_docs request'''
+    if not checkpoints:
+        return
+    for checkpoint in checkpoints:
+        checkpoint.updated = datetime.now()
+    # update() sets the new _rev in the unwrapped documents
+    for success, doc_id, result in database.update([checkpoint.unwrap() for checkpoint in checkpoints]):
+        if not success:
+            logging.error("Failed to store checkpoint %s: %s" % (doc_id, result))
+
+
+def acquire_lock(database, purge_type, owner, ttl, interval):
+    """
+    Take the lock of a purge type if the purge is due and no other replica runs it
+    Documents are updated with their _rev, only one replica can win a concurrent acquisition
+    @param ttl: seconds after which the lock is considered abandoned
+    @param interval: seconds between two purge runs
+    @return: lock document or None if the lock was not acquired
+    """
+    lock = PurgeLock.load(database, 'purge_lock_%s' % purge_type)
+    if lock is None:
+        lock = PurgeLock(id='purge_lock_%s' % purge_type, name='purge_lock_%s' % purge_type, purge_type=purge_type)
+    now = time.time()
+    if lock.owner and lock.owner != owner and (lock.expires or 0) > now:
+        return None
+    if lock.last_started and now - lock.last_started < interval:
+        return None
+    lock.owner, lock.expires, lock.last_started = owner, now + ttl, now
+    lock.last_status = 'RUNNING'
+    try:
+        lock.store(database)
+    except ResourceConflict:
+        return None
+    return lock
+
+
+def renew_lock(database, lock, ttl):
+    '''
+    Extend a held purge lock by ttl seconds, called between volumes by long purges
+    @return: False if the lock was taken over by another replica
+    '''
+    lock.expires = time.time() + ttl
+    try:
+        lock.store(database)
+    except ResourceConflict:
+        logging.error("Purge lock %s was taken over while purging" % lock.id)
+        return False
+    return True
+
+
+def release_lock(database, lock, status, result=None, error=None):
+    '''Free a purge lock and record the status of the run'''
+    lock.last_finished = time.time()
+    lock.last_duration = lock.last_finished - lock.last_started
+    lock.last_status, lock.last_result, lock.last_error = status, result, error
+    lock.owner, lock.expires = None, 0
+    try:
+        lock.store(database)
+    except ResourceConflict:
+        logging.error("Purge lock %s was taken over while purging" % lock.id)
+
+
+def purge_status(database, purge_type, interval=None):
+    '''@return: last run status of a purge type as a dict'''
+    lock = PurgeLock.load(database, 'purge_lock_%s' % purge_type)
+    status = {'purge_type': purge_type, 'interval': interval, 'running': False}
+    if lock is None:
+        return status
+    status.update({
+        'running': bool(lock.owner) and (lock.expires or 0) > time.time(),
+        'owner': lock.owner,
+        'last_started': lock.last_started,
+        'last_finished': lock.last_finished,
+        'last_duration': lock.last_duration,
+        'last_status': lock.last_status,
+        'last_result': lock.last_result,
+        'last_error': lock.last_error,
+        'next_run': lock.last_started + interval if interval and lock.last_started else None,
+    })
+    return status
@@ -1,80 +1,136 @@
 ''' Wrapper Module for accessing couchdb database'''
+import copy
 import couchdb
+import json
+import logging
 import re
+import threading
+import time
 from .configuration import Configuration
 from .user import User
 
+# Versioned definition of the views, grouped in one design document per document type so that
+# changing a view re-indexes only its design document. A write updates the generic lookups and the
+# indexes of its type, snapshot and workspace writes also update the pipeline dependents.
+# A view is a map function or a (map, reduce) tuple. Bump DESIGN_VERSION when a view
+# is added or changed, migrate() then installs the definition into databases of an earlier release
+DESIGN_VERSION = 3
+VIEWS = {
+    # lookups of documents of any type by name or type
+    'documents': {
+        'get_documents_by_name': '''function(doc) {
+                                        if(doc.type) {
+                                            emit(doc.name, doc.type);
+                                        }
+                                    }''',
+        'get_documents_by_type': '''function(doc) {
+                                        if(doc.type) {
+                                            emit(doc.type, doc.name);
+                                        }
+                                    }''',
+    },
+    'snapshot': {
+        'get_snapshots_by_volume': '''function(doc) {
+                                          if(doc.type == 'snapshot') {
+                                              emit(doc.volume, doc.name);
+                                          }
+                                      }''',
+        'get_build_clones_by_pipeline': '''function(doc) {
+                                               if(doc.type == 'snapshot') {
+                                                   emit(doc.parent_pipeline_pvc, doc.pvc);
+                                               }
+                                           }''',
+        # failed build clones are not listed, workspaces created from a pending build clone wait until it is bound
+        'get_build_clones_with_status_by_volume': '''function(doc) {
+            if(doc.type == 'snapshot' && doc.state != 'failed') {
+                emit(doc.volume, doc.name+'_'+doc.build_status);
+            }
+        }''',
+        # reduced counts, read grouped by key with get_counts()
+        'count_builds_by_volume_status': ('''function(doc) {
+                                               if(doc.type == 'snapshot') {
+                                                   emit([doc.volume, doc.build_status], null);
+                                               }
+                                           }''', '_count'),
+    },
+    'workspace': {
+        'get_workspaces_by_project': '''function(doc) {
+                                            if(doc.type == 'workspace') {
+                                                emit(doc.project, doc.workspace);
+                                            }
+                                        }''',
+        'get_workspaces_by_uid': '''function(doc) {
+                                        if(doc.type == 'workspace') {
+                                            emit(doc.uid, doc.name);
+                                        }
+                                    }''',
+        'get_workspaces_by_username': '''function(doc) {
+                                             if(doc.type == 'workspace') {
+                                                 emit(doc.username, doc.name);
+                                             }
+                                         }''',
+        'get_ws_clones_by_pipeline': '''function(doc) {
+                                            if(doc.type == 'workspace') {
+                                                emit(doc.pipeline_pvc, doc.pvc);
+                                            }
+                                        }''',
+        'count_workspaces_by_user': ('''function(doc) {
+                                          if(doc.type == 'workspace') {
+                                              emit(['name', doc.username], null);
+                                              emit(['uid', '' + doc.uid], null);
+                                          }
+                                      }''', '_count'),
+    },
+    # dependents of pipelines (project documents), indexes snapshot and workspace documents
+    'project': {
+        # build clones and workspaces of a pipeline, (map, reduce) counted per kind
+        'get_pipeline_dependents': ('''function(doc) {
+                                         if(doc.type == 'snapshot') {
+                                             emit([doc.parent_pipeline_pvc, 'build'], doc.pvc);
+                                         } else if(doc.type == 'workspace') {
+                                             emit([doc.pipeline_pvc, 'workspace'], doc.pvc);
+                                         }
+                                     }''', '_count'),
+    },
+    'user': {
+        'get_users_by_name': '''function(doc) {
+                                    if(doc.type == 'user') {
+                                        emit(doc.name, null);
+                                    }
+                                }''',
+    },
+}
+# design documents whose index may be being built after a migration -> time of the next index status check
+_building = dict()
+BUILDING_CHECK_INTERVAL = 10
+
+# single design document holding all views up to DESIGN_VERSION 1. Replicas of that release still
+# query it during a rolling upgrade, migrate() removes it from DESIGN_VERSION 4 on
+LEGACY_DESIGN_DOC = 'design_doc'
+LEGACY_DESIGN_DOC_REMOVAL = 4
+
 
-def connect(url, user, password, database):
-    '''Connect to existing couchdb database or create it'''
+def connect(url, user, password, database, session=None):
+    '''Connect to existing couchdb database or create it
+    @param session: optional couchdb.http.Session whose keep-alive connections are reused'''
     host = url
     if url.startswith('http'):
         host = re.sub(r'https?://', '', url)
     if url.startswith('www.'):
         host = re.sub(r'www.', '', url)
-    server = "http://%s:%s@%s"
-    couchdb_server = couchdb.Server("http://%s:%s@%s" % (user, password, host))
+    couchdb_server = couchdb.Server("http://%s:%s@%s" % (user, password, host), session=session)
     if database in couchdb_server:
-        return couchdb_server[database]
-    return create(host, user, password, database)
+        return migrate(couchdb_server[database])
+    return create(host, user, password, database, session=session)
 
 
-def create(host, user, password, database_name):
+def create(host, user, password, database_name, session=None):
     '''Create a couchdb database'''
 
-    couchdb_server = couchdb.Server("http://%s:%s@%s" % (user, password, host))
+    couchdb_server = couchdb.Server("http://%s:%s@%s" % (user, password, host), session=session)
     database = couchdb_server.create(database_name)
-    # create default view needed to query data
-    create_view(database, view_name='get_documents_by_name',
-                view_method='''function(doc) {
-                                    emit(doc.name, doc.type);
-                                }''')
-    create_view(database, view_name='get_documents_by_type',
-                view_method='''function(doc) {
-                                    emit(doc.type, doc.name);
-                                }''')
-    create_view(database, view_name='get_snapshots_by_volume',
-                view_method='''function(doc) {
-                                    if(doc.type == 'snapshot') {
-                                        emit(doc.volume, doc.name);
-                                    }
-                                }''')
-    create_view(database, view_name='get_workspaces_by_project',
-                view_method='''function(doc) {
-                                    if(doc.type == 'workspace') {
-                                        emit(doc.project, doc.workspace);
-                                    }
-                                }''')
-    create_view(database, view_name='get_workspaces_by_uid',
-                view_method='''function(doc) {
-                                    if(doc.type == 'workspace') {
-                                        emit(doc.uid, doc.name);
-                                    }
-                                }''')
-    create_view(database, view_name='get_build_clones_with_status_by_volume',
-                view_method='''function(doc) {
-                                        if(doc.type == 'snapshot') {
-                                            emit(doc.volume, doc.name+'_'+doc.build_status);
-                                        }
-                                    }''')
-    create_view(database, view_name='get_workspaces_by_username',
-                view_method='''function(doc) {
-                                            if(doc.type == 'workspace') {
-                                                emit(doc.username, doc.name);
-                                            }
-                                        }''')
-    create_view(database, view_name='get_build_clones_by_pipeline',
-                view_method='''function(doc) {
-                                               if(doc.type == 'snapshot') {
-                                                   emit(doc.parent_pipeline_pvc, doc.pvc);
-                                               }
-                                           }''')
-    create_view(database, view_name='get_ws_clones_by_pipeline',
-                view_method='''function(doc) {
-                                               if(doc.type == 'workspace') {
-                                                   emit(doc.pipeline_pvc, doc.pvc);
-                                               }
-                                           }''')
+    # install the views needed to query data
+    migrate(database)
     # create a configuration document with default values
     new_configuration = Configuration(name='configuration')
     new_configuration.store(database)
@@ -84,11 +140,217 @@ def create(host, user, password, database_name):
     return database
 
 
-def create_view(database, view_name, view_method):
-    '''Create a view'''
-    view = couchdb.design.ViewDefinition('design_doc', view_name, view_method)
-    view.get_doc(database)
-    view.sync(database)
+class ConnectionPool(object):
+    '''
+    Process-wide couchdb database handles sharing one HTTP session
+    The session keeps a pool of keep-alive connections and is safe to use from
+    multiple request threads, so each worker connects (and probes the database) only once
+    '''
+
+    def __init__(self, timeout=None, retry_delays=None):
+        self.session = couchdb.http.Session(timeout=timeout, retry_delays=retry_delays or [0])
+        self._databases = dict()
+        self._lock = threading.Lock()
+
+    def connect(self, url, user, password, database):
+        '''Return the shared handle for database, connecting on first use'''
+        key = (url, user, database)
+        handle = self._databases.get(key)
+        if handle is None:
+            with self._lock:
+                handle = self._databases.get(key)
+                if handle is None:
+                    handle = connect(url, user, password, database, session=self.session)
+                    self._databases[key] = handle
+        return handle
+
+    def reset(self):
+        '''Drop all cached handles, the next connect() re-validates the database'''
+        with self._lock:
+            self._databases.clear()
+
+
+class DocumentCache(object):
+    '''
+    In-process copy of a single named document (e.g. the configuration document)
+    The copy is served from memory until the _changes feed reports a new revision
+    for it, or at the latest until ttl seconds have passed since it was loaded
+    '''
+
+    def __init__(self, name, ttl=300):
+        self.name = name
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._document = None
+        self._expires = 0
+        self._generation = 0
+        self._watcher = None
+        self._lock = threading.Lock()
+
+    def get(self, database):
+        '''Return a copy of the cached document, loading it from database on a miss
+           Callers may change and store the copy without altering the document served to other threads'''
+        with self._lock:
+            if self._document is not None and time.time() < self._expires:
+                self.hits += 1
+                return self._copy(self._document)
+            self.misses += 1
+            generation = self._generation
+        document = get_document_by_name(database, self.name)
+        with self._lock:
+            # skip caching if the document was invalidated while we were loading it
+            if document is not None and generation == self._generation:
+                self._document = self._copy(document)
+                self._expires = time.time() + self.ttl
+        return document
+
+    @staticmethod
+    def _copy(document):
+        return type(document).wrap(copy.deepcopy(document.unwrap()))
+
+    def invalidate(self):
+        '''Drop the cached copy, the next get() reloads it'''
+        with self._lock:
+            self._document = None
+            self._generation += 1
+
+    def stats(self):
+        '''Hit/miss counters for monitoring'''
+        with self._lock:
+            return {'name': self.name, 'hits': self.hits, 'misses': self.misses,
+                    'cached': self._document is not None, 'watching': self.watching()}
+
+    def watching(self):
+        '''True if the change-feed watcher thread is running'''
+        return self._watcher is not None and self._watcher.is_alive()
+
+    def watch(self, database, timeout=60):
+        '''Start a daemon thread that invalidates the copy when the document changes'''
+        with self._lock:
+            if self.watching() or self._document is None:
+                return
+            self._watcher = threading.Thread(target=self._follow_changes,
+                                             args=(database, self._document.id, timeout),
+                                             name='%s-changes' % self.name)
+            self._watcher.daemon = True
+            self._watcher.start()
+
+    def _follow_changes(self, database, doc_id, timeout):
+        since = 'now'
+        while True:
+            try:
+                changes = database.changes(feed='longpoll', since=since, timeout=timeout * 1000,
+                                           filter='_doc_ids', doc_ids=json.dumps([doc_id]))
+                since = changes['last_seq']
+                if changes['results']:
+                    logging.info("Document %s changed, invalidating cached copy", self.name)
+                    self.invalidate()
+            except Exception as exc:
+                # fall back on the ttl while couchdb is unreachable
+                logging.warning("Unable to follow changes for %s: %s", self.name, str(exc))
+                self.invalidate()
+                time.sleep(timeout)
+
+
+def migrate(database):
+    """
+    Install the versioned view definition if the design documents deployed in database are older
+    Design documents with new or changed views are written with a single bulk update, then pre-warmed
+    @return: database
+    """
+    designs = dict()
+    for design in VIEWS:
+        doc_id = '_design/%s' % design
+        designs[design] = database.get(doc_id) or {'_id': doc_id}
+    deployed = max(document.get('version', 0) for document in designs.values())
+    # the index of a design document migrated by another replica may still be being built
+    _building.update(dict.fromkeys(VIEWS, 0))
+    if deployed > DESIGN_VERSION:
+        # a newer release already migrated the database, never downgrade its views
+        logging.warning("Design documents version %s is newer than %s", deployed, DESIGN_VERSION)
+        return database
+    updates, changed = list(), list()
+    for design, document in designs.items():
+        views = design_views(design)
+        if document.get('views') != views:
+            changed.append(design)
+        elif document.get('version') == DESIGN_VERSION:
+            continue
+        document.update({'language': 'javascript', 'views': views, 'version': DESIGN_VERSION})
+        updates.append(document)
+    legacy = database.get('_design/%s' % LEGACY_DESIGN_DOC) if DESIGN_VERSION >= LEGACY_DESIGN_DOC_REMOVAL else None
+    if legacy is not None:
+        updates.append({'_id': legacy['_id'], '_rev': legacy['_rev'], '_deleted': True})
+    if not updates:
+        return database
+    for success, doc_id, result in database.update(updates):
+        if not success:
+            # another replica migrated the database concurrently
+            logging.info("Design document %s was not migrated: %s", doc_id, result)
+    logging.info("Design documents migrated to version %s, changed: %s", DESIGN_VERSION, ', '.join(sorted(changed)))
+    if legacy is not None:
+        # drop the index files of the removed design document
+        database.cleanup()
+    warm_views(database, changed)
+    return database
+
+
+def design_views(design):
+    '''@return: the views of a design document of VIEWS as stored in the design document'''
+    views = dict()
+    for view_name, view_method in VIEWS[design].items():
+        reduce_method = None
+        if isinstance(view_method, tuple):
+            view_method, reduce_method = view_method
+        views[view_name] = {'map': view_method}
+        if reduce_method:
+            views[view_name]['reduce'] = reduce_method
+    return views
+
+
+def warm_views(database, designs):
+    """
+    Start building the indexes of design documents without waiting for them
+    The views of a design document share one index, querying one view builds all of them.
+    stale=update_after answers from the current index and updates it after responding,
+    reads tolerating outdated results do the same with query_view() until the index is built
+    """
+    for design in designs:
+        view_name = sorted(VIEWS[design])[0]
+        try:
+            len(database.view('%s/%s' % (design, view_name), limit=1, stale='update_after'))
+        except couchdb.http.HTTPError as exc:
+            logging.warning("Unable to warm views of %s: %s", design, str(exc))
+
+
+def index_building(database, design):
+    '''@return: True while the index of a design document is being built after a migration'''
+    if design not in _building:
+        return False
+    if time.time() < _building[design]:
+        return True
+    try:
+        building = bool(database.info(design)['view_index'].get('updater_running'))
+    except (couchdb.http.HTTPError, KeyError) as exc:
+        logging.warning("Unable to get the index status of %s: %s", design, str(exc))
+        building = False
+    if building:
+        _building[design] = time.time() + BUILDING_CHECK_INTERVAL
+    else:
+        _building.pop(design, None)
+    return building
+
+
+def query_view(database, view_name, outdated_ok=False, **options):
+    '''
+    Query a view as design/view
+    Reads tolerating outdated results (e.g. dashboard counts) do not wait for an index being built after a
+    migration, they are answered from the current index with stale=update_after
+    '''
+    if outdated_ok and index_building(database, view_name.split('/')[0]):
+        options['stale'] = 'update_after'
+    return database.view(view_name, **options)
 
 
 def delete(url, user, password, database):
@@ -100,32 +362,105 @@ def delete(url, user, password, database):
 
 def get_document_by_name(database, document):
     '''Get a document by it's name'''
-    for item in database.view('design_doc/get_documents_by_name', key=document, limit=1):
+    for item in database.view('documents/get_documents_by_name', key=document, limit=1):
         document = couchdb.mapping.Document.load(database, item.id)
         return document
 
 
-def get_documents_by_type(database, doc_type):
-    '''Get list of documents by it's type
-    @return: list of documents where each doc is formatted as a dict of all available fields'''
+def get_documents_by_names(database, names, doc_type=None):
+    '''Get documents for several names with a single multi-key view request
+       @param doc_type: optional document type the documents must have
+       @return: list of documents'''
+    if not names:
+        return []
     documents = list()
-    results = database.view('design_doc/get_documents_by_type', key=doc_type)
-    for item in results:
-        documents.append(couchdb.mapping.Document.load(database, item.id))
+    for item in database.view('documents/get_documents_by_name', keys=list(names), include_docs=True):
+        if item.doc is not None and (doc_type is None or item.doc.get('type') == doc_type):
+            documents.append(couchdb.mapping.Document.wrap(item.doc))
     return documents
 
 
-def get_snapshots_by_volume(database, volume):
+def store_documents(database, documents):
+    '''Store several mapped documents with a single _bulk_docs request
+       @return: list of ids of the stored documents'''
+    if not documents:
+        return []
+    stored = list()
+    # update() sets the _id and new _rev in the unwrapped documents
+    for success, doc_id, result in database.update([doc.unwrap() for doc in documents]):
+        if success:
+            stored.append(doc_id)
+        else:
+            logging.error("Failed to store document %s: %s" % (doc_id, result))
+    return stored
+
+
+def delete_documents(database, documents):
+    '''Delete several documents with a single _bulk_docs request
+       @return: list of ids of the deleted documents'''
+    if not documents:
+        return []
+    deletions = [{'_id': doc.id, '_rev': doc.rev, '_deleted': True} for doc in documents]
+    deleted = list()
+    for success, doc_id, result in database.update(deletions):
+        if success:
+            deleted.append(doc_id)
+        else:
+            logging.error("Failed to delete document %s: %s" % (doc_id, result))
+    return deleted
+
+
+def get_user_by_name(database, username):
+    '''Get a user document by it's name with a single keyed view lookup
+       @return: user document or None if the user does not exist'''
+    for item in database.view('user/get_users_by_name', key=username, limit=1, include_docs=True):
+        return couchdb.mapping.Document.wrap(item.doc)
+    return None
+
+
+def get_documents_by_type(database, doc_type, limit=None, startkey_docid=None):
+    '''Get list of documents by it's type
+    Documents are fetched with the view rows (include_docs) in a single request
+    @param limit: optional maximum number of documents to return (page size)
+    @param startkey_docid: optional document id to start the page from (inclusive)
+    @return: list of documents where each doc is formatted as a dict of all available fields'''
+    options = {'key': doc_type, 'include_docs': True}
+    if limit is not None:
+        options['limit'] = limit
+    if startkey_docid is not None:
+        options['startkey_docid'] = startkey_docid
+    results = database.view('documents/get_documents_by_type', **options)
+    return [couchdb.mapping.Document.wrap(item.doc) for item in results if item.doc is not None]
+
+
+def iter_documents_by_type(database, doc_type, page_size=500):
+    '''Iterate over all documents of a type, page_size documents per request'''
+    startkey_docid = None
+    while True:
+        # fetch one extra row to learn where the next page starts
+        documents = get_documents_by_type(database, doc_type, limit=page_size + 1,
+                                          startkey_docid=startkey_docid)
+        for document in documents[:page_size]:
+            yield document
+        if len(documents) <= page_size:
+            return
+        startkey_docid = documents[page_size].id
+
+
+def get_snapshots_by_volume(database, volume, include_docs=False):
     '''Get all snapshot documents that belong to volume
+       @param include_docs: fetch the snapshot documents (row.doc) with the view rows
        @return: ViewResults where each row has row.key=volume and row.value=snapshot'''
-    return database.view('design_doc/get_snapshots_by_volume', key=volume)
+    if include_docs:
+        return database.view('snapshot/get_snapshots_by_volume', key=volume, include_docs=True)
+    return database.view('snapshot/get_snapshots_by_volume', key=volume)
 
 
 def get_workspaces_by_project(database, project):
     '''Get all workspace documents that belong to a project
        @return: ViewResults where each row has row.key=volume \
                 and row.value=workspace_name(clone_name)'''
-    return database.view('design_doc/get_workspaces_by_project', key=project)
+    return database.view('workspace/get_workspaces_by_project', key=project)
 
 
 def get_workspaces_by_user(database, user):
@@ -133,27 +468,85 @@ def get_workspaces_by_user(database, user):
        @return: list of workspace_names owned by user'''
     workspaces = list()
     if user.isdigit():
-        for item in database.view('design_doc/get_workspaces_by_uid', key=user):
+        for item in database.view('workspace/get_workspaces_by_uid', key=user):
             workspaces.append(item.value)
     else:
-        for item in database.view('design_doc/get_workspaces_by_username', key=user):
+        for item in database.view('workspace/get_workspaces_by_username', key=user):
             workspaces.append(item.value)
     return workspaces
 
 
+def get_counts(database, view_name, group_level=None, outdated_ok=False, **options):
+    '''Read a reduced view grouped by key (group=true), or by the first group_level items of array keys
+       @param view_name: view as design/view, e.g. workspace/count_workspaces_by_user
+       @param outdated_ok: do not wait for an index being built after a migration, see query_view()
+       @return: dict key -> reduced value, array keys are returned as tuples'''
+    if group_level is None:
+        options['group'] = True
+    else:
+        options['group_level'] = group_level
+    counts = dict()
+    for row in query_view(database, view_name, outdated_ok, **options):
+        counts[tuple(row.key) if isinstance(row.key, list) else row.key] = row.value
+    return counts
+
+
+def count_workspaces_by_user(database, user=None):
+    '''Count the workspaces of a user (name or uid) with a single reduced view request
+       @return: count of workspaces of user, or dict username -> count if user is None'''
+    if user is None:
+        counts = get_counts(database, 'workspace/count_workspaces_by_user', outdated_ok=True,
+                            startkey=['name'], endkey=['name', {}])
+        return {key[1]: count for key, count in counts.items()}
+    key = ['uid', user] if user.isdigit() else ['name', user]
+    return get_counts(database, 'workspace/count_workspaces_by_user', key=key).get(tuple(key), 0)
+
+
+def count_build_statuses(database, volume=None):
+    '''Tally build clones by build status, for one volume or for all volumes
+       @return: dict build status -> count of build clones'''
+    options = {'startkey': [volume], 'endkey': [volume, {}]} if volume is not None else {}
+    tallies = dict()
+    counts = get_counts(database, 'snapshot/count_builds_by_volume_status', outdated_ok=volume is None, **options)
+    for (_, build_status), count in counts.items():
+        tallies[build_status] = tallies.get(build_status, 0) + count
+    return tallies
+
+
 def get_build_clones_with_status_by_volume(database, volume):
     '''Get all clone names associated with a volume
        @return: ViewResults where each row has row.key=volume and row.value=clone_name_build_status'''
-    return database.view('design_doc/get_build_clones_with_status_by_volume', key=volume)
+    return query_view(database, 'snapshot/get_build_clones_with_status_by_volume', outdated_ok=True, key=volume)
 
 
-def get_build_clones_by_pipeline(database, pipeline_pvc):
+def get_build_clones_by_pipeline(database, pipeline_pvc, include_docs=False):
     '''Get all build clone PVCs associated with a pipeline
+       @param include_docs: fetch the snapshot documents in the same request (row.doc)
        @return: ViewResults where each row has row.key=pvc and row.value=build_clone_pvc'''
-    return database.view('design_doc/get_build_clones_by_pipeline', key=pipeline_pvc)
+    return database.view('snapshot/get_build_clones_by_pipeline', key=pipeline_pvc, include_docs=include_docs)
+
+
+def get_pipeline_dependents(database, pipeline_pvc):
+    '''Get the build clone and workspace PVCs of a pipeline with a single view request
+       @return: dict with the lists of 'build' and 'workspace' PVCs'''
+    dependents = {'build': [], 'workspace': []}
+    for row in database.view('project/get_pipeline_dependents', reduce=False,
+                             startkey=[pipeline_pvc], endkey=[pipeline_pvc, {}]):
+        dependents[row.key[1]].append(row.value)
+    return dependents
+
+
+def count_pipeline_dependents(database):
+    '''Count the build clones and workspaces of all pipelines with a single reduced view request
+       @return: dict pipeline_pvc -> dict with the 'build' and 'workspace' counts'''
+    counts = dict()
+    for row in query_view(database, 'project/get_pipeline_dependents', outdated_ok=True, group_level=2):
+        pipeline_pvc, kind = row.key
+        counts.setdefault(pipeline_pvc, {'build': 0, 'workspace': 0})[kind] = row.value
+    return counts
 
 
 def get_ws_clones_by_pipeline(database, pipeline_pvc):
     '''Get all workspace clone PVCs associated with a pipeline
        @return: ViewResults where each row has row.key=pvc and row.value=ws_clone_pvc'''
-    return database.view('design_doc/get_ws_clones_by_pipeline', key=pipeline_pvc)
+    return database.view('workspace/get_ws_clones_by_pipeline', key=pipeline_pvc)
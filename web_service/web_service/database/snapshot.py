@@ -1,10 +1,20 @@
 ''' snapshot couchdb document mapping '''
 import logging
+import time
 from datetime import datetime
 from couchdb.mapping import Document, TextField, DateTimeField, IntegerField
 from web_service.helpers import helpers
 from web_service.ontap.ontap_service import OntapService
+from web_service.ontap.ontap_apis.ontap_apis import PRIORITY_PURGE
 import web_service.database.database as Database
+import web_service.database.checkpoint as checkpoint
+
+
+# states of the PVC clone recorded by a snapshot document, documents without state are bound.
+# A pending clone is bound by the first workspace created from it (backend _wait_for_build_clone)
+STATE_PENDING = 'pending'
+STATE_BOUND = 'bound'
+STATE_FAILED = 'failed'
 
 
 class Snapshot(Document):
@@ -13,6 +23,7 @@ class Snapshot(Document):
     type = TextField(default="snapshot")
     volume = TextField()
     pvc = TextField()
+    state = TextField()
     parent_pipeline_pvc = TextField()
     project = TextField()
     jenkins_build = IntegerField()
@@ -21,74 +32,138 @@ class Snapshot(Document):
 
 
 # Module methods: clients using these methods donot need a Snapshot Document instance
-def purge(snapshot_type):
+def clone_state(status):
+    """
+    State of a PVC clone from the status returned by KubernetesAPI.create_pvc_clone_resource(s)
+    A clone that was not bound within the wait remains pending
+    """
+    if status['code'] >= 400:
+        return STATE_FAILED
+    return STATE_BOUND if status.get('bound', True) else STATE_PENDING
+
+
+def purge(snapshot_type, workers=1, heartbeat=None):
     """
     Purge SCM or CI snapshots
     @param snapshot_type: snapshot-type (SCM or CI)
+    @param workers: number of concurrent ONTAP snapshot deletions per volume
+    @param heartbeat: optional callable invoked between volumes, the purge stops if it returns False
     @return: count of snapshots purged
     """
     config = helpers.get_db_config()
     if snapshot_type == "scm":
         volume = config['scm_volume']
         purge_limit = config['scm_purge_limit']
-        purge_inconsistent_snapshots(volume)
-        count = purge_snapshots_by_volume(volume, purge_limit)
+        if not volume:
+            return 0
+        count = purge_volumes("scm", [(volume, purge_limit)], workers, heartbeat)
     elif snapshot_type == "ci":
-        count = purge_ci_snapshots()
+        count = purge_ci_snapshots(workers, heartbeat)
     return count
 
 
-def purge_inconsistent_snapshots(volume):
+def purge_inconsistent_snapshots(volume, dry_run=False, ontap_snapshot_data=None):
     """
     Snapshot consistency check - ONTAP vs DB
     Purge inconsistent snapshot documents from DB
     i.e. snapshots in DB that do not exist in ONTAP
+    @param ontap_snapshot_data: OntapService.get_snapshot_list() result if already listed
     @return: count of snapshots deleted from DB
     """
+    report = reconcile_snapshots(volume, dry_run, ontap_snapshot_data)
+    logging.info("Purge: snapshot reconciliation for %s: %s", volume, report)
+    return report['purged_from_db']
+
+
+def reconcile_snapshots(volume, dry_run=False, ontap_snapshot_data=None):
+    """
+    Reconcile snapshots of a volume - ONTAP vs DB
+    Snapshot documents without ONTAP snapshot are purged from DB with a single bulk request,
+    ONTAP snapshots without snapshot document are reported only
+    @param dry_run: report inconsistencies without purging them
+    @param ontap_snapshot_data: OntapService.get_snapshot_list() result if already listed
+    @return: report of snapshot counts, inconsistent snapshot names and timings in seconds
+    """
+    started = time.time()
     config = helpers.get_db_config()
     database = helpers.connect_db()
-    snapshots_in_db = Database.get_snapshots_by_volume(database, volume=volume)
-    ontap = OntapService(config['ontap_api'], config['ontap_apiuser'], config['ontap_apipass'],
-                         config['ontap_svm_name'], config['ontap_aggr_name'], config['ontap_data_ip'])
-    ontap_snapshot_data = ontap.get_snapshot_list(volume)
-    if not ontap_snapshot_data:
-        # purge all snapshots from DB and return:
-        return purge_snapshots_from_db(snapshots_ontap=[],
-                                       snapshots_db=snapshots_in_db)
-    if not snapshots_in_db:
-        # return if there are no snapshot documents in db
-        return 0
+    snapshots_in_db = list(Database.get_snapshots_by_volume(database, volume=volume, include_docs=True))
+    db_listed = time.time()
+    if ontap_snapshot_data is None:
+        ontap = OntapService(config['ontap_api'], config['ontap_apiuser'], config['ontap_apipass'],
+                             config['ontap_svm_name'], config['ontap_aggr_name'], config['ontap_data_ip'],
+                             priority=PRIORITY_PURGE)
+        ontap_snapshot_data = ontap.get_snapshot_list(volume)
+    ontap_listed = time.time()
+    report = {'volume': volume, 'dry_run': dry_run, 'db_snapshots': len(snapshots_in_db)}
+    if isinstance(ontap_snapshot_data, tuple):
+        # get_snapshot_list returns (snapshots, error) when the volume has no snapshots or cannot be listed
+        ontap_snapshot_data, error = ontap_snapshot_data
+        if error:
+            # never purge DB documents based on a failed ONTAP listing
+            report.update({'error': error, 'ontap_snapshots': None, 'missing_in_ontap': [], 'missing_in_db': [],
+                           'purged_from_db': 0})
+            report['timings'] = {'list_db': db_listed - started, 'list_ontap': ontap_listed - db_listed,
+                                 'purge': 0, 'total': time.time() - started}
+            return report
+    ontap_snapshots = set(snap['snapshot_name'] for snap in ontap_snapshot_data or [])
+    db_snapshots = set(row.value for row in snapshots_in_db)
+    report['ontap_snapshots'] = len(ontap_snapshots)
+    report['missing_in_ontap'] = sorted(db_snapshots - ontap_snapshots)
+    report['missing_in_db'] = sorted(ontap_snapshots - db_snapshots)
+    report['purged_from_db'] = purge_snapshots_from_db(ontap_snapshots, snapshots_in_db, dry_run)
+    report['timings'] = {'list_db': db_listed - started, 'list_ontap': ontap_listed - db_listed,
+                         'purge': time.time() - ontap_listed, 'total': time.time() - started}
+    return report
 
-    ontap_snapshots = [snap['snapshot_name'] for snap in ontap_snapshot_data]
-    return purge_snapshots_from_db(snapshots_ontap=ontap_snapshots,
-                                   snapshots_db=snapshots_in_db)
+
+def purge_snapshots_from_db(snapshots_ontap, snapshots_db, dry_run=False):
+    """
+    Purge snapshots present only in snapshots_db but not in snapshots_ontap with a single bulk request
+    @param snapshots_db: view rows fetched with include_docs,
+                         where each row has row.key=volume_name and row.value=snapshot_name
+    @param dry_run: count inconsistent snapshots without purging them
+    @return: count of inconsistent snapshots
+    """
+    snapshots_ontap = set(snapshots_ontap)
+    inconsistent = [row for row in snapshots_db if row.value not in snapshots_ontap]
+    if not inconsistent or dry_run:
+        return len(inconsistent)
+    database = helpers.connect_db()
+    Database.delete_documents(database, [row.doc for row in inconsistent if row.doc is not None])
+    for row in inconsistent:
+        logging.info("Purge: inconsistent snapshot %s deleted from db", row.value)
+    return len(inconsistent)
 
 
-def purge_snapshots_from_db(snapshots_ontap, snapshots_db):
-    ''' purge snapshots present only in snapshot_db but not in snapshots_ontap'''
+def reconcile_all_snapshots(dry_run=False):
+    """
+    Reconcile snapshots of the SCM volume and of all project volumes
+    @return: list of reconciliation reports, one per volume
+    """
+    config = helpers.get_db_config()
     database = helpers.connect_db()
-    count = 0
-    # snapshots_db is a list of rows:
-    # where each row has row.key=volume_name and row.value=snapshot_name
-    for snap in snapshots_db:
-        if snap.value not in snapshots_ontap:
-            count += 1
-            database.delete(snap)
-            logging.info("Purge: inconsistent snapshot %s deleted from db", snap.value)
-    return count
+    volumes = [config['scm_volume']] if config['scm_volume'] else []
+    volumes += [project['volume'] for project in Database.get_documents_by_type(database, doc_type="project")]
+    return [reconcile_snapshots(volume, dry_run) for volume in volumes]
 
 
-def purge_snapshots_by_volume(volume, purge_limit):
+def purge_snapshots_by_volume(volume, purge_limit, workers=1, ontap_snapshot_list=None):
     """
     Purge snapshots per volume
+    @param workers: number of concurrent ONTAP snapshot deletions, snapshots are deleted one at a time if 1
+    @param ontap_snapshot_list: OntapService.get_snapshot_list() result if already listed
     @return: count of snapshots purged
     """
     config = helpers.get_db_config()
     ontap = OntapService(config['ontap_api'], config['ontap_apiuser'], config['ontap_apipass'],
-                         config['ontap_svm_name'], config['ontap_aggr_name'], config['ontap_data_ip'])
-    ontap_snapshot_list = ontap.get_snapshot_list(volume)
-
+                         config['ontap_svm_name'], config['ontap_aggr_name'], config['ontap_data_ip'],
+                         priority=PRIORITY_PURGE)
     if ontap_snapshot_list is None:
+        ontap_snapshot_list = ontap.get_snapshot_list(volume)
+
+    if ontap_snapshot_list is None or isinstance(ontap_snapshot_list, tuple):
+        # no snapshots or error listing them
         return 0
 
     delete_count = len(ontap_snapshot_list) - purge_limit
@@ -100,6 +175,9 @@ def purge_snapshots_by_volume(volume, purge_limit):
 
     sorted_by_timestamp = sorted(ontap_snapshot_list, key=lambda snap: snap['timestamp'])
     delete_snapshot_list = sorted_by_timestamp[:delete_count]
+    if workers > 1:
+        return len(purge_snapshots_concurrently(database, ontap, volume,
+                                                [snap['snapshot_name'] for snap in delete_snapshot_list], workers))
     for snap in delete_snapshot_list:
         status = ontap.delete_snapshot(volume, snap['snapshot_name'])
         if helpers.verify_successful_response(status):
@@ -114,9 +192,26 @@ def purge_snapshots_by_volume(volume, purge_limit):
     return delete_count
 
 
-def purge_ci_snapshots():
+def purge_snapshots_concurrently(database, ontap, volume, snapshot_names, workers):
+    """
+    Delete snapshots from ONTAP with up to workers concurrent deletions,
+    then delete their documents from DB with a single bulk request
+    @return: list of snapshot names deleted from ONTAP
+    """
+    statuses = ontap.delete_snapshots(volume, snapshot_names, workers)
+    deleted = [name for name in snapshot_names if helpers.verify_successful_response(statuses[name])]
+    documents = Database.get_documents_by_names(database, deleted, doc_type='snapshot')
+    for name in set(deleted) - set(doc['name'] for doc in documents):
+        logging.info("Purge: snapshot document not found for %s", name)
+    Database.delete_documents(database, documents)
+    logging.info("Purge: %s snapshot(s) deleted from DB and ONTAP for volume %s", len(deleted), volume)
+    return deleted
+
+
+def purge_ci_snapshots(workers=1, heartbeat=None):
     """
     Purge CI snapshots
+    @param workers: number of concurrent ONTAP snapshot deletions per volume
     @return: count of CI snapshots purged
     """
     database = helpers.connect_db()
@@ -124,9 +219,58 @@ def purge_ci_snapshots():
     projects_in_db = Database.get_documents_by_type(database, doc_type="project")
     if not projects_in_db:
         return 0
+    return purge_volumes("ci", [(project['volume'], project['ci_purge_limit']) for project in projects_in_db],
+                         workers, heartbeat)
+
+
+def purge_volumes(purge_type, volume_limits, workers=1, heartbeat=None):
+    """
+    Purge inconsistent and exceeding snapshots of several volumes
+    The snapshots of each volume are listed once. Exceeding snapshots are not purged from volumes whose
+    snapshots and purge limit did not change since the previous purge run.
+    Each purged volume is checkpointed, an interrupted run is resumed with the volumes it did not purge
+    @param purge_type: scm or ci
+    @param volume_limits: list of (volume, purge_limit)
+    @param heartbeat: optional callable invoked between volumes (e.g. renewing the purge lock),
+                      the run stops unfinished if it returns False and is resumed by the next purge
+    @return: count of snapshots purged
+    """
+    config = helpers.get_db_config()
+    database = helpers.connect_db()
+    run, checkpoints = checkpoint.start_run(database, purge_type)
+    ontap = OntapService(config['ontap_api'], config['ontap_apiuser'], config['ontap_apipass'],
+                         config['ontap_svm_name'], config['ontap_aggr_name'], config['ontap_data_ip'],
+                         priority=PRIORITY_PURGE)
     count = 0
-    # For each project, get all snapshot documents
-    for project in projects_in_db:
-        purge_inconsistent_snapshots(volume=project['volume'])
-        count += purge_snapshots_by_volume(project['volume'], project['ci_purge_limit'])
+    for volume, purge_limit in volume_limits:
+        volume_checkpoint = checkpoints.get(volume)
+        if volume_checkpoint is not None and volume_checkpoint.run == run.run:
+            # purged by the interrupted run being resumed
+            continue
+        if heartbeat is not None and not heartbeat():
+            logging.error("Purge: %s purge run %s stopped, the purge lock was lost", purge_type, run.run)
+            return count
+        ontap_snapshot_data = ontap.get_snapshot_list(volume)
+        if isinstance(ontap_snapshot_data, tuple) and ontap_snapshot_data[1]:
+            logging.error("Purge: unable to list snapshots of %s: %s", volume, ontap_snapshot_data[1])
+            continue
+        # reconciliation reuses the listing, it only costs a DB lookup
+        purge_inconsistent_snapshots(volume, ontap_snapshot_data=ontap_snapshot_data)
+        ontap_snapshot_list = [] if isinstance(ontap_snapshot_data, tuple) else ontap_snapshot_data
+        latest = max([float(snap['timestamp']) for snap in ontap_snapshot_list] or [0])
+        if volume_checkpoint is not None and volume_checkpoint.snapshot_timestamp == latest \
+                and volume_checkpoint.snapshot_count == len(ontap_snapshot_list) \
+                and volume_checkpoint.purge_limit == purge_limit:
+            logging.info("Purge: no snapshot or purge limit changes for %s since the last purge", volume)
+            continue
+        count += purge_snapshots_by_volume(volume, purge_limit, workers, ontap_snapshot_list)
+        if volume_checkpoint is None:
+            volume_checkpoint = checkpoints[volume] = checkpoint.new_checkpoint(purge_type, volume, run)
+        volume_checkpoint.run = run.run
+        # the purge keeps the latest purge_limit snapshots
+        volume_checkpoint.snapshot_timestamp = latest
+        volume_checkpoint.snapshot_count = min(len(ontap_snapshot_list), purge_limit)
+        volume_checkpoint.purge_limit = purge_limit
+        checkpoint.save_checkpoints(database, [volume_checkpoint])
+    checkpoint.finish_run(database, run)
     return count
@@ -0,0 +1,100 @@
+"""Purge checkpoint tests"""
+import unittest
+from unittest.mock import patch, Mock
+from couchdb.http import ResourceConflict
+import web_service.database.checkpoint as checkpoint
+
+
+class TestCheckpoint(unittest.TestCase):
+    """Test purge runs and checkpoints"""
+
+    @patch('web_service.database.database.get_documents_by_type')
+    def test_start_run(self, mock_get_documents):
+        """Test a new run is started after a completed run and an interrupted run is resumed"""
+        database = Mock()
+        database.save.return_value = 'purge_run_ci', '1-a'
+        mock_get_documents.return_value = [
+            checkpoint.new_checkpoint('ci', 'vol_1', Mock(run='old')),
+            checkpoint.new_checkpoint('workspace', 'ws_1', Mock(run='old'))]
+        database.get.return_value = {'_id': 'purge_run_ci', 'type': 'purge_run', 'run': 'old', 'completed': True}
+        run, checkpoints = checkpoint.start_run(database, 'ci')
+        self.assertNotEqual(run.run, 'old')
+        self.assertFalse(run.completed)
+        database.save.assert_called_once()
+        self.assertEqual(list(checkpoints), ['vol_1'])
+
+        database.reset_mock()
+        database.get.return_value = {'_id': 'purge_run_ci', 'type': 'purge_run', 'run': 'old', 'completed': False}
+        run, _ = checkpoint.start_run(database, 'ci')
+        self.assertEqual(run.run, 'old')
+        database.save.assert_not_called()
+
+    def test_save_checkpoints_bulk(self):
+        """Test checkpoints are stored with one bulk request"""
+        database = Mock()
+        database.update.return_value = [(True, 'checkpoint_ci_vol_1', '1-a'), (True, 'checkpoint_ci_vol_2', '1-b')]
+        checkpoints = [checkpoint.new_checkpoint('ci', volume, Mock(run='run_1')) for volume in ['vol_1', 'vol_2']]
+        checkpoint.save_checkpoints(database, checkpoints)
+        database.update.assert_called_once()
+        self.assertEqual([doc['_id'] for doc in database.update.call_args[0][0]],
+                         ['checkpoint_ci_vol_1', 'checkpoint_ci_vol_2'])
+
+    @patch('web_service.database.checkpoint.time.time', return_value=10000)
+    def test_acquire_lock(self, mock_time):
+        """Test the purge lock is taken only when the purge is due and not held by another replica"""
+        database = Mock()
+        database.save.return_value = 'purge_lock_ci', '1-a'
+        database.get.return_value = None
+        lock = checkpoint.acquire_lock(database, 'ci', 'replica-1', ttl=600, interval=3600)
+        self.assertEqual((lock.owner, lock.expires, lock.last_status), ('replica-1', 10600, 'RUNNING'))
+
+        database.get.return_value = {'_id': 'purge_lock_ci', '_rev': '1-a', 'type': 'purge_lock',
+                                     'owner': 'replica-1', 'expires': 10600, 'last_started': 5000}
+        self.assertIsNone(checkpoint.acquire_lock(database, 'ci', 'replica-2', ttl=600, interval=3600))
+        database.get.return_value = {'_id': 'purge_lock_ci', '_rev': '1-a', 'type': 'purge_lock',
+                                     'owner': None, 'last_started': 9000}
+        self.assertIsNone(checkpoint.acquire_lock(database, 'ci', 'replica-2', ttl=600, interval=3600))
+        # another replica stored the lock first
+        database.get.return_value = {'_id': 'purge_lock_ci', '_rev': '1-a', 'type': 'purge_lock',
+                                     'owner': 'replica-1', 'expires': 9000, 'last_started': 5000}
+        database.save.side_effect = ResourceConflict('conflict')
+        self.assertIsNone(checkpoint.acquire_lock(database, 'ci', 'replica-2', ttl=600, interval=3600))
+
+    def test_release_lock(self):
+        """Test releasing the purge lock records the run status"""
+        database = Mock()
+        database.save.return_value = 'purge_lock_ci', '2-a'
+        database.get.return_value = None
+        lock = checkpoint.PurgeLock(id='purge_lock_ci', purge_type='ci', owner='replica-1', expires=2000,
+                                    last_started=1000)
+        with patch('web_service.database.checkpoint.time.time', return_value=1090):
+            checkpoint.release_lock(database, lock, 'COMPLETED', result=4)
+        database.get.return_value = lock.unwrap()
+        with patch('web_service.database.checkpoint.time.time', return_value=1100):
+            status = checkpoint.purge_status(database, 'ci', 3600)
+        self.assertFalse(status['running'])
+        self.assertEqual((status['last_status'], status['last_result'], status['last_duration'], status['next_run']),
+                         ('COMPLETED', 4, 90, 4600))
+
+    def test_delete_checkpoint(self):
+        """Test the checkpoint of a deleted workspace is deleted if it exists"""
+        database = Mock()
+        database.get.return_value = {'_id': 'checkpoint_workspace_ws_1', '_rev': '1-a', 'type': 'checkpoint'}
+        checkpoint.delete_checkpoint(database, 'workspace', 'ws_1')
+        database.get.assert_called_once_with('checkpoint_workspace_ws_1')
+        database.delete.assert_called_once()
+        database.reset_mock()
+        database.get.return_value = None
+        checkpoint.delete_checkpoint(database, 'workspace', 'ws_2')
+        database.delete.assert_not_called()
+
+    @patch('web_service.database.checkpoint.time.time', return_value=5000)
+    def test_renew_lock(self, mock_time):
+        """Test the lock is extended, a lock taken over by another replica is reported"""
+        database = Mock()
+        database.save.return_value = 'purge_lock_ci', '3-a'
+        lock = checkpoint.PurgeLock(id='purge_lock_ci', purge_type='ci', owner='replica-1', expires=4000)
+        self.assertTrue(checkpoint.renew_lock(database, lock, 600))
+        self.assertEqual(lock.expires, 5600)
+        database.save.side_effect = ResourceConflict('conflict')
+        self.assertFalse(checkpoint.renew_lock(database, lock, 600))
@@ -5,6 +5,7 @@ import unittest
 from unittest.mock import patch, Mock
 from web_service import create_app
 import web_service.database.database as Database
+from web_service.database.configuration import Configuration
 from web_service.database.pipeline import Pipeline
 from web_service.helpers import helpers
 
@@ -51,3 +52,176 @@ class TestDatabase(unittest.TestCase):
             self.fail("Document %s not created successfully " % new_project.id)
         Database.delete(self.app.config['DATABASE_URL'], self.app.config[
             'DATABASE_USER'], self.app.config['DATABASE_PASS'], dbname)
+
+    @patch('web_service.database.database.connect')
+    def test_connection_pool_reuse(self, mock_connect):
+        """ Test if the pooled handle connects only once per database"""
+        pool = Database.ConnectionPool()
+        first = pool.connect('couchdb:5984', 'admin', 'admin', 'pooled_db')
+        second = pool.connect('couchdb:5984', 'admin', 'admin', 'pooled_db')
+        self.assertIs(first, second)
+        mock_connect.assert_called_once_with('couchdb:5984', 'admin', 'admin', 'pooled_db',
+                                             session=pool.session)
+        pool.reset()
+        pool.connect('couchdb:5984', 'admin', 'admin', 'pooled_db')
+        self.assertEqual(mock_connect.call_count, 2)
+
+    @patch('web_service.database.database.get_document_by_name')
+    def test_document_cache(self, mock_get_document):
+        """ Test if cached document is served from memory until invalidated"""
+        mock_get_document.return_value = Configuration(id='config_id')
+        cache = Database.DocumentCache('configuration', ttl=300)
+        cache.get(Mock())
+        cache.get(Mock())
+        self.assertEqual(mock_get_document.call_count, 1)
+        cache.invalidate()
+        cache.get(Mock())
+        self.assertEqual(mock_get_document.call_count, 2)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+
+    @patch('web_service.database.database.get_document_by_name')
+    def test_document_cache_returns_copies(self, mock_get_document):
+        """ Test if changes to a document returned by the cache do not alter the cached copy"""
+        mock_get_document.return_value = Configuration(scm_url=None)
+        cache = Database.DocumentCache('configuration', ttl=300)
+        cache.get(Mock())['scm_url'] = 'http://scm'
+        document = cache.get(Mock())
+        self.assertIsNone(document['scm_url'])
+        self.assertIsInstance(document, Configuration)
+        document['scm_url'] = 'http://scm'
+        self.assertIsNone(cache.get(Mock())['scm_url'])
+
+    def test_get_documents_by_type_single_request(self):
+        """ Test if documents are returned from the view rows without extra loads"""
+        database = Mock()
+        database.view.return_value = [Mock(doc={'_id': 'a', 'name': 'proj_a', 'type': 'project'}),
+                                      Mock(doc={'_id': 'b', 'name': 'proj_b', 'type': 'project'})]
+        documents = Database.get_documents_by_type(database, 'project')
+        database.view.assert_called_once_with('documents/get_documents_by_type',
+                                              key='project', include_docs=True)
+        self.assertEqual([doc['name'] for doc in documents], ['proj_a', 'proj_b'])
+
+    def test_iter_documents_by_type_pages(self):
+        """ Test if pages are chained with startkey_docid"""
+        database = Mock()
+        database.view.side_effect = [
+            [Mock(doc={'_id': 'a'}), Mock(doc={'_id': 'b'}), Mock(doc={'_id': 'c'})],
+            [Mock(doc={'_id': 'c'})]
+        ]
+        documents = list(Database.iter_documents_by_type(database, 'user', page_size=2))
+        self.assertEqual([doc.id for doc in documents], ['a', 'b', 'c'])
+        database.view.assert_called_with('documents/get_documents_by_type', key='user',
+                                         include_docs=True, limit=3, startkey_docid='c')
+
+    def test_migrate_installs_new_views(self):
+        """ Test if outdated design documents are installed with one bulk write and pre-warmed"""
+        self.assertLess(Database.DESIGN_VERSION, Database.LEGACY_DESIGN_DOC_REMOVAL)
+        database = Mock()
+        database.view.return_value = []
+        deployed = {'_design/design_doc': {'_id': '_design/design_doc', '_rev': '1-a', 'views': {}},
+                    '_design/user': {'_id': '_design/user', '_rev': '1-b', 'version': Database.DESIGN_VERSION,
+                                     'views': Database.design_views('user')}}
+        database.get.side_effect = deployed.get
+        database.update.side_effect = lambda docs: [(True, doc['_id'], '2-a') for doc in docs]
+        Database.migrate(database)
+        database.update.assert_called_once()
+        updates = {doc['_id']: doc for doc in database.update.call_args[0][0]}
+        # the legacy design document is kept for replicas of the previous release
+        self.assertEqual(sorted(updates), ['_design/documents', '_design/project', '_design/snapshot',
+                                           '_design/workspace'])
+        self.assertEqual(updates['_design/project']['version'], Database.DESIGN_VERSION)
+        self.assertEqual(updates['_design/project']['views']['get_pipeline_dependents']['reduce'], '_count')
+        database.cleanup.assert_not_called()
+        # one view per changed design document builds its index
+        warmed = sorted(call[0][0].split('/')[0] for call in database.view.call_args_list)
+        self.assertEqual(warmed, ['documents', 'project', 'snapshot', 'workspace'])
+        self.assertEqual(database.view.call_args[1], {'limit': 1, 'stale': 'update_after'})
+
+        # the deployed design documents are up to date
+        database.reset_mock()
+        deployed = dict(updates, **{'_design/user': deployed['_design/user'],
+                                    '_design/design_doc': deployed['_design/design_doc']})
+        database.get.side_effect = deployed.get
+        Database.migrate(database)
+        database.update.assert_not_called()
+        database.view.assert_not_called()
+
+        # the legacy design document is removed once no replica of its release can be running
+        with patch('web_service.database.database.DESIGN_VERSION', Database.LEGACY_DESIGN_DOC_REMOVAL):
+            Database.migrate(database)
+        removed = [doc for doc in database.update.call_args[0][0] if doc['_id'] == '_design/design_doc']
+        self.assertTrue(removed[0]['_deleted'])
+        database.cleanup.assert_called_once_with()
+        Database._building.clear()
+
+    def test_outdated_reads_while_index_building(self):
+        """ Test tolerant reads use stale=update_after while the index is built after a migration"""
+        database = Mock()
+        database.get.return_value = None
+        database.update.return_value = []
+        database.view.return_value = []
+        database.info.return_value = {'view_index': {'updater_running': True}}
+        try:
+            Database.migrate(database)
+            Database.count_build_statuses(database)
+            database.view.assert_called_with('snapshot/count_builds_by_volume_status', group=True,
+                                             stale='update_after')
+            database.info.assert_called_once_with('snapshot')
+            # the index status is checked again after BUILDING_CHECK_INTERVAL
+            Database.count_build_statuses(database)
+            database.info.assert_called_once_with('snapshot')
+            # reads guarding deletions or limits wait for the index
+            Database.count_workspaces_by_user(database, user='alice')
+            database.view.assert_called_with('workspace/count_workspaces_by_user', group=True, key=['name', 'alice'])
+            Database._building['snapshot'] = 0
+            database.info.return_value = {'view_index': {'updater_running': False}}
+            Database.count_build_statuses(database)
+            database.view.assert_called_with('snapshot/count_builds_by_volume_status', group=True)
+            self.assertNotIn('snapshot', Database._building)
+        finally:
+            Database._building.clear()
+
+    def test_get_user_by_name(self):
+        """ Test if user is resolved with one keyed view lookup"""
+        database = Mock()
+        database.view.return_value = [Mock(doc={'_id': 'u1', 'name': 'alice', 'uid': 1000})]
+        user = Database.get_user_by_name(database, 'alice')
+        database.view.assert_called_once_with('user/get_users_by_name', key='alice',
+                                              limit=1, include_docs=True)
+        self.assertEqual(user['uid'], 1000)
+        database.view.return_value = []
+        self.assertIsNone(Database.get_user_by_name(database, 'bob'))
+
+    def test_delete_documents_bulk(self):
+        """ Test if documents are looked up and deleted with one request each"""
+        database = Mock()
+        database.view.return_value = [Mock(doc={'_id': 's1', '_rev': '1-a', 'name': 'snap1', 'type': 'snapshot'}),
+                                      Mock(doc={'_id': 'p1', '_rev': '1-b', 'name': 'snap2', 'type': 'project'})]
+        documents = Database.get_documents_by_names(database, ['snap1', 'snap2'], doc_type='snapshot')
+        database.view.assert_called_once_with('documents/get_documents_by_name', keys=['snap1', 'snap2'],
+                                              include_docs=True)
+        self.assertEqual([doc['name'] for doc in documents], ['snap1'])
+        database.update.return_value = [(True, 's1', '2-a')]
+        self.assertEqual(Database.delete_documents(database, documents), ['s1'])
+        database.update.assert_called_once_with([{'_id': 's1', '_rev': '1-a', '_deleted': True}])
+        self.assertEqual(Database.delete_documents(database, []), [])
+        database.update.assert_called_once()
+
+    def test_count_pipeline_dependents(self):
+        """ Test if build clones and workspaces of all pipelines are counted with one grouped request"""
+        database = Mock()
+        database.view.return_value = [Mock(key=['p1-pvc', 'build'], value=3),
+                                      Mock(key=['p1-pvc', 'workspace'], value=1),
+                                      Mock(key=['p2-pvc', 'build'], value=2)]
+        self.assertEqual(Database.count_pipeline_dependents(database),
+                         {'p1-pvc': {'build': 3, 'workspace': 1}, 'p2-pvc': {'build': 2, 'workspace': 0}})
+        database.view.assert_called_once_with('project/get_pipeline_dependents', group_level=2)
+
+    def test_count_build_statuses(self):
+        """ Test if build statuses are tallied from one grouped request"""
+        database = Mock()
+        database.view.return_value = [Mock(key=['vol1', 'failed'], value=1), Mock(key=['vol1', 'passed'], value=4),
+                                      Mock(key=['vol2', 'passed'], value=2)]
+        self.assertEqual(Database.count_build_statuses(database), {'failed': 1, 'passed': 6})
+        database.view.assert_called_once_with('snapshot/count_builds_by_volume_status', group=True)
@@ -56,19 +56,101 @@ class TestSnapshot(unittest.TestCase):
         # test_1 is deleted
         self.assertEqual(count, 1)
 
+    @patch('web_service.database.database.delete_documents')
+    @patch('web_service.database.database.get_documents_by_names')
+    @patch('web_service.ontap.ontap_service.OntapService.delete_snapshots')
+    @patch('web_service.helpers.helpers.connect_db')
+    @patch('web_service.helpers.helpers.get_db_config')
+    @patch('web_service.ontap.ontap_service.OntapService.get_snapshot_list')
+    def test_purge_snapshots_by_volume_concurrently(self, mock_get_snapshot_list, mock_db_config, mock_connect_db,
+                                                    mock_del_snapshots, mock_get_documents, mock_delete_documents):
+        """Test concurrent deletion of snapshots with one bulk DB deletion"""
+        mock_db_config.return_value = {
+            'ontap_api': 'a', 'ontap_apiuser': 'b', 'ontap_apipass': 'c',
+            'ontap_svm_name': 'd', 'ontap_aggr_name': 'e', 'ontap_data_ip': 'f'
+        }
+        mock_get_snapshot_list.return_value = [
+            {"snapshot_name": "test_%s" % index, "timestamp": index} for index in range(5)]
+        mock_del_snapshots.return_value = {
+            'test_0': {'code': 201}, 'test_1': {'code': 400}, 'test_2': {'code': 201}}
+        mock_get_documents.return_value = [{'name': 'test_0'}]
+        count = snapshot.purge_snapshots_by_volume(volume="test_volume", purge_limit=2, workers=4)
+        self.assertEqual(count, 2)
+        mock_del_snapshots.assert_called_once_with('test_volume', ['test_0', 'test_1', 'test_2'], 4)
+        mock_get_documents.assert_called_once_with(mock_connect_db.return_value, ['test_0', 'test_2'],
+                                                   doc_type='snapshot')
+        mock_delete_documents.assert_called_once_with(mock_connect_db.return_value, [{'name': 'test_0'}])
+
+    @patch('web_service.database.checkpoint.save_checkpoints')
+    @patch('web_service.database.checkpoint.finish_run')
+    @patch('web_service.database.checkpoint.start_run')
+    @patch('web_service.ontap.ontap_service.OntapService.get_snapshot_list')
+    @patch('web_service.helpers.helpers.get_db_config')
     @patch('web_service.database.snapshot.purge_snapshots_by_volume')
     @patch('web_service.database.snapshot.purge_inconsistent_snapshots')
     @patch('web_service.database.database.get_documents_by_type')
     @patch('web_service.helpers.helpers.connect_db')
     def test_purge_ci_snapshots(self, mock_connect_db, mock_get_documents,
-                                mock_purge_inconsistent, mock_purge_by_volume):
+                                mock_purge_inconsistent, mock_purge_by_volume, mock_db_config,
+                                mock_get_snapshot_list, mock_start_run, mock_finish_run, mock_save):
         """Test purge CI snapshots"""
+        mock_db_config.return_value = {
+            'ontap_api': 'a', 'ontap_apiuser': 'b', 'ontap_apipass': 'c',
+            'ontap_svm_name': 'd', 'ontap_aggr_name': 'e', 'ontap_data_ip': 'f'
+        }
+        mock_start_run.return_value = Mock(run='run_1'), {}
+        mock_get_snapshot_list.return_value = [{"snapshot_name": "test_1", "timestamp": 100}]
         mock_get_documents.return_value = [{"name": "test",
                                             "volume": "test_vol",
                                             "ci_purge_limit": 50}]
         mock_purge_by_volume.return_value = 10
         result = snapshot.purge_ci_snapshots()
         self.assertEqual(result, 10)
+        mock_start_run.assert_called_once_with(mock_connect_db.return_value, 'ci')
+        [saved] = mock_save.call_args[0][1]
+        self.assertEqual((saved.volume, saved.run, saved.snapshot_timestamp, saved.snapshot_count),
+                         ('test_vol', 'run_1', 100, 1))
+        mock_finish_run.assert_called_once_with(mock_connect_db.return_value, mock_start_run.return_value[0])
+
+    @patch('web_service.database.checkpoint.save_checkpoints')
+    @patch('web_service.database.checkpoint.finish_run')
+    @patch('web_service.database.checkpoint.start_run')
+    @patch('web_service.ontap.ontap_service.OntapService.get_snapshot_list')
+    @patch('web_service.helpers.helpers.get_db_config')
+    @patch('web_service.database.snapshot.purge_snapshots_by_volume')
+    @patch('web_service.database.snapshot.purge_inconsistent_snapshots')
+    @patch('web_service.helpers.helpers.connect_db')
+    def test_purge_volumes_incremental(self, mock_connect_db, mock_purge_inconsistent, mock_purge_by_volume,
+                                       mock_db_config, mock_get_snapshot_list, mock_start_run, mock_finish_run,
+                                       mock_save):
+        """Test unchanged volumes and volumes purged by an interrupted run are skipped"""
+        mock_db_config.return_value = {
+            'ontap_api': 'a', 'ontap_apiuser': 'b', 'ontap_apipass': 'c',
+            'ontap_svm_name': 'd', 'ontap_aggr_name': 'e', 'ontap_data_ip': 'f'
+        }
+        mock_start_run.return_value = Mock(run='run_2'), {
+            'unchanged': Mock(run='run_1', snapshot_timestamp=200, snapshot_count=2, purge_limit=2),
+            'resumed': Mock(run='run_2'),
+            'changed': Mock(run='run_1', snapshot_timestamp=200, snapshot_count=2, purge_limit=2),
+            'lowered': Mock(run='run_1', snapshot_timestamp=200, snapshot_count=2, purge_limit=2)}
+        listings = {
+            'unchanged': [{"snapshot_name": "a", "timestamp": 100}, {"snapshot_name": "b", "timestamp": 200}],
+            'changed': [{"snapshot_name": "b", "timestamp": 200}, {"snapshot_name": "c", "timestamp": 300}],
+            'lowered': [{"snapshot_name": "a", "timestamp": 100}, {"snapshot_name": "b", "timestamp": 200}]}
+        mock_get_snapshot_list.side_effect = listings.get
+        mock_purge_by_volume.return_value = 0
+        snapshot.purge_volumes('ci', [('unchanged', 2), ('resumed', 2), ('changed', 2), ('lowered', 1)])
+        # each volume is listed once, the listing is reused by the reconciliation and the purge
+        self.assertEqual(sorted(call[0][0] for call in mock_get_snapshot_list.call_args_list),
+                         ['changed', 'lowered', 'unchanged'])
+        self.assertEqual(sorted(call[0][0] for call in mock_purge_inconsistent.call_args_list),
+                         ['changed', 'lowered', 'unchanged'])
+        mock_purge_inconsistent.assert_any_call('unchanged', ontap_snapshot_data=listings['unchanged'])
+        self.assertEqual([call[0] for call in mock_purge_by_volume.call_args_list],
+                         [('changed', 2, 1, listings['changed']), ('lowered', 1, 1, listings['lowered'])])
+        saved = [call[0][1][0] for call in mock_save.call_args_list]
+        self.assertEqual([(item.run, item.snapshot_timestamp, item.snapshot_count, item.purge_limit) for item in saved],
+                         [('run_2', 300, 2, 2), ('run_2', 200, 1, 1)])
 
     @patch('web_service.helpers.helpers.connect_db')
     def test_purge_snapshots_from_db(self, mock_connect_db):
@@ -81,3 +163,33 @@ class TestSnapshot(unittest.TestCase):
         # test_2 is deleted
         self.assertEqual(inconsistent, 1)
         self.assertEqual(consistent, 0)
+        mock_connect_db.return_value.update.assert_called_once()
+
+    @patch('web_service.helpers.helpers.connect_db')
+    @patch('web_service.helpers.helpers.get_db_config')
+    @patch('web_service.database.database.get_snapshots_by_volume')
+    @patch('web_service.ontap.ontap_service.OntapService.get_snapshot_list')
+    def test_reconcile_snapshots(self, mock_get_snapshot_list, mock_get_snapshots, mock_db_config, mock_connect_db):
+        """Test reconciliation report in both directions with a single bulk deletion"""
+        mock_db_config.return_value = {
+            'ontap_api': 'a', 'ontap_apiuser': 'b', 'ontap_apipass': 'c',
+            'ontap_svm_name': 'd', 'ontap_aggr_name': 'e', 'ontap_data_ip': 'f'
+        }
+        rows = [Mock(value='stale_%s' % index) for index in range(3)] + [Mock(value='test_1')]
+        mock_get_snapshots.return_value = rows
+        mock_get_snapshot_list.return_value = [{"snapshot_name": "test_1", "timestamp": 1},
+                                               {"snapshot_name": "hourly.0", "timestamp": 2}]
+        report = snapshot.reconcile_snapshots("test_volume", dry_run=True)
+        self.assertEqual(report['missing_in_ontap'], ['stale_0', 'stale_1', 'stale_2'])
+        self.assertEqual(report['missing_in_db'], ['hourly.0'])
+        self.assertEqual(report['purged_from_db'], 3)
+        mock_connect_db.return_value.update.assert_not_called()
+        report = snapshot.reconcile_snapshots("test_volume")
+        mock_connect_db.return_value.update.assert_called_once_with(
+            [{'_id': row.doc.id, '_rev': row.doc.rev, '_deleted': True} for row in rows[:3]])
+        self.assertIn('total', report['timings'])
+        # ONTAP listing errors never purge documents
+        mock_get_snapshot_list.return_value = None, "Error 111"
+        report = snapshot.reconcile_snapshots("test_volume")
+        self.assertEqual(report['purged_from_db'], 0)
+        self.assertEqual(mock_connect_db.return_value.update.call_count, 1)
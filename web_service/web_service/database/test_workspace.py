@@ -1,8 +1,10 @@
 """Snapshot document tests"""
+import time
 import unittest
 from unittest.mock import patch, Mock
 from web_service import create_app
 import web_service.database.workspace as workspace
+from web_service.ontap.ontap_service import OntapService
 
 
 class TestWorkspace(unittest.TestCase):
@@ -17,13 +19,20 @@ class TestWorkspace(unittest.TestCase):
     def tearDown(self):
         pass
 
+    @patch('web_service.database.checkpoint.save_checkpoints')
+    @patch('web_service.database.checkpoint.finish_run')
+    @patch('web_service.database.checkpoint.start_run')
+    @patch('web_service.database.database.delete_documents')
+    @patch('web_service.database.database.get_documents_by_names')
     @patch('web_service.helpers.helpers.connect_db')
     @patch('web_service.helpers.helpers.get_db_config')
     @patch('web_service.database.database.get_documents_by_type')
     @patch('web_service.database.database.get_workspaces_by_project')
-    @patch('web_service.ontap.ontap_service.OntapService.get_snapdiff_and_delete')
-    def test_purge_old_workspaces(self, mock_delete_clone, mock_get_workspaces,
-                                  mock_get_projects, mock_db_config, mock_connect_db):
+    @patch('web_service.ontap.ontap_service.OntapService.delete_volume')
+    @patch('web_service.ontap.ontap_service.OntapService.scan_volume_activity')
+    def test_purge_old_workspaces(self, mock_scan, mock_delete_volume, mock_get_workspaces,
+                                  mock_get_projects, mock_db_config, mock_connect_db, mock_get_documents,
+                                  mock_delete_documents, mock_start_run, mock_finish_run, mock_save):
         """Test purge workspace > purge_limit"""
         mock_db_config.return_value = {
             'ontap_api': 'a', 'ontap_apiuser': 'b', 'ontap_apipass': 'c',
@@ -32,16 +41,92 @@ class TestWorkspace(unittest.TestCase):
         mock_get_projects.return_value = [{"name": "proj_1", "workspace_purge_limit": 1},
                                           {"name": "proj_2", "workspace_purge_limit": 2}]
         mock_get_workspaces.side_effect = [
-            [Mock(value='proj_1_ws_1'),  # for proj_1 => return 2 workspaces
-             Mock(value='proj_1_ws_2')],
+            [Mock(value='proj_1_ws_1'),  # for proj_1 => return 3 workspaces
+             Mock(value='proj_1_ws_2'),
+             Mock(value='proj_1_ws_3')],
             [Mock(value='proj_2_ws_1')]  # for proj_2 => return 1 workspace
         ]
-        mock_delete_clone.side_effect = [(True, None),   # proj_1_ws_1
-                                         (False, None),  # proj_1_ws_2
-                                         (True, None)]   # proj_2_ws_1
-        count, workspaces = workspace.purge_old_workspaces()
+        mock_start_run.return_value = Mock(run='run_1'), {}
+        mock_scan.return_value = {'proj_1_ws_1': ('inactive', 100.0), 'proj_1_ws_2': ('active', 100.0),
+                                  'proj_1_ws_3': ('unknown', None), 'proj_2_ws_1': ('missing', None)}
+        mock_delete_volume.return_value = [{'code': 201}]
+        mock_get_documents.return_value = [Mock(name='proj_1_ws_1'), Mock(name='proj_2_ws_1')]
+        count, workspaces = workspace.purge_old_workspaces(workers=2)
+        mock_scan.assert_called_once_with({'proj_1_ws_1': 1, 'proj_1_ws_2': 1, 'proj_1_ws_3': 1,
+                                           'proj_2_ws_1': 2}, 2)
+        mock_delete_volume.assert_called_once_with('proj_1_ws_1')
         self.assertEqual(count, 2)
         self.assertEqual(workspaces, ['proj_1_ws_1', 'proj_2_ws_1'])
+        mock_get_documents.assert_called_once_with(mock_connect_db.return_value, workspaces, doc_type='workspace')
+        # verdicts are checkpointed, checkpoints of deleted workspaces are deleted with them
+        saved = {saved.volume: saved for saved in mock_save.call_args[0][1]}
+        self.assertEqual(saved['proj_1_ws_2'].next_scan, 100.0 + 86400)
+        deleted = mock_delete_documents.call_args[0][1]
+        self.assertEqual(deleted[2:], [saved['proj_1_ws_1'], saved['proj_2_ws_1']])
+        mock_finish_run.assert_called_once()
+
+    @patch('web_service.database.checkpoint.save_checkpoints')
+    @patch('web_service.database.checkpoint.finish_run')
+    @patch('web_service.database.checkpoint.start_run')
+    @patch('web_service.database.database.delete_documents')
+    @patch('web_service.database.database.get_documents_by_names')
+    @patch('web_service.helpers.helpers.connect_db')
+    @patch('web_service.helpers.helpers.get_db_config')
+    @patch('web_service.database.database.get_documents_by_type')
+    @patch('web_service.database.database.get_workspaces_by_project')
+    @patch('web_service.ontap.ontap_service.OntapService.delete_volume')
+    @patch('web_service.ontap.ontap_service.OntapService.scan_volume_activity')
+    def test_purge_old_workspaces_checkpoints(self, mock_scan, mock_delete_volume, mock_get_workspaces,
+                                              mock_get_projects, mock_db_config, mock_connect_db,
+                                              mock_get_documents, mock_delete_documents, mock_start_run,
+                                              mock_finish_run, mock_save):
+        """Test checkpointed workspaces are not scanned again"""
+        mock_db_config.return_value = {
+            'ontap_api': 'a', 'ontap_apiuser': 'b', 'ontap_apipass': 'c',
+            'ontap_svm_name': 'd', 'ontap_aggr_name': 'e', 'ontap_data_ip': 'f'
+        }
+        mock_get_projects.return_value = [{"name": "proj_1", "workspace_purge_limit": 1}]
+        mock_get_workspaces.return_value = [Mock(value='active'), Mock(value='resumed'), Mock(value='due')]
+        mock_start_run.return_value = Mock(run='run_2'), {
+            'active': Mock(run='run_1', verdict='active', next_scan=time.time() + 3600),
+            'resumed': Mock(run='run_2', verdict='inactive'),
+            'due': Mock(run='run_1', verdict='active', next_scan=time.time() - 3600)}
+        mock_scan.return_value = {'due': ('active', 100.0)}
+        mock_delete_volume.return_value = [{'code': 201}]
+        mock_get_documents.return_value = []
+        count, workspaces = workspace.purge_old_workspaces()
+        mock_scan.assert_called_once_with({'due': 1}, 1)
+        mock_delete_volume.assert_called_once_with('resumed')
+        self.assertEqual(workspaces, ['resumed'])
+
+    @patch('web_service.ontap.ontap_apis.ontap_apis.APIServer.get_key_svm', return_value='svm_key')
+    @patch('web_service.ontap.ontap_apis.ontap_apis.APIServer.get_snapdiff')
+    @patch('web_service.ontap.ontap_apis.ontap_apis.APIServer.get_snapshots')
+    @patch('web_service.ontap.ontap_apis.ontap_apis.Aggregate.get_volumes')
+    def test_find_inactive_volumes(self, mock_get_volumes, mock_get_snapshots, mock_get_snapdiff, mock_svm_key):
+        """Test volumes and snapshots are listed once and snapdiffs use the resolved keys"""
+        now = time.time()
+        mock_get_volumes.return_value = {'result': {'records': [{'name': 'ws_%s' % index, 'key': 'vol_%s' % index}
+                                                                for index in range(3)]}}
+        snapshots = list()
+        for index in range(3):
+            for age in ([0, 2, 5] if index < 2 else [0]):
+                snapshots.append({'name': 'hourly.%s' % age, 'key': 'snap_%s_%s' % (index, age),
+                                  'volume_key': 'vol_%s' % index, 'access_timestamp': now - age * 86400})
+        mock_get_snapshots.return_value = {'result': {'records': snapshots}}
+        mock_get_snapdiff.side_effect = lambda key, base_key: 0 if key == 'snap_0_0' else 12
+        ontap = OntapService('a', 'b', 'c', 'd', 'e', 'f')
+        verdicts = ontap.find_inactive_volumes({'ws_0': 3, 'ws_1': 3, 'ws_2': 3, 'ws_3': 3}, workers=2)
+        self.assertEqual(verdicts, {'ws_0': 'inactive', 'ws_1': 'active', 'ws_2': 'unknown', 'ws_3': 'missing'})
+        mock_get_volumes.assert_called_once_with()
+        mock_get_snapshots.assert_called_once_with(svm_key='svm_key')
+        self.assertEqual(sorted(call[0] for call in mock_get_snapdiff.call_args_list),
+                         [('snap_0_0', 'snap_0_5'), ('snap_1_0', 'snap_1_5')])
+
+        # a failed listing reports all volumes as unknown, never as missing
+        mock_get_volumes.return_value = []
+        verdicts = ontap.find_inactive_volumes({'ws_0': 3, 'ws_3': 3})
+        self.assertEqual(verdicts, {'ws_0': 'unknown', 'ws_3': 'unknown'})
 
     @patch('web_service.helpers.helpers.connect_db')
     @patch('web_service.database.database.get_workspaces_by_user')
@@ -51,8 +136,13 @@ class TestWorkspace(unittest.TestCase):
             'ws_2',
             'ws_3'
         ]
+        mock_connect_db.return_value.view.return_value = [Mock(key=['uid', '1000'], value=3)]
         negative, ws_list = workspace.exceeded_workspace_count_for_user('1000', 10)
+        self.assertEqual(ws_list, [])
+        mock_get_workspaces.assert_not_called()
         positive, ws_list = workspace.exceeded_workspace_count_for_user('1000', 3)
         self.assertEqual(negative, False)
         self.assertEqual(positive, True)
         self.assertEqual(ws_list, mock_get_workspaces.return_value)
+        mock_connect_db.return_value.view.assert_called_with('workspace/count_workspaces_by_user',
+                                                             key=['uid', '1000'], group=True)
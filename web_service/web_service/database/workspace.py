@@ -1,10 +1,14 @@
 ''' workspace couchdb document mapping '''
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from couchdb.mapping import Document, TextField, DateTimeField, IntegerField
 import web_service.database.database as Database
+import web_service.database.checkpoint as checkpoint
 import web_service.helpers.helpers as helpers
 from web_service.ontap.ontap_service import OntapService
+from web_service.ontap.ontap_apis.ontap_apis import PRIORITY_PURGE
 
 
 class Workspace(Document):
@@ -29,44 +33,86 @@ class Workspace(Document):
     ide_url = TextField()
 
 
-def purge_old_workspaces():
+def purge_old_workspaces(workers=1, heartbeat=None):
     """
     Purge workspaces older than X days
-    @return: count of workspaces deleted
+    Workspaces of all projects are scanned for inactivity in one batch.
+    Verdicts are checkpointed per workspace: active workspaces are not scanned again before they can
+    have become inactive, and an interrupted purge resumes with the verdicts of its scan
+    @param workers: number of concurrent ONTAP snapdiffs and volume deletions
+    @param heartbeat: optional callable invoked before deleting workspaces, nothing is deleted if it returns False
+    @return: count of workspaces deleted, list of deleted workspaces
     """
     database = helpers.connect_db()
     config = helpers.get_db_config()
     projects_in_db = Database.get_documents_by_type(database, doc_type='project')
     if not projects_in_db:
-        return 0
-    count = 0
-    deleted_workspaces = list()
+        return 0, []
+    # workspace clone name -> days without changes before the workspace is purged
+    workspace_days = dict()
     for project in projects_in_db:
-        workspaces_in_project = Database.get_workspaces_by_project(database, project=project['name'])
-        for workspace in workspaces_in_project:
-            # ontap doesn't provide last_access_timestamp for volumes
-            # hence, snapdiff latest snapshot with snapshot X days older \
-            # to find if workspace is active
-            ontap = OntapService(config['ontap_api'], config['ontap_apiuser'], config['ontap_apipass'],
-                                 config['ontap_svm_name'], config['ontap_aggr_name'], config['ontap_data_ip'])
-            deleted, error = ontap.get_snapdiff_and_delete(
-                volume_name=workspace.value,
-                count=project['workspace_purge_limit'])
+        for workspace in Database.get_workspaces_by_project(database, project=project['name']):
+            workspace_days[workspace.value] = project['workspace_purge_limit']
+    if not workspace_days:
+        return 0, []
+    # ontap doesn't provide last_access_timestamp for volumes
+    # hence, snapdiff latest snapshot with snapshot X days older \
+    # to find if workspace is active
+    ontap = OntapService(config['ontap_api'], config['ontap_apiuser'], config['ontap_apipass'],
+                         config['ontap_svm_name'], config['ontap_aggr_name'], config['ontap_data_ip'],
+                         priority=PRIORITY_PURGE)
+    run, checkpoints = checkpoint.start_run(database, 'workspace')
+    verdicts = dict()
+    workspaces_to_scan = dict()
+    for name, days in workspace_days.items():
+        workspace_checkpoint = checkpoints.get(name)
+        if workspace_checkpoint is not None and workspace_checkpoint.run == run.run:
+            # scanned by the interrupted run being resumed
+            verdicts[name] = workspace_checkpoint.verdict
+        elif workspace_checkpoint is not None and workspace_checkpoint.verdict == OntapService.ACTIVE \
+                and time.time() < (workspace_checkpoint.next_scan or 0):
+            verdicts[name] = OntapService.ACTIVE
+        else:
+            workspaces_to_scan[name] = days
+    scanned = ontap.scan_volume_activity(workspaces_to_scan, workers) if workspaces_to_scan else {}
+    for name, (verdict, old_timestamp) in scanned.items():
+        verdicts[name] = verdict
+        workspace_checkpoint = checkpoints.setdefault(name, checkpoint.new_checkpoint('workspace', name, run))
+        workspace_checkpoint.run = run.run
+        workspace_checkpoint.verdict = verdict
+        # files changed after the N days old snapshot, the workspace cannot be inactive before N more days
+        workspace_checkpoint.next_scan = old_timestamp + workspace_days[name] * 86400 \
+            if verdict == OntapService.ACTIVE else None
+    # store verdicts before deleting anything, an interrupted purge resumes from them
+    checkpoint.save_checkpoints(database, [checkpoints[name] for name in scanned])
+    if heartbeat is not None and not heartbeat():
+        logging.error("Purge: workspace purge run %s stopped, the purge lock was lost", run.run)
+        return 0, []
 
-            # delete inconsistent or old workspace that exceeded purge limit
-            if error is not None or deleted is True:
-                workspace_doc = Database.get_document_by_name(database, workspace.value)
-                database.delete(workspace_doc)
-                deleted_workspaces.append(workspace.value)
-                logging.info("Purge: deleted workspace %s from DB", workspace.value)
-                count += 1
-    return count, deleted_workspaces
+    inactive = [name for name, verdict in verdicts.items() if verdict == OntapService.INACTIVE]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        statuses = dict(zip(inactive, executor.map(ontap.delete_volume, inactive)))
+    deleted_workspaces = [name for name in inactive if helpers.verify_successful_response(statuses[name])]
+    for name in deleted_workspaces:
+        logging.info("Deleted inactive workspace %s", name)
+    # delete inconsistent or old workspace that exceeded purge limit
+    deleted_workspaces += [name for name, verdict in verdicts.items() if verdict == OntapService.MISSING]
+    documents = Database.get_documents_by_names(database, deleted_workspaces, doc_type='workspace')
+    documents += [checkpoints[name] for name in deleted_workspaces if name in checkpoints]
+    Database.delete_documents(database, documents)
+    for name in deleted_workspaces:
+        logging.info("Purge: deleted workspace %s from DB", name)
+    checkpoint.finish_run(database, run)
+    return len(deleted_workspaces), deleted_workspaces
 
 
 def exceeded_workspace_count_for_user(username, limit):
-    '''Verify if user has exceeded workspace limit'''
+    '''
+    Verify if user has exceeded workspace limit
+    Workspaces are counted server side, their names are only retrieved once the limit is reached
+    @return: True and the workspace names of the user if the limit is reached, False and [] otherwise
+    '''
     database = helpers.connect_db()
-    workspaces = Database.get_workspaces_by_user(database, user=username)
-    if len(workspaces) >= limit:
-        return True, workspaces
-    return False, workspaces
+    if Database.count_workspaces_by_user(database, user=username) < limit:
+        return False, []
+    return True, Database.get_workspaces_by_user(database, user=username)
@@ -29,14 +29,17 @@ def dashboard():
         services = helpers.get_services()
         pipelines = helpers.get_pipelines_for_dashboard()
         workspaces = helpers.get_workspaces()
+        summary = helpers.get_dashboard_summary()
 
     except Exception as e:
         services = []
         pipelines = []
         workspaces = []
+        summary = {}
         logging.error(
             "Unable to retrieve Build@Scale dashboard data: %s" % traceback.format_exc())
-    return render_template('dashboard.html', services=services, pipelines=pipelines, workspaces=workspaces)
+    return render_template('dashboard.html', services=services, pipelines=pipelines, workspaces=workspaces,
+                           summary=summary)
 
 
 @frontend_blueprint.route('/frontend/pipeline/create', methods=['GET'])
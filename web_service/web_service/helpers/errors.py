@@ -10,11 +10,17 @@ class GenericException(Exception):
                        'message': 'Missing one or more required parameters, please re-try'}
     http_codes[401] = {'type': 'Bad Request',
                        'message': 'User has exceeded workspace limit'}
+    http_codes[404] = {'type': 'Not Found',
+                       'message': 'The requested resource does not exist'}
     http_codes[406] = {'type': 'Bad Request',
                        'message': 'Invalid value for one or more parameters, please re-try'}
+    http_codes[409] = {'type': 'Conflict',
+                       'message': 'The request conflicts with the current state of the resource'}
     # HTTP 5xx -- server-side error
     http_codes[500] = {'type': 'Server Error',
                        'message': 'Server has encountered an error'}
+    http_codes[503] = {'type': 'Service Unavailable',
+                       'message': 'The resource is not ready yet, please re-try later'}
     DB_CONNECTION_ERROR = "Error connecting to the database and fetching configuration document,"\
                           "please contact your administrator"
     DB_CONFIG_DOC_NOT_FOUND = "Customer configuration document not found, please contact your administrator"
@@ -6,12 +6,16 @@ import random
 import re
 import requests
 import string
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from flask import current_app as app
 import web_service.database.database as Database
+import web_service.database.checkpoint as checkpoint
 from web_service.ontap.ontap_service import OntapService
 from web_service.jenkins.jenkins_api_secure import JenkinsAPI
 from web_service.kub.KubernetesAPI import KubernetesAPI
 from web_service.helpers.errors import GenericException
+from web_service.helpers import jobs
 import sys
 import inspect
 import traceback
@@ -148,14 +152,14 @@ def replace_kube_invalid_characters(text):
 
 
 def connect_db():
-    """Connect to database and retrieve config document"""
+    """Return the worker's pooled database handle, connecting on first use"""
     if app.config.get('DATABASE_URL') is None:
         app.config['DATABASE_URL'] = KubernetesAPI.get_instance().get_service_url(
             service_name=app.config['DATABASE_SERVICE_NAME'])
         logging.info("DATABASE_URL not known, fetching from Kubernetes " + app.config['DATABASE_URL'])
     try:
-        database = Database.connect(app.config['DATABASE_URL'], app.config['DATABASE_USER'],
-                                    app.config['DATABASE_PASS'], app.config['DATABASE_NAME'])
+        database = app.extensions['couchdb'].connect(app.config['DATABASE_URL'], app.config['DATABASE_USER'],
+                                                     app.config['DATABASE_PASS'], app.config['DATABASE_NAME'])
     except Exception as e:
         print("Unable to connect to database: %s" % traceback.format_exc())
         raise e
@@ -163,14 +167,16 @@ def connect_db():
 
 
 def get_db_config():
-    """Connect to database and retrieve config document"""
+    """Retrieve config document, served from the worker's in-process cache"""
     database = connect_db()
+    config_cache = app.extensions['config_cache']
     try:
-        config_document = Database.get_document_by_name(
-            database, 'configuration')
+        config_document = config_cache.get(database)
     except Exception as e:
         print("Unable to retrieve configuration document from database: %s" % traceback.format_exc())
         raise e
+    if app.config.get('CONFIG_CACHE_WATCH'):
+        config_cache.watch(database)
     return config_document
 
 
@@ -189,12 +195,7 @@ def connect_jenkins(account=None):
 def get_db_user_document(username):
     """Connect to database and retrieve user document"""
     database = connect_db()
-    user_document = None
-    users = Database.get_documents_by_type(database, 'user')
-    for user in users:
-        if user['name'] == username:
-            user_document = user
-    return user_document
+    return Database.get_user_by_name(database, username)
 
 
 def set_jenkins_job_params(job_type):
@@ -219,16 +220,35 @@ def get_pipelines_for_dashboard():
         database, doc_type='project')
     pipelines_data = list()
     jenkins_obj = connect_jenkins()
+    # one Jenkins query for all pipelines instead of one per pipeline
+    last_build_statuses = jenkins_obj.get_last_build_statuses([pipeline['name'] for pipeline in pipeline_documents])
+    # one reduced query for the build clone and workspace counts of all pipelines
+    dependents = Database.count_pipeline_dependents(database)
     for pipeline in pipeline_documents:
-        last_build_status = jenkins_obj.get_last_build_status(job_name=pipeline['name'])
+        counts = dependents.get(pipeline.get('pvc'), {})
         # both scm and jenkins URLs are set as part of pipeline_create
         pipelines_data.append({'pipeline_name': pipeline['name'],
                                'scm_url': pipeline['scm_url'],
                                'jenkins_url': pipeline['jenkins_url'],
-                               'last_build': last_build_status})
+                               'last_build': last_build_statuses.get(pipeline['name'], "N/A"),
+                               'builds': counts.get('build', 0),
+                               'workspaces': counts.get('workspace', 0)})
     return pipelines_data
 
 
+def get_dashboard_summary():
+    """
+        Get build and workspace counts for the dashboard, from reduced views
+    """
+    database = connect_db()
+    build_statuses = Database.count_build_statuses(database)
+    workspaces_per_user = Database.count_workspaces_by_user(database)
+    return {'builds': sum(build_statuses.values()),
+            'build_statuses': build_statuses,
+            'workspaces': sum(workspaces_per_user.values()),
+            'workspaces_per_user': workspaces_per_user}
+
+
 def get_pipelines():
     """
         Get all pipelines available
@@ -444,6 +464,8 @@ def delete_workspace(name):
         kube.delete_pvc(pvc)
         logging.info("Workspace PVC deleted")
         db.delete(workspace)
+        # the workspace purge checkpoints the activity of the workspace volume
+        checkpoint.delete_checkpoint(db, 'workspace', workspace['clone'])
     except Exception as e:
         logging.error("Unable to delete workspace %s: %s" % (name, traceback.format_exc()))
         raise
@@ -457,23 +479,38 @@ def get_db_name_from_kube_resource(kube_resource_name):
 
 
 def check_if_workspaces_exist_for_pipeline(name):
-    get_db_config()
+    workspace_list = get_pipeline_dependents(name)['workspace']
+    return len(workspace_list) > 0, workspace_list
+
+
+def get_pipeline_dependents(name):
+    """
+    Retrieve the build clone and workspace PVCs depending on a pipeline
+    :param name: Name of the pipeline
+    :return: dict with the lists of 'build' and 'workspace' PVCs
+    :raises GenericException 404 if the pipeline does not exist
+    """
     db = connect_db()
     # retrieve details for the current pipeline
-    pipeline = Database.get_document_by_name(db, name)
-    # get all workspaces for the pipeline. If one or more workspaces exist, we don't delete the pipeline
-    workspace_list = get_all_ws_pvc_for_pipeline(pipeline['pvc'])
-    print("Got workspace list as:: ", str(workspace_list))
-    return len(workspace_list) > 0, workspace_list
+    pipelines = Database.get_documents_by_names(db, [name], doc_type='project')
+    if not pipelines:
+        raise GenericException(404, "Pipeline %s does not exist" % name)
+    pipeline = pipelines[0]
+    # get all builds and workspaces for the pipeline. If one or more workspaces exist, we don't delete the pipeline
+    dependents = Database.get_pipeline_dependents(db, pipeline['pvc'])
+    logging.debug("Dependents of pipeline %s: %s" % (name, dependents))
+    return dependents
 
 
-def delete_pipeline(name):
+def delete_pipeline(name, workers=1):
     """
     Delete all elements associated with a given pipeline(ONTAP volume/Jenkins job)
     When using Trident, it is sufficient to delete the PVC mapped to the project
     (Trident takes care of deleting the volume and PV)
     After deleting the pipeline's PVC, delete all the build clone PVCs associated with the pipeline
     (Don not proceed with this step, if there is at least one workspace tied to a pipeline build)
+    Build clone PVCs are deleted by up to workers threads, their documents with a single bulk request.
+    Progress is reported to the job running the deletion, if any
     """
     # TODO: Be more specific on what goes in 'try'
     get_db_config()
@@ -481,20 +518,27 @@ def delete_pipeline(name):
     # retrieve details for the current pipeline
     pipeline = Database.get_document_by_name(db, name)
     # if there aren't any workspaces, we can safely delete all the build clones
-    build_pvc_list = get_all_build_pvc_for_pipeline(pipeline['pvc'])
+    builds = list(Database.get_build_clones_by_pipeline(db, pipeline['pvc'], include_docs=True))
+    kube = KubernetesAPI.get_instance()
+
+    def delete_build_pvc(build_pvc):
+        # if this is a re-try (intermittent failure) PVC is already gone
+        try:
+            kube.delete_pvc(build_pvc)
+        except Exception:
+            pass
+        return build_pvc
+
     try:
-        for build_pvc in build_pvc_list:
-            # if this is a re-try (intermittent failure) PVC is already gone
-            try:
-                KubernetesAPI.get_instance().delete_pvc(build_pvc)
-            except Exception:
-                pass
-            # delete the pipeline DB doc
-            db_name = get_db_name_from_kube_resource(build_pvc)
-            build = Database.get_document_by_name(db, db_name)
-            db.delete(build)
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [executor.submit(delete_build_pvc, build.value) for build in builds]
+            # progress is reported from this thread, the job is not known to the pool threads
+            for done, future in enumerate(as_completed(futures), 1):
+                jobs.report_progress(done, len(builds), "Deleted build clone %s" % future.result())
+        # delete the build DB docs
+        Database.delete_documents(db, [build.doc for build in builds if build.doc is not None])
         # when all build clones are deleted successfully, delete the pipeline PVC
-        KubernetesAPI.get_instance().delete_pvc(pipeline['pvc'])
+        kube.delete_pvc(pipeline['pvc'])
         # delete the pipeline DB doc
         db.delete(pipeline)
         # finally delete the Jenkins job
@@ -596,7 +640,11 @@ def _setup_couchdb():
     # Retrieve Kube namespace
     kube_specs = {
         'namespace': app.config['KUBE_NAMESPACE'],
-        'service_type': app.config['SERVICE_TYPE']
+        'service_type': app.config['SERVICE_TYPE'],
+        'cache_staleness': app.config.get('KUBE_CACHE_STALENESS'),
+        'node_strategy': app.config.get('KUBE_NODE_STRATEGY', 'first'),
+        'node_selector': app.config.get('KUBE_NODE_SELECTOR'),
+        'node_cache_ttl': app.config.get('KUBE_NODE_CACHE_TTL', 60)
     }
     KubernetesAPI(kube_specs)
     kube = KubernetesAPI.get_instance()
@@ -660,3 +708,4 @@ def _setup_couchdb():
         config_document['storage_class'] = app.config['STORAGE_CLASS']
 
         config_document.store(database)
+        app.extensions['config_cache'].invalidate()
@@ -0,0 +1,124 @@
+''' Background jobs for long running operations (workspace provisioning, etc.) '''
+import logging
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from web_service.helpers.errors import GenericException
+
+PENDING = 'PENDING'
+RUNNING = 'RUNNING'
+COMPLETED = 'COMPLETED'
+FAILED = 'FAILED'
+
+# job run by the current worker thread, for progress reports
+_current = threading.local()
+
+
+def report_progress(done, total, message=None):
+    '''
+    Record the progress of the job running in the current thread
+    Does nothing when called outside of a job (e.g. a synchronous request)
+    '''
+    job = getattr(_current, 'job', None)
+    if job is not None:
+        job.progress = {'done': done, 'total': total, 'message': message}
+
+
+class Job(object):
+    '''State of one background job'''
+
+    def __init__(self, job_type, template=None):
+        self.id = uuid.uuid4().hex
+        self.type = job_type
+        # template rendered with the job result once the job has completed
+        self.template = template
+        self.status = PENDING
+        self.result = None
+        self.error = None
+        self.progress = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self._done = threading.Event()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        '''Block until the job has completed or failed, returns False on timeout'''
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        '''convert job to dict'''
+        job = {
+            'job_id': self.id,
+            'type': self.type,
+            'status': self.status,
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+            'duration': (self.finished or time.time()) - self.started if self.started else None,
+        }
+        if self.progress is not None:
+            job['progress'] = self.progress
+        if self.error is not None:
+            job['error'] = self.error
+        if self.status == COMPLETED:
+            job['result'] = self.result
+        return job
+
+
+class JobManager(object):
+    '''
+    Run jobs on a bounded thread pool and keep their state for status queries
+    Finished jobs are forgotten after retention seconds
+    '''
+
+    def __init__(self, workers=4, retention=3600):
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._jobs = dict()
+        self._lock = threading.Lock()
+
+    def submit(self, app, job_type, func, *args, template=None, **kwargs):
+        '''
+        Queue func(*args, **kwargs) for execution within an app context of app
+        :return: Job tracking the execution
+        '''
+        job = Job(job_type, template)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, app, job, func, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        '''Return job with id job_id or None'''
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, app, job, func, args, kwargs):
+        job.status, job.started = RUNNING, time.time()
+        _current.job = job
+        try:
+            with app.app_context():
+                job.result = func(*args, **kwargs)
+            job.status = COMPLETED
+        except GenericException as exc:
+            job.error = exc.to_dict()
+            job.status = FAILED
+        except Exception as exc:
+            logging.error("Job %s (%s) failed: %s" % (job.id, job.type, traceback.format_exc()))
+            job.error = {'status_code': 500, 'error': str(exc)}
+            job.status = FAILED
+        _current.job = None
+        job.finished = time.time()
+        job._done.set()
+
+    def _prune(self):
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.done() and time.time() - job.finished > self.retention]
+        for job_id in expired:
+            del self._jobs[job_id]
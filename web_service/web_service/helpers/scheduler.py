@@ -0,0 +1,128 @@
+''' Scheduled purges running in the background of the web service '''
+import logging
+import socket
+import threading
+import traceback
+import uuid
+from web_service.helpers import helpers
+from web_service.helpers import jobs
+import web_service.database.checkpoint as checkpoint
+
+PURGE_TYPES = ('scm', 'ci', 'workspace')
+INTERVAL_ALIASES = {'@hourly': 3600, '@daily': 86400, '@weekly': 604800}
+
+
+def parse_schedule(schedule):
+    """
+    Parse a purge schedule such as 'ci=@hourly,workspace=@daily,scm=43200'
+    Intervals are aliases or seconds, purge types missing from the schedule are not scheduled
+    @return: dict purge type -> interval in seconds
+    """
+    intervals = dict()
+    for entry in (schedule or '').split(','):
+        if not entry.strip():
+            continue
+        purge_type, _, interval = entry.partition('=')
+        purge_type, interval = purge_type.strip(), interval.strip()
+        if purge_type not in PURGE_TYPES:
+            raise ValueError("Invalid purge type %s in purge schedule, expected one of %s"
+                             % (purge_type, ', '.join(PURGE_TYPES)))
+        intervals[purge_type] = INTERVAL_ALIASES.get(interval) or int(interval)
+    return intervals
+
+
+def run_purge(purge_type, workers=1, heartbeat=None):
+    '''
+    Run one purge
+    @param heartbeat: optional callable invoked between volumes, the purge stops if it returns False
+    @return: count of snapshots or workspaces purged
+    '''
+    if purge_type == 'workspace':
+        # imported here, workspace documents import the ONTAP and Kubernetes clients
+        import web_service.database.workspace as workspace_obj
+        count, _ = workspace_obj.purge_old_workspaces(workers=workers, heartbeat=heartbeat)
+        return count
+    import web_service.database.snapshot as snapshot_obj
+    return snapshot_obj.purge(purge_type, workers=workers, heartbeat=heartbeat)
+
+
+def new_owner():
+    '''Unique purge lock owner for this replica'''
+    return '%s-%s' % (socket.gethostname(), uuid.uuid4().hex[:8])
+
+
+def run_locked(database, purge_type, owner, ttl, purge, interval=0):
+    """
+    Run a purge holding the purge lock of its type, scheduled and manual purges never run concurrently
+    The lock is renewed for ttl seconds every time the purge reports a heartbeat
+    @param purge: callable taking the heartbeat, returning the count purged or (count, purged names)
+    @param interval: seconds since the previous run before the purge is due, 0 for manual purges
+    @return: result of purge, None if the purge is not due or another replica runs it
+    """
+    lock = checkpoint.acquire_lock(database, purge_type, owner, ttl, interval)
+    if lock is None:
+        return None
+    logging.info("%s purge started by %s", purge_type, owner)
+    try:
+        result = purge(lambda: checkpoint.renew_lock(database, lock, ttl))
+    except Exception as exc:
+        logging.error("%s purge failed: %s" % (purge_type, traceback.format_exc()))
+        checkpoint.release_lock(database, lock, jobs.FAILED, error=str(exc))
+        raise
+    count = result[0] if isinstance(result, tuple) else result
+    logging.info("%s purge purged %s", purge_type, count)
+    checkpoint.release_lock(database, lock, jobs.COMPLETED, result=count)
+    return result
+
+
+class PurgeScheduler(object):
+    '''
+    Run purges at fixed intervals off the request path
+    Every replica runs a scheduler, the purge lock document in DB elects the replica running each purge
+    '''
+
+    def __init__(self, app, intervals, lock_ttl=7200, poll=60):
+        self.app = app
+        self.intervals = intervals
+        self.lock_ttl = lock_ttl
+        self.poll = poll
+        self.owner = new_owner()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        ''' Start checking for due purges in the background '''
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='purge-scheduler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            with self.app.app_context():
+                for purge_type in self.intervals:
+                    try:
+                        self.run_if_due(purge_type)
+                    except Exception:
+                        logging.error("Scheduled %s purge failed: %s" % (purge_type, traceback.format_exc()))
+            self._stopped.wait(self.poll)
+
+    def run_if_due(self, purge_type):
+        """
+        Run a purge if its interval has elapsed and no other replica runs it, within an app context
+        @return: True if the purge ran on this replica
+        """
+        workers = self.app.config.get('PURGE_WORKERS', 1)
+        try:
+            result = run_locked(helpers.connect_db(), purge_type, self.owner, self.lock_ttl,
+                                lambda heartbeat: run_purge(purge_type, workers, heartbeat),
+                                self.intervals[purge_type])
+        except Exception:
+            # logged and recorded in the purge lock
+            return True
+        return result is not None
@@ -1,8 +1,9 @@
 import os
 import sys
 import unittest
-from unittest.mock import patch, Mock
+from unittest.mock import patch, Mock, MagicMock
 import web_service.helpers.helpers as ut
+from web_service.helpers import jobs
 
 # Set project root directory so coverage.py can generate coverage
 BASE_DIR = os.path.join(os.path.dirname(__file__), '../..')
@@ -21,3 +22,50 @@ class TestHelpersMethods(unittest.TestCase):
         """ Test helper to call setup_couchdb once """
         ut.onetime_setup_required()
         mock_setup.assert_called_once_with()
+
+    @patch('web_service.helpers.helpers.connect_jenkins')
+    @patch('web_service.kub.KubernetesAPI.KubernetesAPI.get_instance')
+    @patch('web_service.database.database.get_document_by_name')
+    @patch('web_service.helpers.helpers.connect_db')
+    @patch('web_service.helpers.helpers.get_db_config')
+    def test_delete_pipeline(self, mock_config, mock_connect_db, mock_get_document, mock_kube, mock_jenkins):
+        """ Test build clones are deleted concurrently, their documents with one bulk request """
+        database = mock_connect_db.return_value
+        pipeline = mock_get_document.return_value = {'name': 'ci-project', 'pvc': 'ci-project-pvc'}
+        builds = [Mock(value='build-%s-pvc' % index, doc=Mock(id='build-%s' % index, rev='1-a'))
+                  for index in range(5)]
+        database.view.return_value = builds
+        database.update.return_value = [(True, build.doc.id, '2-a') for build in builds]
+        # a PVC already deleted by a previous attempt does not stop the deletion
+        mock_kube.return_value.delete_pvc.side_effect = lambda pvc: None if pvc != 'build-2-pvc' else 1 / 0
+        progress = []
+        reports = Mock(side_effect=lambda done, total, message: progress.append((done, total)))
+        with patch('web_service.helpers.jobs.report_progress', reports):
+            ut.delete_pipeline('ci-project', workers=3)
+        database.view.assert_called_once_with('snapshot/get_build_clones_by_pipeline', key='ci-project-pvc',
+                                              include_docs=True)
+        deleted_pvcs = [call[0][0] for call in mock_kube.return_value.delete_pvc.call_args_list]
+        self.assertEqual(sorted(deleted_pvcs[:-1]), ['build-%s-pvc' % index for index in range(5)])
+        self.assertEqual(deleted_pvcs[-1], 'ci-project-pvc')
+        database.update.assert_called_once_with([{'_id': 'build-%s' % index, '_rev': '1-a', '_deleted': True}
+                                                 for index in range(5)])
+        database.delete.assert_called_once_with(pipeline)
+        mock_jenkins.return_value.delete_job.assert_called_once_with('ci-project')
+        self.assertEqual(progress, [(done, 5) for done in range(1, 6)])
+
+    @patch('web_service.helpers.helpers.connect_jenkins')
+    @patch('web_service.kub.KubernetesAPI.KubernetesAPI.get_instance')
+    @patch('web_service.database.database.get_document_by_name')
+    @patch('web_service.helpers.helpers.connect_db')
+    @patch('web_service.helpers.helpers.get_db_config')
+    def test_delete_pipeline_job_progress(self, mock_config, mock_connect_db, mock_get_document, mock_kube,
+                                          mock_jenkins):
+        """ Test progress of build clones deleted by several workers is recorded in the running job """
+        database = mock_connect_db.return_value
+        mock_get_document.return_value = {'name': 'ci-project', 'pvc': 'ci-project-pvc'}
+        database.view.return_value = [Mock(value='build-%s-pvc' % index, doc=None) for index in range(4)]
+        manager = jobs.JobManager(workers=1)
+        job = manager.submit(MagicMock(), 'pipeline-delete', ut.delete_pipeline, 'ci-project', workers=3)
+        self.assertTrue(job.wait(5))
+        self.assertEqual(job.status, jobs.COMPLETED)
+        self.assertEqual((job.progress['done'], job.progress['total']), (4, 4))
@@ -0,0 +1,58 @@
+""" Test scheduled purges """
+import unittest
+from unittest.mock import patch, Mock
+import web_service.helpers.scheduler as ut
+
+
+class TestPurgeScheduler(unittest.TestCase):
+    """ Test purge schedule and leader lock handling """
+
+    def test_parse_schedule(self):
+        """ Test intervals are parsed from aliases and seconds """
+        self.assertEqual(ut.parse_schedule('ci=@hourly, scm=600,workspace=@daily'),
+                         {'ci': 3600, 'scm': 600, 'workspace': 86400})
+        self.assertEqual(ut.parse_schedule(''), {})
+        self.assertRaises(ValueError, ut.parse_schedule, 'builds=@daily')
+
+    @patch('web_service.helpers.helpers.connect_db')
+    @patch('web_service.database.checkpoint.release_lock')
+    @patch('web_service.database.checkpoint.acquire_lock')
+    @patch('web_service.database.snapshot.purge')
+    def test_run_if_due(self, mock_purge, mock_acquire, mock_release, mock_connect_db):
+        """ Test a purge runs only on the replica holding the lock and its status is recorded """
+        scheduler = ut.PurgeScheduler(Mock(config={'PURGE_WORKERS': 4}), {'ci': 3600})
+        mock_acquire.return_value = None
+        self.assertFalse(scheduler.run_if_due('ci'))
+        mock_purge.assert_not_called()
+
+        lock = mock_acquire.return_value = Mock()
+        mock_purge.return_value = 3
+        self.assertTrue(scheduler.run_if_due('ci'))
+        mock_purge.assert_called_once()
+        self.assertEqual(mock_purge.call_args[1]['workers'], 4)
+        mock_release.assert_called_once_with(mock_connect_db.return_value, lock, 'COMPLETED', result=3)
+
+        mock_release.reset_mock()
+        mock_purge.side_effect = IOError('ONTAP unreachable')
+        self.assertTrue(scheduler.run_if_due('ci'))
+        mock_release.assert_called_once_with(mock_connect_db.return_value, lock, 'FAILED',
+                                             error='ONTAP unreachable')
+
+    @patch('web_service.database.checkpoint.release_lock')
+    @patch('web_service.database.checkpoint.renew_lock')
+    @patch('web_service.database.checkpoint.acquire_lock')
+    def test_run_locked_heartbeat(self, mock_acquire, mock_renew, mock_release):
+        """ Test the heartbeat of a purge renews its lock """
+        database, lock = Mock(), mock_acquire.return_value
+        mock_renew.return_value = True
+
+        def purge(heartbeat):
+            self.assertTrue(heartbeat())
+            self.assertTrue(heartbeat())
+            return 2, ['ws_1', 'ws_2']
+
+        self.assertEqual(ut.run_locked(database, 'workspace', 'replica-1', 600, purge), (2, ['ws_1', 'ws_2']))
+        mock_acquire.assert_called_once_with(database, 'workspace', 'replica-1', 600, 0)
+        self.assertEqual(mock_renew.call_count, 2)
+        mock_renew.assert_called_with(database, lock, 600)
+        mock_release.assert_called_once_with(database, lock, 'COMPLETED', result=2)
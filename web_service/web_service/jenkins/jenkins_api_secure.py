@@ -1,5 +1,6 @@
 """ Connect to Jenkins instance and perfom openations using python jenkins module """
 import base64
+from concurrent.futures import ThreadPoolExecutor
 import jenkinsapi as j
 import jinja2
 import logging
@@ -8,6 +9,9 @@ import requests
 import urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# upper bound on concurrent Jenkins requests when falling back to per-job status lookups
+MAX_STATUS_WORKERS = 8
+
 
 class JenkinsAPI(object):
     """ Provides API methods for the following:
@@ -87,6 +91,34 @@ class JenkinsAPI(object):
             build_status = last_bld.get_status()
         return build_status
 
+    def get_last_build_statuses(self, job_names):
+        """
+        Get last build status for many jobs at once
+        A single api/json query returns the last build of every job; if that query fails
+        the statuses are looked up per job with a bounded thread pool
+        :param job_names: list of job names
+        :return: dict() job_name -> status, "N/A" for unknown jobs or jobs without builds
+        """
+        url = "{}/api/json?tree=jobs[name,lastBuild[number,result]]".format(self.url)
+        try:
+            response = requests.get(url, auth=(self.username, self.password), verify=False)
+            response.raise_for_status()
+            jobs = {job['name']: job.get('lastBuild') for job in response.json().get('jobs', [])}
+        except Exception as exc:
+            logging.warning("Batched build status query failed, querying jobs one by one: %s", str(exc))
+            if not job_names:
+                return dict()
+            with ThreadPoolExecutor(max_workers=min(MAX_STATUS_WORKERS, len(job_names))) as executor:
+                return dict(zip(job_names, executor.map(self.get_last_build_status, job_names)))
+        statuses = dict()
+        for job_name in job_names:
+            last_build = jobs.get(job_name)
+            if last_build is None or last_build.get('number', 0) == 0:
+                statuses[job_name] = "N/A"
+            else:
+                statuses[job_name] = last_build.get('result')
+        return statuses
+
     def get_job_url_headers(self, job_name):
         """
         Construct url from job_name
@@ -4,6 +4,7 @@ import os
 import sys
 import unittest
 from unittest.mock import patch, Mock
+import requests
 import web_service.jenkins.jenkins_api_secure as j
 
 # Set project root directory so coverage.py can generate coverage
@@ -111,6 +112,34 @@ class TestJenkinsAPI(unittest.TestCase):
             builds = jenkins.get_successful_builds('job1')
             self.assertTrue(len(builds) == 1)
 
+    @patch('requests.get')
+    def test_get_last_build_statuses(self, mock_get_requests):
+        """
+            Test batched last build status for several jobs in one request
+        """
+        with patch.object(j.JenkinsAPI, "__init__", lambda v, w, x, y: None):
+            jenkins = j.JenkinsAPI(None, None, None)
+            jenkins.url, jenkins.username, jenkins.password = "https://test.com", "user", "pass"
+            mock_get_requests.return_value.json.return_value = {"jobs": [
+                {'name': 'job1', 'lastBuild': {'number': 3, 'result': 'SUCCESS'}},
+                {'name': 'job2', 'lastBuild': None}
+            ]}
+            statuses = jenkins.get_last_build_statuses(['job1', 'job2', 'job3'])
+            self.assertEqual(mock_get_requests.call_count, 1)
+            self.assertEqual(statuses, {'job1': 'SUCCESS', 'job2': 'N/A', 'job3': 'N/A'})
+
+    @patch('requests.get', side_effect=requests.ConnectionError)
+    def test_get_last_build_statuses_fallback(self, mock_get_requests):
+        """
+            Test per-job status lookup when the batched query fails
+        """
+        with patch.object(j.JenkinsAPI, "__init__", lambda v, w, x, y: None):
+            jenkins = j.JenkinsAPI(None, None, None)
+            jenkins.url, jenkins.username, jenkins.password = "https://test.com", "user", "pass"
+            jenkins.get_last_build_status = Mock(side_effect={'job1': 'FAILURE', 'job2': 'SUCCESS'}.get)
+            statuses = jenkins.get_last_build_statuses(['job1', 'job2'])
+            self.assertEqual(statuses, {'job1': 'FAILURE', 'job2': 'SUCCESS'})
+
     # def test_create_trigger_purge_job(self):
     #     """
     #         Test creation of trigger purge job in Jenkins
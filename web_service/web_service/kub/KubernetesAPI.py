@@ -1,13 +1,20 @@
 ''' Connect to Kubernetes and perform operations using Kubernetes REST API '''
-from time import sleep
-from kubernetes import client, config
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from kubernetes import client, config, watch
 from kubernetes.client.rest import ApiException
 from kubernetes.stream import stream
+from web_service.kub.informer import Informer
 from web_service.ontap.ontap_service import OntapService
 from web_service.helpers import helpers
 import os
 import logging
 
+# node roles never used to expose services
+MASTER_ROLE_LABELS = ('node-role.kubernetes.io/master', 'node-role.kubernetes.io/control-plane')
+
 
 class KubernetesAPI:
     ''' Kubernetes API methods to perform the following:
@@ -45,8 +52,20 @@ class KubernetesAPI:
         client.configuration.verify_ssl = False
         self.api = client.CoreV1Api()
         self.namespace, self.service_type = None, None
+        # seconds a cached resource may lag behind the API server, None disables the cache
+        self.cache_staleness = None
+        self.cache = None
+        # node used for NodePort service URLs: 'first', 'round-robin' or 'label' (first node matching node_selector)
+        self.node_strategy = 'first'
+        self.node_selector = None
+        self.node_cache_ttl = 60
+        self._node_addresses, self._node_refreshed = None, 0
+        self._node_lock = threading.Lock()
+        self._node_cycle = itertools.count()
         for key in specs:
             setattr(self, key, specs[key])
+        if self.cache_staleness:
+            self.enable_cache(self.cache_staleness)
         self.init_complete = True
 
     @staticmethod
@@ -56,6 +75,29 @@ class KubernetesAPI:
                             'please initialize class and try again')
         return KubernetesAPI.__kube_instance
 
+    def enable_cache(self, staleness=30):
+        ''' Serve PVC, PV, Service, Pod and Node reads from list-watched in-memory copies '''
+        self.cache = {
+            'pvc': Informer(self.api.list_namespaced_persistent_volume_claim, (self.namespace,), staleness),
+            'pv': Informer(self.api.list_persistent_volume, (), staleness),
+            'service': Informer(self.api.list_namespaced_service, (self.namespace,), staleness),
+            'pod': Informer(self.api.list_namespaced_pod, (self.namespace,), staleness),
+            'node': Informer(self.api.list_node, (), staleness),
+        }
+        for informer in self.cache.values():
+            informer.start()
+
+    def get_cached(self, resource, name=None):
+        '''
+        Look up a resource in the in-memory cache
+        :return: resource object (list of all objects if name is None), None if not cached or stale
+        '''
+        if not self.cache:
+            return None
+        if name is None:
+            return self.cache[resource].list()
+        return self.cache[resource].get(name)
+
     @staticmethod
     def parse_exception(exc):
         ''' Extract key fields from exception
@@ -120,16 +162,14 @@ class KubernetesAPI:
         kube_pvc = self.get_kube_resource_name(vol_name, 'pvc')
         pvc_status = self.create_pvc_with_sc(kube_pvc, size_to_bytes, storage_class)
         phase = ""
-        counter = 0
+        elapsed = 0
         if pvc_status['code'] == 201:
             # wait for PVC to be ready!
-            while phase != 'Bound' and counter < 60:
-                counter += 1
-                sleep(1)
-                # removed direct call to api.pvc_status
-                status = self.read_status("pvc", pvc_status['resource_name'])
-                phase = status.status.phase
-        pvc_status['time'] = counter
+            start = time.time()
+            _, pvc = self.wait_for("pvc", pvc_status['resource_name'], self.pvc_bound, timeout=60)
+            elapsed = int(time.time() - start)
+            phase = pvc.status.phase if pvc is not None else ""
+        pvc_status['time'] = elapsed
         pvc_status['name'] = kube_pvc
         pvc_status['phase'] = phase
         if pvc_status['phase'] != 'Bound':
@@ -153,27 +193,68 @@ class KubernetesAPI:
 
         :param clone: Name of the PVC being created
         :param source: Name of the PVC to clone from
+        :return: status of PVC creation, with 'bound' False if the new PVC was not bound within 60 seconds
+        '''
+        pvc_status = self.create_pvc_clone_from_source(clone, source)
+        if pvc_status['code'] == 201:
+            # wait for PVC to be ready!
+            start = time.time()
+            pvc_status['bound'], _ = self.wait_for("pvc", pvc_status['resource_name'], self.pvc_bound, timeout=60)
+            pvc_status['time'] = int(time.time() - start)
+        pvc_status['name'] = clone
+        return pvc_status
+
+    def create_pvc_clone_resources(self, clones, workers=4):
+        '''
+        Create several PVCs cloning source PVCs using Trident, without waiting for them to be bound
+        PVCs are created concurrently, see wait_for_pvc_clones()
+
+        :param clones: list of (clone, source) PVC names
+        :param workers: maximum number of concurrent PVC creations
+        :return: list of status of PVC creation, in the order of clones
+        '''
+        if not clones:
+            return []
+
+        def create(clone, source):
+            try:
+                return self.create_pvc_clone_from_source(clone, source)
+            except ApiException as exc:
+                err = "Exception calling CoreV1Api->read_namespaced_persistent_volume_claim: %s\n" % exc
+                return OntapService.set_status(400, "PVC", clone, err)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(clones)))) as executor:
+            statuses = list(executor.map(lambda clone: create(*clone), clones))
+        for (clone, _), pvc_status in zip(clones, statuses):
+            pvc_status['name'] = clone
+        return statuses
+
+    def wait_for_pvc_clones(self, statuses, timeout=60):
+        '''
+        Wait for the PVCs created by create_pvc_clone_resources() with a single watch
+        Sets 'bound' and the seconds waited in 'time' in the status of each created PVC
+
+        :param statuses: status of PVC creation of the clones to wait for
+        '''
+        start = time.time()
+        created = [pvc_status for pvc_status in statuses if pvc_status['code'] == 201]
+        bound = self.wait_for_all("pvc", [pvc_status['resource_name'] for pvc_status in created],
+                                  self.pvc_bound, timeout=timeout)
+        for pvc_status in created:
+            pvc_status['bound'] = pvc_status['resource_name'] in bound
+            pvc_status['time'] = int(time.time() - start)
+        return statuses
+
+    def create_pvc_clone_from_source(self, clone, source):
+        '''
+        Create a PVC cloning the source PVC with the size and storage class of the source, without waiting
         :return: status of PVC creation
         '''
         # TODO: refactor this method, combine to more generic methods
         pvc_data = self.api.read_namespaced_persistent_volume_claim(name=source, namespace=self.namespace)
         pvc_size = pvc_data.spec.resources.requests['storage']
         storage_class = pvc_data.spec.storage_class_name
-        pvc_status = self.create_pvc_clone(clone, source, pvc_size, storage_class)
-        if pvc_status['code'] == 201:
-            # wait for PVC to be ready!
-            phase = ""
-            counter = 0
-            while phase != 'Bound' and counter < 60:
-                counter += 1
-                sleep(1)
-                # removed direct call to api.pvc_status
-                status = self.read_status(
-                    "pvc", pvc_status['resource_name'])
-                phase = status.status.phase
-            pvc_status['time'] = counter
-        pvc_status['name'] = clone
-        return pvc_status
+        return self.create_pvc_clone(clone, source, pvc_size, storage_class)
 
     def create_pvc_with_sc(self, pvc_name, pvc_size, storage_class):
         ''' Create PVC with name 'vol_name' and size 'pvc_size' '''
@@ -222,12 +303,15 @@ class KubernetesAPI:
         return status
 
     def get_pv_name_from_pvc(self, pvc_name):
-        pvc_data = self.api.read_namespaced_persistent_volume_claim(name=pvc_name, namespace=self.namespace)
+        pvc_data = self.get_cached('pvc', pvc_name)
+        if pvc_data is None or pvc_data.spec.volume_name is None:
+            # not cached yet or cached before it was bound
+            pvc_data = self.api.read_namespaced_persistent_volume_claim(name=pvc_name, namespace=self.namespace)
         return pvc_data.spec.volume_name
 
     def get_volume_name_from_pvc(self, pvc_name, vol_type='nfs'):
         pv_name = self.get_pv_name_from_pvc(pvc_name)
-        pv_data = self.api.read_persistent_volume(pv_name)
+        pv_data = self.get_cached('pv', pv_name) or self.api.read_persistent_volume(pv_name)
         volume_path = '__UNKNOWN__'
         logging.debug('PV: %s' % repr(pv_data.spec))
         if pv_data.spec.csi is not None:
@@ -244,9 +328,143 @@ class KubernetesAPI:
 
     def read_status(self, resource, name):
         if resource == "pv":
-            return self.api.read_persistent_volume_status(name)
+            return self.get_cached('pv', name) or self.api.read_persistent_volume_status(name)
+        elif resource == "pvc":
+            return self.get_cached('pvc', name) or \
+                self.api.read_namespaced_persistent_volume_claim_status(name, self.namespace)
+
+    def get_list_method(self, resource):
+        '''
+        Return the list method of the API for a resource type and its positional arguments,
+        as expected by the watch API
+        :param resource: one of 'pv', 'pvc', 'pod', 'service'
+        '''
+        if resource == "pv":
+            return self.api.list_persistent_volume, ()
         elif resource == "pvc":
-            return self.api.read_namespaced_persistent_volume_claim_status(name, self.namespace)
+            return self.api.list_namespaced_persistent_volume_claim, (self.namespace,)
+        elif resource == "pod":
+            return self.api.list_namespaced_pod, (self.namespace,)
+        elif resource == "service":
+            return self.api.list_namespaced_service, (self.namespace,)
+        else:
+            raise ValueError("Unsupported resource type for wait: %s" % resource)
+
+    def wait_for(self, resource, name, predicate, timeout=60):
+        '''
+        Wait until predicate(object) is true for the named resource
+        The current state is read first, then changes are followed with the watch API
+        so the wait returns as soon as the resource reaches the expected state
+        :param resource: one of 'pv', 'pvc', 'pod', 'service'
+        :param name: name of the resource
+        :param predicate: function called with the resource object
+        :param timeout: maximum wait in seconds
+        :return: (True if predicate was satisfied, last seen resource object or None)
+        '''
+        list_method, args = self.get_list_method(resource)
+        field_selector = 'metadata.name=%s' % name
+        deadline = time.time() + timeout
+        current = list_method(*args, field_selector=field_selector)
+        obj = current.items[0] if current.items else None
+        if obj is not None and predicate(obj):
+            return True, obj
+        resource_version = current.metadata.resource_version
+        resource_watch = watch.Watch()
+        while time.time() < deadline:
+            try:
+                for event in resource_watch.stream(list_method, *args, field_selector=field_selector,
+                                                   resource_version=resource_version,
+                                                   timeout_seconds=max(1, int(deadline - time.time()))):
+                    if event['type'] == 'DELETED':
+                        obj = None
+                        continue
+                    obj = event['object']
+                    resource_version = obj.metadata.resource_version
+                    if predicate(obj):
+                        resource_watch.stop()
+                        return True, obj
+            except ApiException as exc:
+                # 410 Gone when resource_version is too old: restart from the current state
+                if exc.status != 410:
+                    raise
+                logging.warning("Watch on %s %s interrupted: %s" % (resource, name, exc.reason))
+                current = list_method(*args, field_selector=field_selector)
+                obj = current.items[0] if current.items else None
+                if obj is not None and predicate(obj):
+                    return True, obj
+                resource_version = current.metadata.resource_version
+        logging.error("Timeout after %s seconds waiting for %s %s" % (timeout, resource, name))
+        return False, obj
+
+    def wait_for_all(self, resource, names, predicate, timeout=60):
+        '''
+        Wait until predicate(object) is true for all named resources, following changes with one watch
+        :param resource: one of 'pv', 'pvc', 'pod', 'service'
+        :param names: names of the resources
+        :param predicate: function called with the resource object
+        :param timeout: maximum wait in seconds
+        :return: set of names for which predicate was satisfied
+        '''
+        list_method, args = self.get_list_method(resource)
+        pending = set(names)
+        deadline = time.time() + timeout
+
+        def relist():
+            current = list_method(*args)
+            pending.difference_update(item.metadata.name for item in current.items if predicate(item))
+            return current.metadata.resource_version
+
+        if not pending:
+            return set()
+        resource_version = relist()
+        resource_watch = watch.Watch()
+        while pending and time.time() < deadline:
+            try:
+                for event in resource_watch.stream(list_method, *args, resource_version=resource_version,
+                                                   timeout_seconds=max(1, int(deadline - time.time()))):
+                    obj = event['object']
+                    resource_version = obj.metadata.resource_version
+                    if event['type'] != 'DELETED' and obj.metadata.name in pending and predicate(obj):
+                        pending.discard(obj.metadata.name)
+                        if not pending:
+                            resource_watch.stop()
+                            break
+            except ApiException as exc:
+                # 410 Gone when resource_version is too old: restart from the current state
+                if exc.status != 410:
+                    raise
+                logging.warning("Watch on %s interrupted: %s" % (resource, exc.reason))
+                resource_version = relist()
+        if pending:
+            logging.error("Timeout after %s seconds waiting for %s %s"
+                          % (timeout, resource, ', '.join(sorted(pending))))
+        return set(names) - pending
+
+    @staticmethod
+    def pvc_bound(pvc):
+        ''' PVC is bound to a PV '''
+        return pvc.status.phase == 'Bound'
+
+    @staticmethod
+    def pv_available(pv):
+        ''' PV is ready to be claimed '''
+        return pv.status.phase == 'Available'
+
+    @staticmethod
+    def pod_initialized(pod):
+        ''' Pod init containers have completed (successfully or not) '''
+        return pod.status.phase in ('Running', 'Succeeded', 'Failed')
+
+    @staticmethod
+    def pod_running(pod):
+        ''' Pod containers have started '''
+        return pod.status.phase == 'Running'
+
+    def service_has_address(self, service):
+        ''' Service can be reached from outside the cluster '''
+        if self.service_type == 'LoadBalancer':
+            return bool(service.status.load_balancer and service.status.load_balancer.ingress)
+        return bool(service.spec.ports and service.spec.ports[0].node_port)
 
     def create_pv_and_pvc(self, vol_name, size, ontap_cluster_data_lif):
         ''' Create PV and PVC enabled to use the volume 'vol_name' '''
@@ -258,30 +476,17 @@ class KubernetesAPI:
 
         if pv_status['code'] == 201:
             # wait for PV to be ready!
-            phase = ""
-            counter = 0
-            while phase != 'Available' and counter < 10:
-                counter += 1
-                sleep(1)
-                status = self.read_status(
-                    "pv", pv_status['resource_name'])
-                phase = status.status.phase
-            pv_status['time'] = counter
+            start = time.time()
+            self.wait_for("pv", pv_status['resource_name'], self.pv_available, timeout=10)
+            pv_status['time'] = int(time.time() - start)
 
         pvc_status = self.create_pvc(
             vol_name_no_underscore, size_to_mb)
         if pvc_status['code'] == 201:
             # wait for PVC to be ready!
-            phase = ""
-            counter = 0
-            while phase != 'Bound' and counter < 10:
-                counter += 1
-                sleep(1)
-                # removed direct call to api.pvc_status
-                status = self.read_status(
-                    "pvc", pvc_status['resource_name'])
-                phase = status.status.phase
-            pvc_status['time'] = counter
+            start = time.time()
+            self.wait_for("pvc", pvc_status['resource_name'], self.pvc_bound, timeout=10)
+            pvc_status['time'] = int(time.time() - start)
 
         return [pv_status, pvc_status]
 
@@ -347,7 +552,10 @@ class KubernetesAPI:
             # create a temporary pod to set UID GID For workspace
             self.api.create_namespaced_pod(self.namespace, temp_pod)
             logging.info("Changing UID and GID for the workspace clone volume")
-            sleep(10)   # TODO: Change this to wait on pod status
+            # the init container changes ownership, the pod leaves Pending once it has completed
+            initialized, _ = self.wait_for("pod", workspace['temp_pod_name'], self.pod_initialized, timeout=120)
+            if not initialized:
+                logging.warning("Timeout waiting for pod %s to change UID and GID" % workspace['temp_pod_name'])
             # delete the temp pod
             self.delete_pod(workspace['temp_pod_name'])
             self.api.create_namespaced_pod(self.namespace, body)
@@ -649,7 +857,8 @@ class KubernetesAPI:
 
     def get_service_type(self, service_name):
         try:
-            response = self.api.read_namespaced_service(name=service_name, namespace=self.namespace)
+            response = self.get_cached('service', service_name) or \
+                self.api.read_namespaced_service(name=service_name, namespace=self.namespace)
             # determine service service_type
             return response.spec.type
         except ApiException as exc:
@@ -663,7 +872,8 @@ class KubernetesAPI:
         """
         try:
             # Get nodeport for service
-            response = self.api.read_namespaced_service(name=service_name, namespace=self.namespace)
+            response = self.get_cached('service', service_name) or \
+                self.api.read_namespaced_service(name=service_name, namespace=self.namespace)
             # determine service service_type
             if self.service_type == 'LoadBalancer':
                 ip = response.status.load_balancer.ingress[0].ip
@@ -683,19 +893,83 @@ class KubernetesAPI:
 
     def get_worker_node(self):
         """
-        Retrieve any worker node
-        Returns node hostname if found or empty string if not
+        Retrieve a Ready worker node according to node_strategy
+        Returns node InternalIP if found or empty string if not
         """
-
         try:
-            for address in self.api.list_node().items[0].status.addresses:
-                if address.type == 'InternalIP':
-                    return str(address.address)
-                pass
+            addresses = self.get_worker_node_addresses()
         except ApiException as exc:
             err = "Error while retrieving worker node: %s\n" % (exc)
             print(err)
-        return ""
+            return ""
+        if not addresses:
+            return ""
+        if self.node_strategy == 'round-robin':
+            return addresses[next(self._node_cycle) % len(addresses)]
+        return addresses[0]
+
+    def get_worker_node_addresses(self):
+        """
+        InternalIP addresses of Ready worker nodes, sorted by node name
+        Only nodes matching node_selector are kept with the 'label' strategy
+        Served from the node cache when enabled, otherwise memoized for node_cache_ttl seconds
+        """
+        selector = self.node_selector if self.node_strategy == 'label' else None
+        nodes = self.get_cached('node')
+        if nodes is None:
+            with self._node_lock:
+                if self._node_addresses is not None and time.time() - self._node_refreshed < self.node_cache_ttl:
+                    return self._node_addresses
+            nodes = self.api.list_node(label_selector=selector or '').items
+            addresses = self._ready_worker_addresses(nodes)
+            with self._node_lock:
+                self._node_addresses, self._node_refreshed = addresses, time.time()
+            return addresses
+        if selector:
+            nodes = [node for node in nodes if self.match_labels(node.metadata.labels, selector)]
+        return self._ready_worker_addresses(nodes)
+
+    @staticmethod
+    def _ready_worker_addresses(nodes):
+        ready = [node for node in nodes if KubernetesAPI.node_ready(node)]
+        # single node clusters schedule workloads on the master
+        workers = [node for node in ready
+                   if not any(label in (node.metadata.labels or {}) for label in MASTER_ROLE_LABELS)] or ready
+        addresses = []
+        for node in sorted(workers, key=lambda node: node.metadata.name):
+            for address in node.status.addresses or []:
+                if address.type == 'InternalIP':
+                    addresses.append(str(address.address))
+                    break
+        return addresses
+
+    @staticmethod
+    def node_ready(node):
+        return not node.spec.unschedulable and \
+            any(condition.type == 'Ready' and condition.status == 'True'
+                for condition in node.status.conditions or [])
+
+    @staticmethod
+    def match_labels(labels, selector):
+        """
+        Match labels against an equality based label selector, e.g. 'role=build,!gpu,zone!=b'
+        """
+        labels = labels or {}
+        for requirement in filter(None, [part.strip() for part in selector.split(',')]):
+            if '!=' in requirement:
+                key, value = [token.strip() for token in requirement.split('!=', 1)]
+                if labels.get(key) == value:
+                    return False
+            elif '=' in requirement:
+                key, value = [token.strip() for token in requirement.replace('==', '=').split('=', 1)]
+                if labels.get(key) != value:
+                    return False
+            elif requirement.startswith('!'):
+                if requirement[1:].strip() in labels:
+                    return False
+            elif requirement not in labels:
+                return False
+        return True
 
     def execute_command_in_pod(self, pod_name, command):
         """
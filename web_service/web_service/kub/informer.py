@@ -0,0 +1,92 @@
+''' In-memory copies of Kubernetes resources kept up to date with list + watch '''
+import logging
+import threading
+import time
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+
+
+class Informer(object):
+    '''
+    In-memory copy of one kind of Kubernetes resource, keyed by resource name
+    A daemon thread lists the resources once, then applies watch events to the copy.
+    Lookups return None when the copy has not been confirmed in sync for more than
+    staleness seconds, so that callers fall back to reading the API server
+    '''
+
+    def __init__(self, list_method, args=(), staleness=30):
+        self.list_method = list_method
+        self.args = args
+        self.staleness = staleness
+        self._items = dict()
+        self._synced_at = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        ''' Start following changes in the background '''
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='informer-%s' % self.list_method.__name__)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        ''' Stop following changes, lookups return None once the copy is stale '''
+        self._stopped.set()
+
+    def fresh(self):
+        ''' True if the copy was in sync within the staleness bound '''
+        return time.time() - self._synced_at <= self.staleness
+
+    def get(self, name):
+        ''' Return resource object by name, None if unknown or stale '''
+        with self._lock:
+            if not self.fresh():
+                return None
+            return self._items.get(name)
+
+    def list(self):
+        ''' Return all resource objects, None if stale '''
+        with self._lock:
+            if not self.fresh():
+                return None
+            return list(self._items.values())
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                resource_version = self._relist()
+                self._watch(resource_version)
+            except Exception as exc:
+                logging.warning("Informer %s out of sync, re-listing: %s" % (self.list_method.__name__, str(exc)))
+                self._stopped.wait(1)
+
+    def _relist(self):
+        current = self.list_method(*self.args)
+        with self._lock:
+            self._items = {item.metadata.name: item for item in current.items}
+            self._synced_at = time.time()
+        return current.metadata.resource_version
+
+    def _watch(self, resource_version):
+        resource_watch = watch.Watch()
+        # end each watch well within the staleness bound to confirm nothing was missed
+        timeout = max(1, int(self.staleness / 2))
+        while not self._stopped.is_set():
+            for event in resource_watch.stream(self.list_method, *self.args,
+                                               resource_version=resource_version, timeout_seconds=timeout):
+                if event['type'] == 'ERROR':
+                    raise ApiException(reason="Watch error: %s" % event.get('raw_object'))
+                obj = event['object']
+                with self._lock:
+                    if event['type'] == 'DELETED':
+                        self._items.pop(obj.metadata.name, None)
+                    else:
+                        self._items[obj.metadata.name] = obj
+                    self._synced_at = time.time()
+                resource_version = obj.metadata.resource_version
+            with self._lock:
+                self._synced_at = time.time()
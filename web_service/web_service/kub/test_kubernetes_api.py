@@ -4,9 +4,11 @@ import os
 import sys
 import unittest
 from unittest.mock import patch, Mock
+from kubernetes.client.rest import ApiException
 # fix circular dependency with web_service.kub.KubernetesAPI
 from web_service.helpers import helpers
 import web_service.kub.KubernetesAPI as ut
+from web_service.kub.informer import Informer
 from web_service.ontap.ontap_service import OntapService as ontap
 
 # Set project root directory so coverage.py can generate coverage
@@ -149,3 +151,143 @@ class TestKubernetesAPIMethods(unittest.TestCase):
         service_name = 'kubernetes'
         result = self.kube_api.get_service_url(service_name)
         self.assertEqual(result, "http://%s:%s" % (mock_node, "31455"))
+
+    @patch('web_service.kub.KubernetesAPI.watch.Watch')
+    @patch('kubernetes.client.CoreV1Api.list_namespaced_persistent_volume_claim')
+    def test_wait_for_pvc_bound(self, mock_list_pvc, mock_watch):
+        """Test wait_for returns as soon as the watched PVC is bound"""
+        pending = Mock(status=Mock(phase='Pending'))
+        bound = Mock(status=Mock(phase='Bound'))
+        mock_list_pvc.return_value = Mock(items=[pending], metadata=Mock(resource_version='1'))
+        mock_watch.return_value.stream.return_value = iter([{'type': 'MODIFIED', 'object': pending},
+                                                            {'type': 'MODIFIED', 'object': bound}])
+        ready, pvc = self.kube_api.wait_for('pvc', 'test-pvc', self.kube_api.pvc_bound, timeout=5)
+        self.assertTrue(ready)
+        self.assertIs(pvc, bound)
+        mock_list_pvc.assert_called_once_with('12345', field_selector='metadata.name=test-pvc')
+        mock_watch.return_value.stop.assert_called_once_with()
+
+    @patch('web_service.kub.KubernetesAPI.watch.Watch')
+    @patch('kubernetes.client.CoreV1Api.list_namespaced_pod')
+    def test_wait_for_current_state(self, mock_list_pod, mock_watch):
+        """Test wait_for does not watch if the resource is already in the expected state"""
+        running = Mock(status=Mock(phase='Running'))
+        mock_list_pod.return_value = Mock(items=[running], metadata=Mock(resource_version='1'))
+        ready, pod = self.kube_api.wait_for('pod', 'test-pod', self.kube_api.pod_running, timeout=5)
+        self.assertTrue(ready)
+        mock_watch.assert_not_called()
+
+    @patch('web_service.kub.KubernetesAPI.watch.Watch')
+    @patch('kubernetes.client.CoreV1Api.list_namespaced_persistent_volume_claim')
+    def test_wait_for_watch_errors(self, mock_list_pvc, mock_watch):
+        """Test wait_for restarts the watch when its resource version expired and raises other errors"""
+        pending = Mock(status=Mock(phase='Pending'))
+        bound = Mock(status=Mock(phase='Bound'))
+        mock_list_pvc.side_effect = [Mock(items=[pending], metadata=Mock(resource_version='1')),
+                                     Mock(items=[bound], metadata=Mock(resource_version='2'))]
+        mock_watch.return_value.stream.side_effect = ApiException(status=410, reason='Gone')
+        ready, pvc = self.kube_api.wait_for('pvc', 'test-pvc', self.kube_api.pvc_bound, timeout=5)
+        self.assertTrue(ready)
+        self.assertIs(pvc, bound)
+        mock_list_pvc.side_effect = None
+        mock_list_pvc.return_value = Mock(items=[pending], metadata=Mock(resource_version='1'))
+        mock_watch.return_value.stream.side_effect = ApiException(status=403, reason='Forbidden')
+        with self.assertRaises(ApiException):
+            self.kube_api.wait_for('pvc', 'test-pvc', self.kube_api.pvc_bound, timeout=5)
+
+    @patch('web_service.kub.KubernetesAPI.watch.Watch')
+    @patch('kubernetes.client.CoreV1Api.list_namespaced_persistent_volume_claim')
+    @patch('kubernetes.client.CoreV1Api.create_namespaced_persistent_volume_claim')
+    @patch('kubernetes.client.CoreV1Api.read_namespaced_persistent_volume_claim')
+    def test_create_pvc_clone_resources(self, mock_read_pvc, mock_create_pvc, mock_list_pvc, mock_watch):
+        """Test PVC clones are created together, then waited for with a single watch"""
+        def pvc(name, phase):
+            resource = Mock(status=Mock(phase=phase), metadata=Mock(resource_version='2'))
+            resource.metadata.name = name
+            return resource
+        source = Mock()
+        source.spec.resources.requests = {'storage': '1Gi'}
+        mock_read_pvc.return_value = source
+        mock_list_pvc.return_value = Mock(items=[pvc('clone-1', 'Bound'), pvc('clone-2', 'Pending')],
+                                          metadata=Mock(resource_version='1'))
+        mock_watch.return_value.stream.return_value = iter([{'type': 'MODIFIED', 'object': pvc('other', 'Bound')},
+                                                            {'type': 'MODIFIED', 'object': pvc('clone-2', 'Bound')}])
+        statuses = self.kube_api.create_pvc_clone_resources([('clone-1', 'src-1'), ('clone-2', 'src-2')], workers=2)
+        self.assertEqual([(status['name'], status['code']) for status in statuses],
+                         [('clone-1', 201), ('clone-2', 201)])
+        self.assertEqual(mock_create_pvc.call_count, 2)
+        mock_list_pvc.assert_not_called()
+        self.kube_api.wait_for_pvc_clones(statuses, timeout=5)
+        self.assertEqual([status['bound'] for status in statuses], [True, True])
+        mock_list_pvc.assert_called_once_with('12345')
+        mock_watch.return_value.stream.assert_called_once()
+        mock_watch.return_value.stop.assert_called_once_with()
+
+    @patch('web_service.kub.informer.watch.Watch')
+    def test_informer_applies_watch_events(self, mock_watch):
+        """Test informer keeps an in-memory copy from list + watch and honours the staleness bound"""
+        def named(name):
+            resource = Mock(metadata=Mock(resource_version='2'))
+            resource.metadata.name = name
+            return resource
+        pvc_a, pvc_b, pvc_c = named('pvc-a'), named('pvc-b'), named('pvc-c')
+        list_method = Mock(__name__='list_namespaced_persistent_volume_claim',
+                           return_value=Mock(items=[pvc_a, pvc_b], metadata=Mock(resource_version='1')))
+        informer = Informer(list_method, ('12345',), staleness=30)
+
+        def stream(*args, **kwargs):
+            informer.stop()
+            return iter([{'type': 'DELETED', 'object': pvc_a}, {'type': 'ADDED', 'object': pvc_c}])
+        mock_watch.return_value.stream.side_effect = stream
+        self.assertIsNone(informer.get('pvc-a'))
+        informer._watch(informer._relist())
+        self.assertIsNone(informer.get('pvc-a'))
+        self.assertIs(informer.get('pvc-b'), pvc_b)
+        self.assertIs(informer.get('pvc-c'), pvc_c)
+        mock_watch.return_value.stream.assert_called_once_with(list_method, '12345',
+                                                               resource_version='1', timeout_seconds=15)
+        informer._synced_at -= 31
+        self.assertIsNone(informer.get('pvc-b'))
+        self.assertIsNone(informer.list())
+
+    @patch('kubernetes.client.CoreV1Api.list_node')
+    def test_get_worker_node_skips_not_ready(self, mock_list_node):
+        """Test worker node addresses are memoized and exclude NotReady and master nodes"""
+        def node(name, ip, ready=True, labels=None):
+            item = Mock(metadata=Mock(labels=labels or {}),
+                        status=Mock(addresses=[Mock(type='InternalIP', address=ip)],
+                                    conditions=[Mock(type='Ready', status='True' if ready else 'False')]))
+            item.metadata.name = name
+            item.spec.unschedulable = None
+            return item
+        nodes = [node('master', '10.0.0.1', labels={'node-role.kubernetes.io/master': ''}),
+                 node('worker-1', '10.0.0.2', ready=False),
+                 node('worker-2', '10.0.0.3'),
+                 node('worker-3', '10.0.0.4')]
+        mock_list_node.return_value = Mock(items=nodes)
+        with patch.object(self.kube_api, '_node_addresses', None), \
+                patch.object(self.kube_api, 'node_strategy', 'round-robin'):
+            picked = [self.kube_api.get_worker_node() for _ in range(4)]
+        self.assertEqual(sorted(picked), ['10.0.0.3', '10.0.0.3', '10.0.0.4', '10.0.0.4'])
+        mock_list_node.assert_called_once_with(label_selector='')
+
+    @patch('kubernetes.client.CoreV1Api.list_node')
+    def test_get_worker_node_label_strategy(self, mock_list_node):
+        """Test the node selector only applies with the label strategy"""
+        mock_list_node.return_value = Mock(items=[])
+        with patch.object(self.kube_api, '_node_addresses', None), \
+                patch.object(self.kube_api, 'node_selector', 'role=build'):
+            self.kube_api.get_worker_node()
+            mock_list_node.assert_called_once_with(label_selector='')
+            mock_list_node.reset_mock()
+            self.kube_api._node_addresses = None
+            with patch.object(self.kube_api, 'node_strategy', 'label'):
+                self.kube_api.get_worker_node()
+            mock_list_node.assert_called_once_with(label_selector='role=build')
+
+    def test_match_labels(self):
+        """Test equality based label selectors"""
+        labels = {'role': 'build', 'zone': 'a'}
+        self.assertTrue(self.kube_api.match_labels(labels, 'role=build,zone!=b,!gpu'))
+        self.assertFalse(self.kube_api.match_labels(labels, 'role=build,gpu'))
+        self.assertFalse(self.kube_api.match_labels(labels, 'zone!=a'))
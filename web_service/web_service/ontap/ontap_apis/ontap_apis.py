@@ -26,9 +26,18 @@ NetApp-Jenkins Integration Scripts
  permission is obtained from NetApp, Inc.
 """
 import base64
+import heapq
+import itertools
 import logging
+import random
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import threading
 import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 import argparse
 import sys
@@ -39,6 +48,30 @@ requests.packages.urllib3.disable_warnings()    # pylint: disable=no-member
 
 # time for a job to complete ?
 TIMEOUT = 60
+# job status polls start JOB_POLL_INTERVAL seconds apart and back off exponentially up to JOB_POLL_MAX_INTERVAL
+JOB_POLL_INTERVAL = 0.5
+JOB_POLL_MAX_INTERVAL = 8
+
+# seconds a resolved aggregate, svm, export policy or volume key is reused
+KEY_CACHE_TTL = 300
+
+# connections kept open to the NSLM server, shared by all APIServer objects for that server
+# defaults of APIServer.configure(), the web service reads them from its app config
+POOL_SIZE = 10
+# retries for failed connections and for GET requests answered with a transient error
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5
+RETRY_STATUS_CODES = (502, 503, 504)
+
+# NSLM requests are admitted by priority, lower values first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_PURGE = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_PURGE: 'purge'}
+# requests in flight and sustained requests per second to a NSLM server, over all priorities
+# defaults of APIServer.configure(), requests in flight are capped to the configured pool size unless set
+MAX_CONCURRENT_REQUESTS = POOL_SIZE
+REQUEST_RATE = 20
+REQUEST_BURST = 40
 
 # utility functions
 
@@ -82,6 +115,211 @@ def check_job_status(response):
     return request_status, error_message
 
 
+class KeyCache(object):
+    """
+    uuids of ONTAP objects resolved by name, kept for ttl seconds
+    one cache is shared by all APIServer objects using the same NSLM server and user
+    """
+    _caches = dict()
+    _caches_lock = threading.Lock()
+
+    def __init__(self, ttl=KEY_CACHE_TTL):
+        self.ttl = ttl
+        self._keys = dict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_server(cls, base_url, apiuser, ttl=KEY_CACHE_TTL):
+        """ get the key cache shared for a NSLM server and user """
+        with cls._caches_lock:
+            cache = cls._caches.get((base_url, apiuser))
+            if cache is None:
+                cache = cls._caches[(base_url, apiuser)] = cls(ttl)
+            return cache
+
+    def get(self, kind, name):
+        """ get key for object of given kind and name, None if unknown or expired """
+        with self._lock:
+            entry = self._keys.get((kind, name))
+            if entry is None:
+                return None
+            key, stored = entry
+            if time.time() - stored > self.ttl:
+                del self._keys[(kind, name)]
+                return None
+            return key
+
+    def set(self, kind, name, key):
+        """ remember key for object of given kind and name """
+        if key is None:
+            return
+        with self._lock:
+            self._keys[(kind, name)] = key, time.time()
+
+    def update(self, kind, records):
+        """ remember keys from a list of NSLM records """
+        stored = time.time()
+        with self._lock:
+            for record in records:
+                self._keys[(kind, record['name'])] = record['key'], stored
+
+    def invalidate(self, kind, name=None):
+        """ forget one key, or all keys of a kind if name is None """
+        with self._lock:
+            if name is not None:
+                self._keys.pop((kind, name), None)
+                return
+            for cached in [cached for cached in self._keys if cached[0] == kind]:
+                del self._keys[cached]
+
+    def clear(self):
+        """ forget all keys """
+        with self._lock:
+            self._keys.clear()
+
+
+class RequestScheduler(object):
+    """
+    admit NSLM requests highest priority first, then in arrival order,
+    within a cap on requests in flight and a token bucket rate limit
+    one scheduler is shared by all APIServer objects using the same NSLM server and user
+    """
+    _schedulers = dict()
+    _schedulers_lock = threading.Lock()
+    _options = {'max_concurrent': MAX_CONCURRENT_REQUESTS, 'rate': REQUEST_RATE, 'burst': REQUEST_BURST}
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_REQUESTS, rate=REQUEST_RATE, burst=REQUEST_BURST):
+        self.max_concurrent = max_concurrent
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._refilled = time.monotonic()
+        self._running = 0
+        self._queue = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._requests = defaultdict(int)
+        self._wait_total = defaultdict(float)
+        self._wait_max = defaultdict(float)
+        self._max_depth = defaultdict(int)
+
+    @classmethod
+    def for_server(cls, base_url, apiuser):
+        """ get the request scheduler shared for a NSLM server and user """
+        with cls._schedulers_lock:
+            scheduler = cls._schedulers.get((base_url, apiuser))
+            if scheduler is None:
+                scheduler = cls._schedulers[(base_url, apiuser)] = cls(**cls._options)
+            return scheduler
+
+    @classmethod
+    def configure(cls, max_concurrent=None, rate=None, burst=None):
+        """ set the limits of schedulers created afterwards, None keeps the current value """
+        options = {'max_concurrent': max_concurrent, 'rate': rate, 'burst': burst}
+        with cls._schedulers_lock:
+            cls._options = dict(cls._options, **{name: value for name, value in options.items() if value is not None})
+
+    @classmethod
+    def servers(cls):
+        """ get the request schedulers of this process, dict 'user@NSLM base url' -> scheduler """
+        with cls._schedulers_lock:
+            return {'%s@%s' % (apiuser, base_url): scheduler
+                    for (base_url, apiuser), scheduler in cls._schedulers.items()}
+
+    def acquire(self, priority):
+        """ block until a request of given priority may be sent, returns seconds waited """
+        entry = (priority, next(self._sequence))
+        queued = time.monotonic()
+        with self._condition:
+            heapq.heappush(self._queue, entry)
+            self._max_depth[priority] = max(self._max_depth[priority], self._depth(priority))
+            while True:
+                timeout = None
+                if self._queue[0] == entry and self._running < self.max_concurrent:
+                    self._refill()
+                    if self._tokens >= 1:
+                        break
+                    timeout = (1 - self._tokens) / self.rate
+                self._condition.wait(timeout)
+            heapq.heappop(self._queue)
+            self._tokens -= 1
+            self._running += 1
+            waited = time.monotonic() - queued
+            self._requests[priority] += 1
+            self._wait_total[priority] += waited
+            self._wait_max[priority] = max(self._wait_max[priority], waited)
+            # the next request in line may be admitted as well
+            self._condition.notify_all()
+        return waited
+
+    def release(self):
+        """ end of a request admitted by acquire """
+        with self._condition:
+            self._running -= 1
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self, priority):
+        """ send a request of given priority within the with block """
+        self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def metrics(self):
+        """ queue depth, requests sent and wait times in seconds per priority """
+        with self._condition:
+            priorities = {}
+            for priority, name in PRIORITY_NAMES.items():
+                requests_sent = self._requests[priority]
+                priorities[name] = {
+                    'queue_depth': self._depth(priority),
+                    'max_queue_depth': self._max_depth[priority],
+                    'requests': requests_sent,
+                    'wait_avg': self._wait_total[priority] / requests_sent if requests_sent else 0,
+                    'wait_max': self._wait_max[priority],
+                }
+            return {'running': self._running, 'max_concurrent': self.max_concurrent, 'rate': self.rate,
+                    'burst': self.burst, 'priorities': priorities}
+
+    def _depth(self, priority):
+        return sum(1 for queued in self._queue if queued[0] == priority)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+
+class ScheduledSession(object):
+    """ http session sending every request through a request scheduler at one priority """
+
+    def __init__(self, session, scheduler, priority):
+        self.session = session
+        self.scheduler = scheduler
+        self.priority = priority
+
+    def request(self, method, url, **kwargs):
+        with self.scheduler.slot(self.priority):
+            return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+
 class Aggregate(object):
     """ ONTAP aggregate to support volume creation """
 
@@ -93,11 +331,7 @@ class Aggregate(object):
 
     def get_key_aggr(self):
         """ get uuid for an aggregate """
-        tmp = dict(self.api_server.get_aggrs())
-        aggrs = tmp['result']['records']
-        for i in aggrs:
-            if i['name'] == self.aggr_name:
-                return i['key']
+        return self.api_server.get_key_aggr(self.aggr_name)
 
     def get_volume(self, vol_name):
         """ get specified volume in aggregate """
@@ -105,7 +339,7 @@ class Aggregate(object):
         url = self.api_server.get_url("ontap/aggregates/{}/volumes?name={}".format(self.get_key_aggr(), vol_name))
         headers = self.api_server.get_headers()
 
-        response = requests.get(url, headers=headers, verify=False)
+        response = self.api_server.session.get(url, headers=headers, verify=False)
         if check_http_response(response, 200):
             return response.json()
         return []
@@ -114,11 +348,15 @@ class Aggregate(object):
         """ get all volumes for aggregate """
         url = self.api_server.get_url("ontap/aggregates/{}/volumes/".format(self.get_key_aggr()))
         headers = self.api_server.get_headers()
-        response = requests.get(url, headers=headers, verify=False)
+        response = self.api_server.session.get(url, headers=headers, verify=False)
         if check_http_response(response, 200):
             return response.json()
         return []
 
+    def get_snapshots(self):
+        """ get all snapshots of the svm of the aggregate """
+        return self.api_server.get_snapshots(svm_key=self.api_server.get_key_svm(self.svm_name))
+
     def check_vol_junction(self, vol_name, junction_name):
         """ verify junction exists for a volume """
         tmp = dict(self.get_volume(vol_name))
@@ -141,10 +379,16 @@ class Volume(object):
 
     def get_key_vol(self):
         """ get uuid for a volume """
+        keys = self.aggregate.api_server.keys
+        cache_name = (self.aggregate.aggr_name, self.volume_name)
+        volume_key = keys.get('volume', cache_name)
+        if volume_key is not None:
+            return volume_key
         tmp = dict(self.aggregate.get_volume(self.volume_name))
         vols = tmp['result']['records']
         for i in vols:
             if i['name'] == self.volume_name:
+                keys.set('volume', cache_name, i['key'])
                 return i['key']
 
     def check_vol(self):
@@ -190,7 +434,7 @@ class Volume(object):
         url = self.aggregate.api_server.get_url("ontap/volumes/{}".format(vol_key))
         headers = self.aggregate.api_server.get_headers()
 
-        response = requests.get(url, headers=headers, verify=False)
+        response = self.aggregate.api_server.session.get(url, headers=headers, verify=False)
         if check_http_response(response, 200):
             response_dict = response.json()
             return {
@@ -211,7 +455,7 @@ class Volume(object):
         url = self.aggregate.api_server.get_url("ontap/snapshots?volume_key={}".format(volume_key))
         headers = self.aggregate.api_server.get_headers()
 
-        response = requests.get(url, headers=headers, verify=False)
+        response = self.aggregate.api_server.session.get(url, headers=headers, verify=False)
         if check_http_response(response, 200):
             return response.json(), ""
         return [], "Error 111"
@@ -261,22 +505,14 @@ class Volume(object):
             return [], error_message
         base_snapshot_key, error_message = self.get_key_snapshot(base)
         previous_snapshot_key, error_message = self.get_key_snapshot(previous)
-        url = self.aggregate.api_server.get_url("ontap/snapshots/{}/files?base_snapshot_key={}".format(
-            base_snapshot_key, previous_snapshot_key))
-        headers = self.aggregate.api_server.get_headers()
-
-        response = requests.get(url, headers=headers, verify=False)
-        if check_http_response(response, 200):
-            tmp = dict(response.json())
-            return tmp["result"]["total_records"]
-        # TODO: handle error
+        return self.aggregate.api_server.get_snapdiff(base_snapshot_key, previous_snapshot_key)
 
     def get_clones(self):
         """ get all clones associated with this volume """
         url = self.aggregate.api_server.get_url(
             "ontap/volumes?clone_parent_key={}".format(self.get_key_vol()))
         headers = self.aggregate.api_server.get_headers()
-        response = requests.get(url, headers=headers, verify=False)
+        response = self.aggregate.api_server.session.get(url, headers=headers, verify=False)
         if check_http_response(response, 200):
             return response.json()
         return []
@@ -332,7 +568,7 @@ class Volume(object):
             "is_snap_dir_access_enabled": "False",
             "export_policy_key": self.aggregate.api_server.get_key_export_policy(export_policy)
         }
-        response = requests.post(url, headers=headers, json=data, verify=False)
+        response = self.aggregate.api_server.session.post(url, headers=headers, json=data, verify=False)
         if check_http_response(response, 202):
             job_url = response.headers['Location']
             return self.aggregate.api_server.get_job_status(job_url)
@@ -349,7 +585,7 @@ class Volume(object):
             "volume_key": self.get_key_vol(),
             "name": snapshot_name,
         }
-        response = requests.post(url, headers=headers, json=data, verify=False)
+        response = self.aggregate.api_server.session.post(url, headers=headers, json=data, verify=False)
         if check_http_response(response, 202):
             job_url = response.headers['Location']
             snapshot = Volume(snapshot_name, self.aggregate)
@@ -375,7 +611,7 @@ class Volume(object):
             "security_group_id": users['gid']
         }
 
-        response = requests.post(url, headers=headers, json=data, verify=False)
+        response = self.aggregate.api_server.session.post(url, headers=headers, json=data, verify=False)
         if check_http_response(response, 202):
             job_url = response.headers['Location']
             clone = Volume(clone_name, self.aggregate)
@@ -395,7 +631,7 @@ class Volume(object):
             "security_group_id": users['gid']
         }
 
-        response = requests.post(url, headers=headers, json=data, verify=False)
+        response = self.aggregate.api_server.session.post(url, headers=headers, json=data, verify=False)
         if check_http_response(response, 202):
             job_url = response.headers['Location']
             clone = Volume(clone_name, self.aggregate)
@@ -413,7 +649,7 @@ class Volume(object):
             "junction_path": junction_name
         }
 
-        response = requests.post(url, headers=headers, json=data, verify=False)
+        response = self.aggregate.api_server.session.post(url, headers=headers, json=data, verify=False)
         if check_http_response(response, 202):
             job_url = response.headers['Location']
             return self.aggregate.api_server.get_job_status(job_url) + (junction_name,)
@@ -428,7 +664,7 @@ class Volume(object):
         data = {
             "force": True
         }
-        response = requests.post(url, headers=headers, json=data, verify=False)
+        response = self.aggregate.api_server.session.post(url, headers=headers, json=data, verify=False)
         if check_http_response(response, 202):
             job_url = response.headers['Location']
             return self.aggregate.api_server.get_job_status(job_url)
@@ -443,7 +679,7 @@ class Volume(object):
         data = {
             "state": "online"
         }
-        response = requests.put(url, headers=headers, json=data, verify=False)
+        response = self.aggregate.api_server.session.put(url, headers=headers, json=data, verify=False)
         if check_http_response(response, 202):
             job_url = response.headers['Location']
             return self.aggregate.api_server.get_job_status(job_url)
@@ -458,7 +694,7 @@ class Volume(object):
         data = {
             "state": "offline"
         }
-        response = requests.put(url, headers=headers, json=data, verify=False)
+        response = self.aggregate.api_server.session.put(url, headers=headers, json=data, verify=False)
         if check_http_response(response, 202):
             job_url = response.headers['Location']
             return self.aggregate.api_server.get_job_status(job_url)
@@ -471,10 +707,13 @@ class Volume(object):
         url = self.aggregate.api_server.get_url("ontap/volumes/{}".format(volume_key))
         headers = self.aggregate.api_server.get_headers()
 
-        response = requests.delete(url, headers=headers, verify=False)
+        response = self.aggregate.api_server.session.delete(url, headers=headers, verify=False)
         if check_http_response(response, 202):
             job_url = response.headers['Location']
-            return self.aggregate.api_server.get_job_status(job_url)
+            status, error_message = self.aggregate.api_server.get_job_status(job_url)
+            if status == "COMPLETED":
+                self.aggregate.api_server.keys.invalidate('volume', (self.aggregate.aggr_name, self.volume_name))
+            return status, error_message
         error_message = str(response.json()['status']['error']['reason']) or ""
         return "ERROR: HTTP status_code = %s" % response.status_code, error_message
 
@@ -523,17 +762,49 @@ class Volume(object):
         url = self.aggregate.api_server.get_url("ontap/snapshots/{}".format(snapshot_key))
         headers = self.aggregate.api_server.get_headers()
 
-        response = requests.delete(url, headers=headers, verify=False)
+        response = self.aggregate.api_server.session.delete(url, headers=headers, verify=False)
         if check_http_response(response, 202):
             job_url = response.headers['Location']
             return self.aggregate.api_server.get_job_status(job_url)
         error_message = str(response.json()['status']['error']['reason']) or ""
         return "ERROR: HTTP status_code = %s" % response.status_code, error_message
 
+    def delete_snapshots(self, snapshot_names, workers=1, timeout=TIMEOUT):
+        """
+        delete several snapshots: snapshot keys are resolved with one listing,
+        delete requests are sent by up to workers threads and all delete jobs are waited for at once
+        returns dict snapshot name -> (status, error_message)
+        """
+        data, error_message = self.get_snapshots()
+        if not data:
+            return {name: ("ERROR: cannot get snapshot key", error_message) for name in snapshot_names}
+        snapshot_keys = {snap['name']: snap['key'] for snap in dict(data)['result']['records']}
+
+        def start_delete(snapshot_name):
+            """ returns job url, or (status, error_message) if the job could not be started """
+            if snapshot_name not in snapshot_keys:
+                return "ERROR: cannot get snapshot key", "cannot find snapshot: %s" % snapshot_name
+            url = self.aggregate.api_server.get_url("ontap/snapshots/{}".format(snapshot_keys[snapshot_name]))
+            try:
+                response = self.aggregate.api_server.session.delete(
+                    url, headers=self.aggregate.api_server.get_headers(), verify=False)
+                if check_http_response(response, 202):
+                    return response.headers['Location']
+            except IOError as exc:
+                return "ERROR: %s" % exc, ""
+            error_message = str(response.json()['status']['error']['reason']) or ""
+            return "ERROR: HTTP status_code = %s" % response.status_code, error_message
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            started = dict(zip(snapshot_names, executor.map(start_delete, snapshot_names)))
+        job_urls = [job for job in started.values() if not isinstance(job, tuple)]
+        jobs = self.aggregate.api_server.wait_for_jobs(job_urls, timeout)
+        return {name: job if isinstance(job, tuple) else jobs[job] for name, job in started.items()}
+
     def get_all_storage_service_levels(self):
         url = self.aggregate.api_server.get_url("slo/storage-service-levels/", version="1.0")
         headers = self.aggregate.api_server.get_headers()
-        response = requests.get(url, headers=headers, verify=False)
+        response = self.aggregate.api_server.session.get(url, headers=headers, verify=False)
         if check_http_response(response, 200):
             return response.json()
         return []
@@ -548,7 +819,7 @@ class Volume(object):
     def get_all_file_shares(self):
         url = self.aggregate.api_server.get_url("slo/file-shares/", version="1.0")
         headers = self.aggregate.api_server.get_headers()
-        response = requests.get(url, headers=headers, verify=False)
+        response = self.aggregate.api_server.session.get(url, headers=headers, verify=False)
         if check_http_response(response, 200):
             return response.json()
         return []
@@ -569,7 +840,7 @@ class Volume(object):
             "storage_service_level_key": ssl_key
         }
         headers = self.aggregate.api_server.get_headers()
-        response = requests.put(url, headers=headers, json=data, verify=False)
+        response = self.aggregate.api_server.session.put(url, headers=headers, json=data, verify=False)
         if check_http_response(response, 200):
             return response.json()
         return []
@@ -577,20 +848,77 @@ class Volume(object):
 
 class APIServer(object):
     """ python wrappers around ONTAP API services (NSLM) """
-
-    def __init__(self, api, apiuser, apipass, debug=False):
-        """ collect global values for API authentication """
+    _sessions = dict()
+    _sessions_lock = threading.Lock()
+    _session_options = {'pool_size': POOL_SIZE, 'retries': MAX_RETRIES, 'backoff_factor': BACKOFF_FACTOR,
+                        'retry_status_codes': RETRY_STATUS_CODES}
+
+    def __init__(self, api, apiuser, apipass, debug=False,
+                 pool_size=None, retries=None, backoff_factor=None, keep_alive=True,
+                 priority=PRIORITY_INTERACTIVE):
+        """
+        collect global values for API authentication, requests are sent at the given priority
+        pool_size, retries and backoff_factor default to the values set with configure()
+        """
         self.api = api
         self.apiuser = apiuser
         self.apipass = apipass
         self.debug = debug
         self.base_url = "https://{}/api".format(self.api)
+        self.keys = KeyCache.for_server(self.base_url, self.apiuser)
+        self.priority = priority
+        self.scheduler = RequestScheduler.for_server(self.base_url, self.apiuser)
+        self.session = self.get_session(pool_size, retries, backoff_factor, keep_alive)
+        self.headers = {
+            "Authorization": "Basic %s" % self.get_base_auth(),
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+        }
+
+    @classmethod
+    def configure(cls, pool_size=None, retries=None, backoff_factor=None, retry_status_codes=None,
+                  max_concurrent_requests=None, request_rate=None, request_burst=None):
+        """
+        set the pool size, retry policy and request limits of sessions created afterwards,
+        None keeps the current value, requests in flight are capped to pool_size unless max_concurrent_requests is set
+        """
+        options = {'pool_size': pool_size, 'retries': retries, 'backoff_factor': backoff_factor,
+                   'retry_status_codes': retry_status_codes}
+        with cls._sessions_lock:
+            cls._session_options = dict(cls._session_options,
+                                        **{name: value for name, value in options.items() if value is not None})
+        RequestScheduler.configure(max_concurrent=max_concurrent_requests or pool_size, rate=request_rate,
+                                   burst=request_burst)
+
+    def get_session(self, pool_size, retries, backoff_factor, keep_alive):
+        """ get the pooled http session shared for a NSLM server, user and request priority """
+        with APIServer._sessions_lock:
+            session = APIServer._sessions.get((self.base_url, self.apiuser, self.priority))
+            if session is not None:
+                return session
+            session = APIServer._sessions.get((self.base_url, self.apiuser))
+            if session is None:
+                options = APIServer._session_options
+                pool_size = options['pool_size'] if pool_size is None else pool_size
+                retries = options['retries'] if retries is None else retries
+                backoff_factor = options['backoff_factor'] if backoff_factor is None else backoff_factor
+                session = requests.Session()
+                # POST requests start jobs, only retry them if the connection could not be made
+                retry = Retry(total=retries, backoff_factor=backoff_factor,
+                              status_forcelist=options['retry_status_codes'],
+                              allowed_methods=frozenset(['GET']), raise_on_status=False)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+                session.mount("https://", adapter)
+                if not keep_alive:
+                    session.headers["Connection"] = "close"
+                APIServer._sessions[(self.base_url, self.apiuser)] = session
+            session = ScheduledSession(session, self.scheduler, self.priority)
+            APIServer._sessions[(self.base_url, self.apiuser, self.priority)] = session
+            return session
 
     def get_base_auth(self):
         """ get base authentication from credentials """
-        # for compatibility with python2.7
-        return base64.encodestring(('%s:%s' % (self.apiuser, self.apipass))  # pylint: disable=deprecated-method
-                                   .encode()).decode().replace('\n', '')
+        return base64.b64encode(('%s:%s' % (self.apiuser, self.apipass)).encode()).decode()
 
     def get_url(self, url, version="2.0"):  # use version = "5.0" if using with APIServices 2.0.
         """ build url using common prefix """
@@ -598,18 +926,13 @@ class APIServer(object):
 
     def get_headers(self):
         """ http header for get and post request """
-        headers = {
-            "Authorization": "Basic %s" % self.get_base_auth(),
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        }
-        return headers
+        return dict(self.headers)
 
     def get_aggrs(self):
         """ get list of all aggregates """
         url = self.get_url("ontap/aggregates")
         headers = self.get_headers()
-        response = requests.get(url, headers=headers, verify=False)
+        response = self.session.get(url, headers=headers, verify=False)
         if check_http_response(response, 200):
             return response.json()
         return []
@@ -619,7 +942,7 @@ class APIServer(object):
         url = self.get_url("ontap/storage-vms/")
         headers = self.get_headers()
 
-        response = requests.get(url, headers=headers, verify=False)
+        response = self.session.get(url, headers=headers, verify=False)
         if check_http_response(response, 200):
             return response.json()
         return []
@@ -628,55 +951,107 @@ class APIServer(object):
         """ get list of all export policies"""
         url = self.get_url("ontap/export-policies/")
         headers = self.get_headers()
-        response = requests.get(url, headers=headers, verify=False)
+        response = self.session.get(url, headers=headers, verify=False)
+        if check_http_response(response, 200):
+            return response.json()
+        return []
+
+    def get_snapshots(self, svm_key=None):
+        """ get list of all snapshots, for all volumes or for the volumes of one svm """
+        url = self.get_url("ontap/snapshots")
+        if svm_key is not None:
+            url += "?storage_vm_key={}".format(svm_key)
+        headers = self.get_headers()
+        response = self.session.get(url, headers=headers, verify=False)
         if check_http_response(response, 200):
             return response.json()
         return []
 
+    def get_snapdiff(self, snapshot_key, base_snapshot_key):
+        """
+            get number of file differences between two snapshots
+            returns None on error
+        """
+        url = self.get_url("ontap/snapshots/{}/files?base_snapshot_key={}".format(snapshot_key, base_snapshot_key))
+        headers = self.get_headers()
+        response = self.session.get(url, headers=headers, verify=False)
+        if check_http_response(response, 200):
+            tmp = dict(response.json())
+            return tmp["result"]["total_records"]
+        # TODO: handle error
+
     def get_svm_aggregate_relationships(self):
         """ get list of all svms/aggregate relationships """
         url = self.get_url("ontap/storage-vm-aggregate-relationships/")
         headers = self.get_headers()
 
-        response = requests.get(url, headers=headers, verify=False)
+        response = self.session.get(url, headers=headers, verify=False)
         if check_http_response(response, 200):
             return response.json()
         return []
 
+    def get_key(self, kind, name, list_records):
+        """ get uuid for an object by name, listing all objects of its kind on a cache miss """
+        key = self.keys.get(kind, name)
+        if key is None:
+            tmp = dict(list_records())
+            self.keys.update(kind, tmp['result']['records'])
+            key = self.keys.get(kind, name)
+        return key
+
+    def get_key_aggr(self, aggr_name):
+        """ get uuid for an aggregate """
+        return self.get_key('aggregate', aggr_name, self.get_aggrs)
+
     def get_key_svm(self, svm_name):
         """ get uuid for a svm """
-        tmp = dict(self.get_svms())
-        svms = tmp['result']['records']
-        for i in svms:
-            if i['name'] == svm_name:
-                return i['key']
+        return self.get_key('svm', svm_name, self.get_svms)
 
     def get_key_export_policy(self, export_policy_name):
         """ get uuid for a export policy """
-        tmp = dict(self.get_export_policies())
-        policies = tmp['result']['records']
-        for i in policies:
-            if i['name'] == export_policy_name:
-                return i['key']
+        return self.get_key('export_policy', export_policy_name, self.get_export_policies)
 
-    def get_job_status(self, url):
+    def get_job_status(self, url, timeout=TIMEOUT):
         """ verify job status and wait for job to complete """
-        error_message = ""
-        headers = self.get_headers()
-        retry = TIMEOUT
-        while retry > 0:
-            response = requests.get(url, headers=headers, verify=False)
+        return self.wait_for_jobs([url], timeout)[url]
+
+    def wait_for_jobs(self, urls, timeout=TIMEOUT):
+        """
+        wait for jobs to complete, polling all outstanding jobs in one loop
+        polls back off exponentially with jitter until the jobs complete or timeout seconds have passed
+        returns dict job url -> (request_status, error_message)
+        """
+        deadline = time.time() + timeout
+        results = dict()
+        pending = list(dict.fromkeys(urls))
+        interval = JOB_POLL_INTERVAL
+        while pending:
+            for url in list(pending):
+                request_status, error_message, finished = self.poll_job(url)
+                results[url] = request_status, error_message
+                if finished:
+                    pending.remove(url)
+            remaining = deadline - time.time()
+            if not pending:
+                break
+            if remaining <= 0:
+                logging.error("timeout, waiting %s seconds for %s job(s) to complete", timeout, len(pending))
+                break
+            time.sleep(min(remaining, interval * random.uniform(0.5, 1.5)))
+            interval = min(interval * 2, JOB_POLL_MAX_INTERVAL)
+        return results
+
+    def poll_job(self, url):
+        """ get job status once, returns request_status, error_message and whether the job is finished """
+        try:
+            response = self.session.get(url, headers=self.get_headers(), verify=False)
             if check_http_response(response, 200):
                 request_status, error_message = check_job_status(response.json())
-                if request_status != "STARTED":
-                    break
-                retry -= 1
-                time.sleep(1)
-            else:
-                request_status = "ERROR: HTTP status_code = %s" % response.status_code
-        else:
-            logging.error("timeout, waiting %s seconds for job to complete", TIMEOUT)
-        return request_status, error_message
+                return request_status, error_message, request_status != "STARTED"
+        except (IOError, ValueError) as exc:
+            return "ERROR: %s" % exc, "", True
+        # transient http error, keep polling
+        return "ERROR: HTTP status_code = %s" % response.status_code, "", False
 
     def attach_cluster(self, ip_address, ontap_username, ontap_password):
         """ attach NSLM to an ONTAP cluster (a storage system) """
@@ -710,7 +1085,7 @@ class APIServer(object):
                 ]
             }
         ]
-        response = requests.post(url, headers=headers, json=data, verify=False)
+        response = self.session.post(url, headers=headers, json=data, verify=False)
         if check_http_response(response, 202):
             return "COMPLETED", ""
         if check_http_response(response, 400) and response.json()['status']['error']['errno'] == 2004:
@@ -3,8 +3,10 @@ Ontap Service to act as interfact between Service server and Ontap API,
 located at prohibition_service/ontap_apis/ontap_apis.py.
 """
 import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from web_service.ontap.ontap_apis.ontap_apis import Aggregate, APIServer, Volume
+from web_service.ontap.ontap_apis.ontap_apis import Aggregate, APIServer, Volume, PRIORITY_INTERACTIVE
 
 # BASEDIR = os.path.dirname(os.path.realpath(__file__))
 # sys.path.insert(0, os.path.dirname(BASEDIR))
@@ -13,14 +15,20 @@ from web_service.ontap.ontap_apis.ontap_apis import Aggregate, APIServer, Volume
 
 class OntapService(object):
     """ontap service class"""
-    def __init__(self, api, apiuser, apipass, svm_name, aggr_name, data_ip):
+    # activity verdicts for volumes scanned by find_inactive_volumes
+    ACTIVE = 'active'
+    INACTIVE = 'inactive'
+    MISSING = 'missing'
+    UNKNOWN = 'unknown'
+
+    def __init__(self, api, apiuser, apipass, svm_name, aggr_name, data_ip, priority=PRIORITY_INTERACTIVE):
         self.api = api
         self.apiuser = apiuser
         self.apipass = apipass
         self.svm_name = svm_name
         self.aggr_name = aggr_name
         self.data_ip = data_ip
-        self.api_server = APIServer(api, apiuser, apipass)
+        self.api_server = APIServer(api, apiuser, apipass, priority=priority)
         self.aggregate = Aggregate(svm_name, aggr_name, self.api_server)
 
     def attach_cluster(self, ip_address, ontap_username, ontap_password):
@@ -171,6 +179,16 @@ class OntapService(object):
         if len(snapshots) < 2:
             logging.info("Workspace %s is less than %s days old", volume_name, days)
             return None, None, None
+        return self.select_snapshots_to_compare(snapshots, days) + (None,)
+
+    @staticmethod
+    def select_snapshots_to_compare(snapshots, days):
+        """
+            Select the most recent snapshot and the most recent snapshot older than #days
+            Returns: most_recent_snapshot, N_days_old_snapshot (None if there is none)
+        """
+        if len(snapshots) < 2:
+            return None, None
         # sort by timestamp: recent first, oldest last
         sorted_by_timestamp = sorted(snapshots, key=lambda snap: snap['timestamp'], reverse=True)
         most_recent_snapshot = sorted_by_timestamp[0]
@@ -182,7 +200,63 @@ class OntapService(object):
             if delta.days > days:
                 oldest_snapshot = snap
                 break
-        return most_recent_snapshot, oldest_snapshot, None
+        return most_recent_snapshot, oldest_snapshot
+
+    def find_inactive_volumes(self, volume_days, workers=1):
+        """
+            Find volumes without file changes over their number of days
+            Returns: dict volume name -> ACTIVE, INACTIVE, MISSING (not in ONTAP) or UNKNOWN (too young or error)
+        """
+        return {name: verdict for name, (verdict, _) in self.scan_volume_activity(volume_days, workers).items()}
+
+    def scan_volume_activity(self, volume_days, workers=1):
+        """
+            Compare the latest snapshot of volumes with their N days old snapshot
+            Volumes of the aggregate and snapshots of its svm are listed once for all volumes,
+            snapdiffs run on up to workers threads. All volumes are UNKNOWN if the listings fail
+            Returns: dict volume name -> (verdict, timestamp of the N days old snapshot or None)
+        """
+        volumes = self.aggregate.get_volumes()
+        data = self.aggregate.get_snapshots()
+        if not volumes or not data:
+            # never report volumes as missing or inactive based on a failed ONTAP listing
+            logging.error("Unable to list the volumes or snapshots of aggregate %s", self.aggr_name)
+            return {volume_name: (self.UNKNOWN, None) for volume_name in volume_days}
+        volume_keys = {volume['name']: volume['key'] for volume in dict(volumes)['result']['records']}
+        snapshots_by_volume = defaultdict(list)
+        for snap in dict(data)['result']['records']:
+            snapshots_by_volume[snap['volume_key']].append(
+                {"snapshot_name": snap['name'], "timestamp": snap['access_timestamp'], "key": snap['key']})
+        verdicts = dict()
+        snapshots_to_compare = dict()
+        for volume_name, days in volume_days.items():
+            if volume_name not in volume_keys:
+                verdicts[volume_name] = self.MISSING, None
+                continue
+            recent_snapshot, old_snapshot = self.select_snapshots_to_compare(
+                snapshots_by_volume[volume_keys[volume_name]], days)
+            if recent_snapshot is None or old_snapshot is None:
+                logging.info("Workspace %s is less than %s days old", volume_name, days)
+                verdicts[volume_name] = self.UNKNOWN, None
+                continue
+            snapshots_to_compare[volume_name] = recent_snapshot, old_snapshot
+
+        def snapdiff(volume_name):
+            recent_snapshot, old_snapshot = snapshots_to_compare[volume_name]
+            try:
+                return self.api_server.get_snapdiff(recent_snapshot['key'], old_snapshot['key'])
+            except IOError as exc:
+                logging.error("Snapdiff failed for volume %s: %s", volume_name, exc)
+                return None
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for volume_name, diff in zip(snapshots_to_compare, executor.map(snapdiff, snapshots_to_compare)):
+                old_timestamp = float(snapshots_to_compare[volume_name][1]['timestamp'])
+                if diff is None:
+                    verdicts[volume_name] = self.UNKNOWN, old_timestamp
+                else:
+                    verdicts[volume_name] = self.INACTIVE if diff == 0 else self.ACTIVE, old_timestamp
+        return verdicts
 
     def get_svm_list(self):
         """Retrieve list of svms for ONTAP cluster"""
@@ -274,21 +348,33 @@ class OntapService(object):
         """Delete a snapshot, will fail if a clone is in use"""
         volume = Volume(volume_name, self.aggregate)
         status, error_message = volume.delete_snapshot(snapshot_name)
+        return [self._snapshot_deletion_status(snapshot_name, status, error_message)]
+
+    def delete_snapshots(self, volume_name, snapshot_names, workers=1):
+        """
+        Delete several snapshots of a volume concurrently
+        Returns dict snapshot name -> snapshot status
+        """
+        volume = Volume(volume_name, self.aggregate)
+        return {snapshot_name: self._snapshot_deletion_status(snapshot_name, status, error_message)
+                for snapshot_name, (status, error_message)
+                in volume.delete_snapshots(snapshot_names, workers).items()}
+
+    def _snapshot_deletion_status(self, snapshot_name, status, error_message):
+        """Log a failed snapshot deletion and return the snapshot status"""
         if status == "COMPLETED":
-            snap_status = self.set_status(201, "Snapshot", snapshot_name)
+            return self.set_status(201, "Snapshot", snapshot_name)
+        if "has not expired or is locked" in error_message:
+            logging.warning(
+                "Failed to delete snapshot %s. Most likely clone is in use. error: %s",
+                snapshot_name, error_message
+            )
         else:
-            if "has not expired or is locked" in error_message:
-                logging.warning(
-                    "Failed to delete snapshot %s. Most likely clone is in use. error: %s",
-                    snapshot_name, error_message
-                )
-            else:
-                logging.error(
-                    "Failed to delete snapshot %s, unexpected error: %s",
-                    snapshot_name, error_message
-                )
-            snap_status = self.set_status(400, "Snapshot", snapshot_name, error_message)
-        return [snap_status]
+            logging.error(
+                "Failed to delete snapshot %s, unexpected error: %s",
+                snapshot_name, error_message
+            )
+        return self.set_status(400, "Snapshot", snapshot_name, error_message)
 
     def delete_volume(self, volume_name):
         """Delete a volume"""